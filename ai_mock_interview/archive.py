@@ -0,0 +1,157 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+import dotenv
+
+logger = logging.getLogger(__name__)
+
+dotenv.load_dotenv(override=False)
+
+AUDIO_ARCHIVE_ENABLED = os.getenv("AUDIO_ARCHIVE_ENABLED", "true").lower() in ("1", "true", "yes")
+AUDIO_ARCHIVE_DIR = os.getenv("AUDIO_ARCHIVE_DIR", "inputs")
+AUDIO_ARCHIVE_MAX_BYTES = int(os.getenv("AUDIO_ARCHIVE_MAX_BYTES", 1024 * 1024 * 1024))
+AUDIO_ARCHIVE_MAX_AGE_SECONDS = float(os.getenv("AUDIO_ARCHIVE_MAX_AGE_SECONDS", 7 * 24 * 3600))
+AUDIO_ARCHIVE_QUEUE_SIZE = int(os.getenv("AUDIO_ARCHIVE_QUEUE_SIZE", 256))
+AUDIO_ARCHIVE_BATCH_SIZE = int(os.getenv("AUDIO_ARCHIVE_BATCH_SIZE", 16))
+AUDIO_ARCHIVE_PRUNE_INTERVAL_SECONDS = float(os.getenv("AUDIO_ARCHIVE_PRUNE_INTERVAL_SECONDS", 600))
+
+
+class AudioArchive:
+    """
+    Archive of the candidates' recorded answers, written in the background.
+
+    `submit` only queues the audio, a writer task saves queued recordings in batches in a thread,
+    as `{path}/{session_id}/{content hash}.{format}`. Every `prune_interval` seconds, files older
+    than `max_age` seconds are removed, then the oldest ones until the archive holds at most
+    `max_bytes`, including the `{path}/{time}-{n}.{format}` files of earlier versions. When the
+    queue is full, recordings are dropped rather than slowing down the interview.
+    """
+
+    def __init__(
+        self,
+        path: str | Path = AUDIO_ARCHIVE_DIR,
+        enabled: bool = AUDIO_ARCHIVE_ENABLED,
+        max_bytes: int = AUDIO_ARCHIVE_MAX_BYTES,
+        max_age: float = AUDIO_ARCHIVE_MAX_AGE_SECONDS,
+        queue_size: int = AUDIO_ARCHIVE_QUEUE_SIZE,
+        batch_size: int = AUDIO_ARCHIVE_BATCH_SIZE,
+        prune_interval: float = AUDIO_ARCHIVE_PRUNE_INTERVAL_SECONDS,
+    ):
+        self.path = Path(path)
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.prune_interval = prune_interval
+        self._queue: asyncio.Queue[tuple[str, bytes, str] | None] = asyncio.Queue(maxsize=queue_size)
+        self._writer: asyncio.Task | None = None
+        # a pruned session directory could otherwise be removed while a recording is written to it.
+        self._files_lock = threading.Lock()
+
+    async def start(self):
+        if self.enabled:
+            self._writer = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Write what is still queued, then stop the writer."""
+        if self._writer is None:
+            return
+        await self._queue.put(None)
+        await self._writer
+        self._writer = None
+
+    def submit(self, session_id: str, data: bytes, format_: str):
+        if self._writer is None or not data:
+            return
+        try:
+            self._queue.put_nowait((session_id, data, format_))
+        except asyncio.QueueFull:
+            logger.warning(f"Audio archive queue is full, dropped a recording of session {session_id}.")
+
+    async def run_pruner(self):
+        """Apply the retention policy now and every `prune_interval` seconds, until cancelled."""
+        if not self.enabled:
+            return
+        while True:
+            try:
+                await asyncio.to_thread(self.prune)
+            except Exception as e:
+                logger.error(f"Audio archive pruning failed: {e}")
+            await asyncio.sleep(self.prune_interval)
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            batch = []
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self.batch_size or self._queue.empty():
+                    break
+                item = self._queue.get_nowait()
+            if batch:
+                try:
+                    await asyncio.to_thread(self._write_batch, batch)
+                except Exception as e:
+                    logger.error(f"Failed to archive {len(batch)} recording(s): {e}")
+            if item is None:
+                return
+
+    def _write_batch(self, batch: list[tuple[str, bytes, str]]):
+        with self._files_lock:
+            self._write_files(batch)
+        logger.debug(f"Archived {len(batch)} recording(s).")
+
+    def _write_files(self, batch: list[tuple[str, bytes, str]]):
+        for session_id, data, format_ in batch:
+            session_path = self.path / Path(session_id).name
+            session_path.mkdir(parents=True, exist_ok=True)
+            file = session_path / f"{hashlib.sha256(data).hexdigest()[:32]}.{format_}"
+            if file.exists():
+                continue
+            tmp_file = file.with_suffix(".tmp")
+            tmp_file.write_bytes(data)
+            os.replace(tmp_file, file)
+
+    def prune(self):
+        """Apply the retention policy."""
+        with self._files_lock:
+            self._prune()
+
+    def _prune(self):
+        if not self.path.is_dir():
+            return
+        now = time.time()
+        files = []
+        removed = 0
+        for file in [*self.path.glob("*/*"), *self.path.glob("*")]:
+            if file.is_dir():
+                continue
+            try:
+                stat = file.stat()
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.max_age:
+                file.unlink(missing_ok=True)
+                removed += 1
+            else:
+                files.append((stat.st_mtime, stat.st_size, file))
+
+        total_bytes = sum(size for _, size, _ in files)
+        files.sort()
+        for _, size, file in files:
+            if total_bytes <= self.max_bytes:
+                break
+            file.unlink(missing_ok=True)
+            total_bytes -= size
+            removed += 1
+
+        for session_path in self.path.iterdir():
+            if session_path.is_dir() and not any(session_path.iterdir()):
+                session_path.rmdir()
+        if removed:
+            logger.info(f"Removed {removed} archived recording(s), {total_bytes} bytes left.")
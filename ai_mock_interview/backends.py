@@ -0,0 +1,483 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import time
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
+
+import aiosqlite
+import dotenv
+from langchain_core.messages import BaseMessage, messages_from_dict, messages_to_dict
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+logger = logging.getLogger(__name__)
+
+dotenv.load_dotenv(override=False)
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+# messages read at once when iterating over a history, see `SessionBackend.iter_messages`.
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", 200))
+SESSION_SQLITE_PATH = os.getenv(
+    "SESSION_SQLITE_PATH", str(Path(__file__).resolve().parent.parent / "cache" / "sessions.sqlite3")
+)
+# how long a connection waits for the lock held by another worker, then how many times it tries again.
+SESSION_SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SESSION_SQLITE_BUSY_TIMEOUT_MS", 5000))
+SESSION_SQLITE_BUSY_RETRIES = int(os.getenv("SESSION_SQLITE_BUSY_RETRIES", 5))
+
+SQLITE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sessions (
+        session_id TEXT PRIMARY KEY,
+        config TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS messages (
+        session_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        message TEXT NOT NULL,
+        PRIMARY KEY (session_id, seq)
+    );
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id TEXT PRIMARY KEY,
+        session_id TEXT NOT NULL,
+        job TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS turn_reviews (
+        session_id TEXT NOT NULL,
+        turn INTEGER NOT NULL,
+        review TEXT NOT NULL,
+        PRIMARY KEY (session_id, turn)
+    );
+    CREATE TABLE IF NOT EXISTS tutor_outputs (
+        session_id TEXT NOT NULL,
+        message_index INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        content TEXT NOT NULL,
+        PRIMARY KEY (session_id, message_index, kind)
+    );
+    CREATE TABLE IF NOT EXISTS reply_audio (
+        session_id TEXT NOT NULL,
+        message_index INTEGER NOT NULL,
+        audio TEXT NOT NULL,
+        PRIMARY KEY (session_id, message_index)
+    );
+    CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at);
+    CREATE INDEX IF NOT EXISTS jobs_session_id ON jobs (session_id);
+"""
+
+T = TypeVar("T")
+
+
+class SessionBackend:
+    """
+    Storage of session configs, transcripts and LangGraph checkpoints.
+
+    A `persistent` backend is shared by all worker processes, so a session created by one worker
+    can be served by another, and dropping it from a worker's local cache doesn't lose it.
+    """
+
+    persistent = False
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @property
+    def checkpointer(self) -> BaseCheckpointSaver:
+        raise NotImplementedError
+
+    async def save_config(self, session_id: str, config: dict):
+        raise NotImplementedError
+
+    async def load_config(self, session_id: str) -> dict | None:
+        raise NotImplementedError
+
+    async def touch(self, session_id: str):
+        """Mark the session as active."""
+        raise NotImplementedError
+
+    async def append_messages(self, session_id: str, messages: list[BaseMessage]):
+        raise NotImplementedError
+
+    async def load_messages(self, session_id: str) -> list[BaseMessage]:
+        raise NotImplementedError
+
+    async def iter_messages(self, session_id: str) -> AsyncIterator[BaseMessage]:
+        """Like `load_messages`, without loading the whole history at once."""
+        for message in await self.load_messages(session_id):
+            yield message
+
+    async def save_job(self, job: dict):
+        """Save the state of a background job (see `jobs.BackgroundJobs`)."""
+        raise NotImplementedError
+
+    async def load_job(self, job_id: str) -> dict | None:
+        raise NotImplementedError
+
+    async def load_session_jobs(self, session_id: str) -> list[dict]:
+        """The jobs of a session, oldest first."""
+        raise NotImplementedError
+
+    async def save_turn_review(self, session_id: str, turn: int, review: dict):
+        """Save the review of a question/answer pair (see `evaluation.RollingEvaluator`)."""
+        raise NotImplementedError
+
+    async def load_turn_reviews(self, session_id: str) -> dict[int, dict]:
+        raise NotImplementedError
+
+    async def save_reply_audio(self, session_id: str, index: int, audio: dict):
+        """Save what the audio of an interviewer message was synthesized from (see `tts.areplay_file`)."""
+        raise NotImplementedError
+
+    async def load_reply_audio(self, session_id: str) -> dict[int, dict]:
+        raise NotImplementedError
+
+    async def save_tutor_output(self, session_id: str, index: int, kind: str, content: str):
+        """Save the tutor help (`kind` is the websocket message type) given for the answer of a turn."""
+        raise NotImplementedError
+
+    async def load_tutor_outputs(self, session_id: str) -> dict[int, dict[str, str]]:
+        raise NotImplementedError
+
+    async def delete(self, session_id: str) -> dict | None:
+        """Delete the session, its jobs, reviews, tutor outputs, audio records and checkpoints, return its config."""
+        raise NotImplementedError
+
+    async def expired(self, idle_ttl: float) -> list[str]:
+        """Ids of the sessions without activity for `idle_ttl` seconds."""
+        raise NotImplementedError
+
+
+class MemorySessionBackend(SessionBackend):
+    """Keep everything in the process memory. Only works with a single worker."""
+
+    def __init__(self):
+        self._checkpointer = InMemorySaver()
+        self._configs: dict[str, dict] = {}
+        self._messages: dict[str, list[BaseMessage]] = {}
+        self._updated_at: dict[str, float] = {}
+        self._jobs: dict[str, dict] = {}
+        self._turn_reviews: dict[str, dict[int, dict]] = {}
+        self._reply_audio: dict[str, dict[int, dict]] = {}
+        self._tutor_outputs: dict[str, dict[int, dict[str, str]]] = {}
+
+    @property
+    def checkpointer(self) -> BaseCheckpointSaver:
+        return self._checkpointer
+
+    async def save_config(self, session_id: str, config: dict):
+        self._configs[session_id] = config
+        self._updated_at[session_id] = time.time()
+
+    async def load_config(self, session_id: str) -> dict | None:
+        return self._configs.get(session_id)
+
+    async def touch(self, session_id: str):
+        if session_id in self._updated_at:
+            self._updated_at[session_id] = time.time()
+
+    async def append_messages(self, session_id: str, messages: list[BaseMessage]):
+        self._messages.setdefault(session_id, []).extend(messages)
+        self._updated_at[session_id] = time.time()
+
+    async def load_messages(self, session_id: str) -> list[BaseMessage]:
+        return list(self._messages.get(session_id, []))
+
+    async def save_job(self, job: dict):
+        self._jobs[job["job_id"]] = job
+
+    async def load_job(self, job_id: str) -> dict | None:
+        return self._jobs.get(job_id)
+
+    async def load_session_jobs(self, session_id: str) -> list[dict]:
+        return [job for job in self._jobs.values() if job["session_id"] == session_id]
+
+    async def save_turn_review(self, session_id: str, turn: int, review: dict):
+        self._turn_reviews.setdefault(session_id, {})[turn] = review
+
+    async def load_turn_reviews(self, session_id: str) -> dict[int, dict]:
+        return dict(self._turn_reviews.get(session_id, {}))
+
+    async def save_reply_audio(self, session_id: str, index: int, audio: dict):
+        self._reply_audio.setdefault(session_id, {})[index] = audio
+
+    async def load_reply_audio(self, session_id: str) -> dict[int, dict]:
+        return dict(self._reply_audio.get(session_id, {}))
+
+    async def save_tutor_output(self, session_id: str, index: int, kind: str, content: str):
+        self._tutor_outputs.setdefault(session_id, {}).setdefault(index, {})[kind] = content
+
+    async def load_tutor_outputs(self, session_id: str) -> dict[int, dict[str, str]]:
+        return {index: dict(outputs) for index, outputs in self._tutor_outputs.get(session_id, {}).items()}
+
+    async def delete(self, session_id: str) -> dict | None:
+        for job_id in [job_id for job_id, job in self._jobs.items() if job["session_id"] == session_id]:
+            del self._jobs[job_id]
+        self._turn_reviews.pop(session_id, None)
+        self._reply_audio.pop(session_id, None)
+        self._tutor_outputs.pop(session_id, None)
+        self._messages.pop(session_id, None)
+        self._updated_at.pop(session_id, None)
+        self._checkpointer.delete_thread(session_id)
+        return self._configs.pop(session_id, None)
+
+    async def expired(self, idle_ttl: float) -> list[str]:
+        deadline = time.time() - idle_ttl
+        return [session_id for session_id, updated_at in self._updated_at.items() if updated_at < deadline]
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """
+    Keep sessions in a SQLite database, shared by all worker processes on the host.
+
+    Each worker writes through a single connection, shared with the LangGraph checkpointer and guarded by its
+    lock, and reads through another one. Writes are short explicit transactions (`BEGIN IMMEDIATE`, so they take
+    the write lock up front), tried again when another worker holds the lock for longer than the busy timeout.
+
+    Note that session configs include the user's OpenAI API key, the database file and its WAL files are only
+    readable by their owner.
+    """
+
+    persistent = True
+
+    def __init__(
+        self,
+        path: str = SESSION_SQLITE_PATH,
+        busy_timeout_ms: int = SESSION_SQLITE_BUSY_TIMEOUT_MS,
+        busy_retries: int = SESSION_SQLITE_BUSY_RETRIES,
+    ):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.busy_retries = busy_retries
+        self._conn: aiosqlite.Connection | None = None
+        self._read_conn: aiosqlite.Connection | None = None
+        self._checkpointer: AsyncSqliteSaver | None = None
+
+    async def start(self):
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        # create the file readable by its owner only before anything is written to it, SQLite gives the same
+        # mode to the -wal and -shm files it creates next to it.
+        os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600))
+        self._conn = await self._connect()
+        # the workers start together, the first one to switch to WAL or create the tables holds the others up.
+        await self._retry_busy(self._conn.execute, "PRAGMA journal_mode=WAL")
+        await self._retry_busy(self._conn.executescript, SQLITE_SCHEMA)
+        await self._conn.commit()
+        # files created by an older version, or by SQLite before the database file was restricted.
+        for path in (self.path, f"{self.path}-wal", f"{self.path}-shm"):
+            if os.path.exists(path):
+                os.chmod(path, 0o600)
+        self._checkpointer = AsyncSqliteSaver(self._conn)
+        await self._retry_busy(self._checkpointer.setup)
+        self._read_conn = await self._connect()
+        logger.info(f"SQLite session backend started: {self.path}")
+
+    async def close(self):
+        for conn in (self._conn, self._read_conn):
+            if conn is not None:
+                await conn.close()
+        self._conn = self._read_conn = self._checkpointer = None
+
+    @property
+    def checkpointer(self) -> BaseCheckpointSaver:
+        if self._checkpointer is None:
+            raise RuntimeError("SQLite session backend is not started.")
+        return self._checkpointer
+
+    async def save_config(self, session_id: str, config: dict):
+        await self._write(
+            lambda conn: conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, config, updated_at) VALUES (?, ?, ?)",
+                (session_id, json.dumps(config), time.time()),
+            )
+        )
+
+    async def load_config(self, session_id: str) -> dict | None:
+        async with self._read_conn.execute("SELECT config FROM sessions WHERE session_id = ?", (session_id,)) as cursor:
+            row = await cursor.fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def touch(self, session_id: str):
+        await self._write(
+            lambda conn: conn.execute(
+                "UPDATE sessions SET updated_at = ? WHERE session_id = ?", (time.time(), session_id)
+            )
+        )
+
+    async def append_messages(self, session_id: str, messages: list[BaseMessage]):
+        rows = [json.dumps(message) for message in messages_to_dict(messages)]
+
+        async def append(conn: aiosqlite.Connection):
+            # in the write transaction, so two workers can't take the same sequence numbers.
+            async with conn.execute(
+                "SELECT COALESCE(MAX(seq), -1) + 1 FROM messages WHERE session_id = ?", (session_id,)
+            ) as cursor:
+                (next_seq,) = await cursor.fetchone()
+            await conn.executemany(
+                "INSERT INTO messages (session_id, seq, message) VALUES (?, ?, ?)",
+                [(session_id, next_seq + i, message) for i, message in enumerate(rows)],
+            )
+            await conn.execute("UPDATE sessions SET updated_at = ? WHERE session_id = ?", (time.time(), session_id))
+
+        await self._write(append)
+
+    async def load_messages(self, session_id: str) -> list[BaseMessage]:
+        async with self._read_conn.execute(
+            "SELECT message FROM messages WHERE session_id = ? ORDER BY seq", (session_id,)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        return messages_from_dict([json.loads(row[0]) for row in rows])
+
+    async def iter_messages(self, session_id: str) -> AsyncIterator[BaseMessage]:
+        last_seq = -1
+        while True:
+            async with self._read_conn.execute(
+                "SELECT seq, message FROM messages WHERE session_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (session_id, last_seq, MESSAGE_BATCH_SIZE),
+            ) as cursor:
+                rows = await cursor.fetchall()
+            for message in messages_from_dict([json.loads(row[1]) for row in rows]):
+                yield message
+            if len(rows) < MESSAGE_BATCH_SIZE:
+                return
+            last_seq = rows[-1][0]
+
+    async def save_job(self, job: dict):
+        await self._write(
+            lambda conn: conn.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, session_id, job) VALUES (?, ?, ?)",
+                (job["job_id"], job["session_id"], json.dumps(job)),
+            )
+        )
+
+    async def load_job(self, job_id: str) -> dict | None:
+        async with self._read_conn.execute("SELECT job FROM jobs WHERE job_id = ?", (job_id,)) as cursor:
+            row = await cursor.fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def load_session_jobs(self, session_id: str) -> list[dict]:
+        # jobs are replaced on every update, the rowid orders them by their last update.
+        async with self._read_conn.execute(
+            "SELECT job FROM jobs WHERE session_id = ? ORDER BY rowid", (session_id,)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    async def save_turn_review(self, session_id: str, turn: int, review: dict):
+        await self._write(
+            lambda conn: conn.execute(
+                "INSERT OR REPLACE INTO turn_reviews (session_id, turn, review) VALUES (?, ?, ?)",
+                (session_id, turn, json.dumps(review)),
+            )
+        )
+
+    async def load_turn_reviews(self, session_id: str) -> dict[int, dict]:
+        async with self._read_conn.execute(
+            "SELECT turn, review FROM turn_reviews WHERE session_id = ?", (session_id,)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        return {turn: json.loads(review) for turn, review in rows}
+
+    async def save_reply_audio(self, session_id: str, index: int, audio: dict):
+        await self._write(
+            lambda conn: conn.execute(
+                "INSERT OR REPLACE INTO reply_audio (session_id, message_index, audio) VALUES (?, ?, ?)",
+                (session_id, index, json.dumps(audio)),
+            )
+        )
+
+    async def load_reply_audio(self, session_id: str) -> dict[int, dict]:
+        async with self._read_conn.execute(
+            "SELECT message_index, audio FROM reply_audio WHERE session_id = ?", (session_id,)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        return {index: json.loads(audio) for index, audio in rows}
+
+    async def save_tutor_output(self, session_id: str, index: int, kind: str, content: str):
+        await self._write(
+            lambda conn: conn.execute(
+                "INSERT OR REPLACE INTO tutor_outputs (session_id, message_index, kind, content) VALUES (?, ?, ?, ?)",
+                (session_id, index, kind, content),
+            )
+        )
+
+    async def load_tutor_outputs(self, session_id: str) -> dict[int, dict[str, str]]:
+        async with self._read_conn.execute(
+            "SELECT message_index, kind, content FROM tutor_outputs WHERE session_id = ?", (session_id,)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        outputs: dict[int, dict[str, str]] = {}
+        for index, kind, content in rows:
+            outputs.setdefault(index, {})[kind] = content
+        return outputs
+
+    async def delete(self, session_id: str) -> dict | None:
+        async def delete(conn: aiosqlite.Connection) -> dict | None:
+            async with conn.execute("SELECT config FROM sessions WHERE session_id = ?", (session_id,)) as cursor:
+                row = await cursor.fetchone()
+            for table in ("jobs", "turn_reviews", "reply_audio", "tutor_outputs", "messages", "sessions"):
+                await conn.execute(f"DELETE FROM {table} WHERE session_id = ?", (session_id,))
+            return json.loads(row[0]) if row else None
+
+        config = await self._write(delete)
+        # takes the lock of the checkpointer, outside of the transaction.
+        await self._retry_busy(self._checkpointer.adelete_thread, session_id)
+        return config
+
+    async def expired(self, idle_ttl: float) -> list[str]:
+        async with self._read_conn.execute(
+            "SELECT session_id FROM sessions WHERE updated_at < ?", (time.time() - idle_ttl,)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        return [row[0] for row in rows]
+
+    async def _write(self, write: Callable[[aiosqlite.Connection], Awaitable[T]]) -> T:
+        """Run `write` in a transaction of its own on the writer connection, committed at once."""
+
+        async def transaction() -> T:
+            # the checkpointer commits whatever is pending on the connection, keep its statements out of ours.
+            async with self._checkpointer.lock:
+                await self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    result = await write(self._conn)
+                    await self._conn.commit()
+                except BaseException:
+                    await self._conn.rollback()
+                    raise
+                return result
+
+        return await self._retry_busy(transaction)
+
+    async def _retry_busy(self, call: Callable[..., Awaitable[T]], *args) -> T:
+        """Run `call`, trying again while the database stays locked by another worker past the busy timeout."""
+        attempt = 0
+        while True:
+            try:
+                return await call(*args)
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) or attempt >= self.busy_retries:
+                    raise
+            attempt += 1
+            delay = random.uniform(0, 0.05 * 2**attempt)
+            logger.warning(f"SQLite database is locked, retry {attempt} in {delay:.2f} seconds")
+            await asyncio.sleep(delay)
+
+    async def _connect(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path)
+        # WAL (see `start`) lets the workers read while one of them writes.
+        await conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+        return conn
+
+
+def create_session_backend(name: str = SESSION_BACKEND) -> SessionBackend:
+    if name == "memory":
+        return MemorySessionBackend()
+    if name == "sqlite":
+        return SQLiteSessionBackend()
+    raise ValueError(f"Invalid session backend: {name}")
@@ -0,0 +1,150 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+import dotenv
+import httpx
+from langchain_openai import ChatOpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+logger = logging.getLogger(__name__)
+
+dotenv.load_dotenv(override=False)
+
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 100))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", 20))
+OPENAI_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY_SECONDS", 30))
+OPENAI_MAX_CLIENTS = int(os.getenv("OPENAI_MAX_CLIENTS", 256))
+OPENAI_CLIENT_IDLE_TTL_SECONDS = float(os.getenv("OPENAI_CLIENT_IDLE_TTL_SECONDS", 1800))
+
+
+def hash_api_key(api_key: str) -> str:
+    """Hash the API key, so it can be used as a cache key without keeping the key itself around."""
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+
+
+class OpenAIClientRegistry:
+    """
+    Process-wide registry of OpenAI clients.
+
+    All clients share one keep-alive connection pool (one for sync, one for async calls), so
+    sessions reuse open connections instead of doing new TLS handshakes. The per-key client
+    objects are cheap wrappers around the pool; they are keyed by the hash of the API key and
+    evicted when idle for `idle_ttl` seconds or when more than `max_clients` are held (LRU).
+    The clients don't retry failed calls, the upstream scheduler does (see `scheduler.UpstreamScheduler`).
+    """
+
+    def __init__(
+        self,
+        max_connections: int = OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections: int = OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = OPENAI_KEEPALIVE_EXPIRY_SECONDS,
+        max_clients: int = OPENAI_MAX_CLIENTS,
+        idle_ttl: float = OPENAI_CLIENT_IDLE_TTL_SECONDS,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.max_clients = max_clients
+        self.idle_ttl = idle_ttl
+        self._http_client: httpx.Client | None = None
+        self._http_async_client: httpx.AsyncClient | None = None
+        # (kind, api key hash, extra) -> (last used, client)
+        self._clients: OrderedDict[tuple, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def http_client(self) -> httpx.Client:
+        if self._http_client is None:
+            self._http_client = DefaultHttpxClient(limits=self.limits)
+        return self._http_client
+
+    @property
+    def http_async_client(self) -> httpx.AsyncClient:
+        if self._http_async_client is None:
+            self._http_async_client = DefaultAsyncHttpxClient(limits=self.limits)
+        return self._http_async_client
+
+    def get_client(self, api_key: str) -> OpenAI:
+        return self._get(
+            ("sync", hash_api_key(api_key)),
+            lambda: OpenAI(api_key=api_key, http_client=self.http_client, max_retries=0),
+        )
+
+    def get_async_client(self, api_key: str) -> AsyncOpenAI:
+        return self._get(
+            ("async", hash_api_key(api_key)),
+            lambda: AsyncOpenAI(api_key=api_key, http_client=self.http_async_client, max_retries=0),
+        )
+
+    def get_chat_model(self, api_key: str, **kwargs) -> ChatOpenAI:
+        """Get a `ChatOpenAI` bound to the shared connection pools. Models with the same settings are shared."""
+        key = ("chat", hash_api_key(api_key), tuple(sorted(kwargs.items())))
+        return self._get(
+            key,
+            lambda: ChatOpenAI(
+                api_key=api_key,
+                http_client=self.http_client,
+                http_async_client=self.http_async_client,
+                max_retries=0,
+                **kwargs,
+            ),
+        )
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    async def aclose(self):
+        with self._lock:
+            self._clients.clear()
+        if self._http_async_client is not None:
+            await self._http_async_client.aclose()
+            self._http_async_client = None
+        if self._http_client is not None:
+            self._http_client.close()
+            self._http_client = None
+
+    def _get(self, key: tuple, factory):
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            item = self._clients.get(key)
+            if item is None:
+                client = factory()
+            else:
+                client = item[1]
+            self._clients[key] = (now, client)
+            self._clients.move_to_end(key)
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+            return client
+
+    def _evict(self, now: float):
+        # entries are in LRU order, so the idle ones are at the front.
+        while self._clients:
+            key, (last_used, _) = next(iter(self._clients.items()))
+            if now - last_used <= self.idle_ttl:
+                break
+            del self._clients[key]
+            logger.debug(f"Evicted idle OpenAI client: {key[0]}")
+
+
+CLIENT_REGISTRY = OpenAIClientRegistry()
+
+
+def get_client(api_key: str) -> OpenAI:
+    return CLIENT_REGISTRY.get_client(api_key)
+
+
+def get_async_client(api_key: str) -> AsyncOpenAI:
+    return CLIENT_REGISTRY.get_async_client(api_key)
+
+
+def get_chat_model(api_key: str, **kwargs) -> ChatOpenAI:
+    return CLIENT_REGISTRY.get_chat_model(api_key, **kwargs)
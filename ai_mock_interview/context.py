@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any
+
+import dotenv
+import tiktoken
+from langchain.agents import AgentState
+from langchain.agents.middleware import AgentMiddleware
+from langchain.messages import RemoveMessage
+from langchain_core.messages import BaseMessage, SystemMessage
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
+from langgraph.runtime import Runtime
+
+from ai_mock_interview.clients import get_chat_model
+from ai_mock_interview.metrics import observe
+from ai_mock_interview.scheduler import PRIORITY_INTERVIEWER, UPSTREAM_SCHEDULER
+
+logger = logging.getLogger(__name__)
+
+dotenv.load_dotenv(override=False)
+
+# the condensed history is summarized once the messages exceed the max tokens, keeping the latest keep tokens.
+INTERVIEWER_CONTEXT_MAX_TOKENS = int(os.getenv("INTERVIEWER_CONTEXT_MAX_TOKENS", 3000))
+INTERVIEWER_CONTEXT_KEEP_TOKENS = int(os.getenv("INTERVIEWER_CONTEXT_KEEP_TOKENS", 1500))
+CONTEXT_SUMMARY_MODEL_NAME = os.getenv("CONTEXT_SUMMARY_MODEL_NAME", "gpt-5-nano-2025-08-07")
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", 100_000))
+DEFAULT_ENCODING = "o200k_base"
+# tokens added by the chat format to every message.
+TOKENS_PER_MESSAGE = 4
+# rough number of characters per token, used when the tiktoken encoding can't be loaded (e.g. offline).
+CHARS_PER_TOKEN = 4
+SUMMARY_MESSAGE_ID_PREFIX = "running-summary-"
+SUMMARY_MESSAGE_HEADER = "Summary of the interview so far:\n"
+
+SUMMARY_SYSTEM_PROMPT = """
+You are the note taker of a job interview. You keep a running summary of the interview for the interviewer.
+
+You will be given:
+- the current summary (it may be empty)
+- the next part of the interview transcript
+
+Update the summary with the new part. Keep the topics and questions already covered, the key facts and examples
+the interviewee gave, and the strengths or gaps the interviewer noticed, so the interviewer doesn't repeat questions
+and can ask follow-ups. Keep it under 300 words.
+
+Return ONLY the updated summary. Do not include any extra text.
+"""
+
+SUMMARY_QUERY_PROMPT = """
+# Current summary:
+{summary}
+# Next part of the interview transcript:
+{transcript}
+"""
+
+
+class TokenCounter:
+    """
+    Count the tokens of messages with tiktoken. The count of each message is cached by its id (LRU).
+
+    The encoding is downloaded the first time it is used (unless in `TIKTOKEN_CACHE_DIR`), which never
+    happens on the event loop: there, it is loaded in a thread (see `start_loading`, called at startup),
+    and counts are approximated from the number of characters until it is ready.
+    """
+
+    def __init__(self, model_name: str | None = None, maxsize: int = TOKEN_COUNT_CACHE_SIZE):
+        self.model_name = model_name
+        self.maxsize = maxsize
+        self._encoding: tiktoken.Encoding | None = None
+        self._encoding_loaded = False
+        self._loader: threading.Thread | None = None
+        self._counts: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    @property
+    def encoding(self) -> tiktoken.Encoding | None:
+        if not self._encoding_loaded:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                # a worker thread or process, or the sync API: it may block.
+                self.load()
+            else:
+                self.start_loading()
+        return self._encoding
+
+    def load(self):
+        """Load the encoding, blocking until it is downloaded if needed."""
+        with self._load_lock:
+            if self._encoding_loaded:
+                return
+            try:
+                encoding_name = tiktoken.encoding_name_for_model(self.model_name or "")
+            except KeyError:
+                encoding_name = DEFAULT_ENCODING
+            try:
+                self._encoding = tiktoken.get_encoding(encoding_name)
+            except Exception as e:
+                logger.warning(f"Failed to load the tiktoken encoding, token counts are approximated: {e}")
+            self._encoding_loaded = True
+
+    def start_loading(self):
+        """Load the encoding in the background."""
+        with self._lock:
+            if self._loader is None:
+                # a daemon thread, the download may hang without a timeout.
+                self._loader = threading.Thread(target=self.load, name="tiktoken-loader", daemon=True)
+                self._loader.start()
+
+    def count(self, message: BaseMessage) -> int:
+        if message.id is None:
+            return self._count(message)
+        with self._lock:
+            count = self._counts.get(message.id)
+            if count is not None:
+                self._counts.move_to_end(message.id)
+                return count
+        if self.encoding is None:
+            # don't keep the approximation, the encoding may be loaded later.
+            return self._count(message)
+        count = self._count(message)
+        with self._lock:
+            self._counts[message.id] = count
+            while len(self._counts) > self.maxsize:
+                self._counts.popitem(last=False)
+        return count
+
+    def count_messages(self, messages: list[BaseMessage]) -> int:
+        return sum(self.count(m) for m in messages)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cut the text to at most `max_tokens` tokens."""
+        encoding = self.encoding
+        if encoding is None:
+            return text[: max_tokens * CHARS_PER_TOKEN]
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return encoding.decode(tokens[:max_tokens])
+
+    def _count(self, message: BaseMessage) -> int:
+        encoding = self.encoding
+        if encoding is None:
+            return len(message.text) // CHARS_PER_TOKEN + TOKENS_PER_MESSAGE
+        return len(encoding.encode(message.text, disallowed_special=())) + TOKENS_PER_MESSAGE
+
+
+TOKEN_COUNTER = TokenCounter(os.getenv("INTERVIEWER_MODEL_NAME"))
+
+
+class RunningSummaryMiddleware(AgentMiddleware):
+    """
+    Keep the agent context within a token budget.
+
+    When the messages exceed `max_tokens`, the oldest ones are condensed into a running summary,
+    keeping the latest `keep_tokens` worth of messages (starting at an AI message, so questions stay
+    with their answers). The summary is kept as a system message at the start of the history, and
+    each update only folds the newly condensed messages into the previous summary. The summary is made
+    by `model_name`, with the `api_key` of the runtime context of the run. The summary calls hold up the
+    interviewer reply, so they run in the interviewer priority class of the upstream scheduler.
+    """
+
+    def __init__(
+        self,
+        model_name: str = CONTEXT_SUMMARY_MODEL_NAME,
+        max_tokens: int = INTERVIEWER_CONTEXT_MAX_TOKENS,
+        keep_tokens: int = INTERVIEWER_CONTEXT_KEEP_TOKENS,
+        token_counter: TokenCounter = TOKEN_COUNTER,
+    ):
+        super().__init__()
+        self.model_name = model_name
+        self.max_tokens = max_tokens
+        self.keep_tokens = keep_tokens
+        self.token_counter = token_counter
+
+    def before_model(self, state: AgentState, runtime: Runtime) -> dict[str, Any] | None:
+        plan = self._plan(state["messages"])
+        if plan is None:
+            return None
+        summary, condensed, kept = plan
+        start_time = time.time()
+        model = get_chat_model(runtime.context.api_key, model=self.model_name)
+        messages = self._summary_messages(summary, condensed)
+        with observe("context_summary", self.model_name):
+            response = UPSTREAM_SCHEDULER.run(lambda: model.invoke(messages))
+        return self._update(response.text, condensed, kept, start_time)
+
+    async def abefore_model(self, state: AgentState, runtime: Runtime) -> dict[str, Any] | None:
+        plan = self._plan(state["messages"])
+        if plan is None:
+            return None
+        summary, condensed, kept = plan
+        start_time = time.time()
+        api_key = runtime.context.api_key
+        model = get_chat_model(api_key, model=self.model_name)
+        messages = self._summary_messages(summary, condensed)
+        with observe("context_summary", self.model_name):
+            response = await UPSTREAM_SCHEDULER.arun(lambda: model.ainvoke(messages), api_key, PRIORITY_INTERVIEWER)
+        return self._update(response.text, condensed, kept, start_time)
+
+    def _plan(self, messages: list[BaseMessage]) -> tuple[str, list[BaseMessage], list[BaseMessage]] | None:
+        """Split the messages into (previous summary, messages to condense, messages to keep), if over budget."""
+        if self.token_counter.count_messages(messages) <= self.max_tokens:
+            return None
+        summary = ""
+        if messages and _is_summary(messages[0]):
+            summary = messages[0].text.removeprefix(SUMMARY_MESSAGE_HEADER)
+            messages = messages[1:]
+
+        start = len(messages) - 1
+        kept_tokens = self.token_counter.count(messages[start])
+        while start > 0:
+            tokens = self.token_counter.count(messages[start - 1])
+            if kept_tokens + tokens > self.keep_tokens:
+                break
+            kept_tokens += tokens
+            start -= 1
+        while start < len(messages) - 1 and messages[start].type != "ai":
+            start += 1
+        if start == 0:
+            return None
+        return summary, messages[:start], messages[start:]
+
+    def _summary_messages(self, summary: str, condensed: list[BaseMessage]) -> list:
+        transcript = "\n".join(f"{_ROLES.get(m.type, m.type)}: {m.text}" for m in condensed)
+        return [
+            ("system", SUMMARY_SYSTEM_PROMPT),
+            ("human", SUMMARY_QUERY_PROMPT.format(summary=summary or "(empty)", transcript=transcript)),
+        ]
+
+    def _update(
+        self, summary: str, condensed: list[BaseMessage], kept: list[BaseMessage], start_time: float
+    ) -> dict[str, Any]:
+        logger.info(
+            f"Condensed {len(condensed)} messages into the running summary in {time.time() - start_time:.2f} seconds"
+        )
+        summary_message = SystemMessage(
+            content=SUMMARY_MESSAGE_HEADER + summary.strip(),
+            id=f"{SUMMARY_MESSAGE_ID_PREFIX}{uuid.uuid4()}",
+        )
+        return {"messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES), summary_message, *kept]}
+
+
+_ROLES = {"human": "interviewee", "ai": "interviewer"}
+
+
+def _is_summary(message: BaseMessage) -> bool:
+    return message.type == "system" and (message.id or "").startswith(SUMMARY_MESSAGE_ID_PREFIX)
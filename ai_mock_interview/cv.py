@@ -0,0 +1,214 @@
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+import dotenv
+from fastapi import UploadFile
+
+from ai_mock_interview import pdf
+from ai_mock_interview.context import TOKEN_COUNTER
+
+logger = logging.getLogger(__name__)
+
+dotenv.load_dotenv(override=False)
+
+CV_UPLOAD_DIR = os.getenv("CV_UPLOAD_DIR", "uploads")
+CV_MAX_UPLOAD_BYTES = int(os.getenv("CV_MAX_UPLOAD_BYTES", 5 * 1024 * 1024))
+CV_MAX_PAGES = int(os.getenv("CV_MAX_PAGES", 10))
+CV_PARSER_WORKERS = int(os.getenv("CV_PARSER_WORKERS", 2))
+CV_PROFILE_MAX_TOKENS = int(os.getenv("CV_PROFILE_MAX_TOKENS", 1500))
+CV_CACHE_DIR = os.getenv("CV_CACHE_DIR", str(Path(__file__).resolve().parent.parent / "cache" / "cv"))
+CV_CACHE_SIZE = int(os.getenv("CV_CACHE_SIZE", 1000))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+_BLANK_LINES_PATTERN = re.compile(r"\n\s*\n+")
+_SPACES_PATTERN = re.compile(r"[ \t\u00a0]+")
+
+
+class CVTooLargeError(ValueError):
+    pass
+
+
+@dataclass
+class CV:
+    path: str
+    content_hash: str
+    # the token-capped text used in the interviewer and reviewer prompts.
+    profile: str
+
+
+_cv_parser_pool: ProcessPoolExecutor | None = None
+
+
+def get_cv_parser_pool() -> ProcessPoolExecutor:
+    global _cv_parser_pool
+    if _cv_parser_pool is None:
+        # spawned, not forked: a fork would copy the locks held by the threads of the app (logging, SQLite,
+        # HTTP pools) and could deadlock on them.
+        _cv_parser_pool = ProcessPoolExecutor(
+            max_workers=CV_PARSER_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _cv_parser_pool
+
+
+def start_cv_parser():
+    """Start a parser process ahead of the first upload, a spawned process takes a few seconds to start."""
+    get_cv_parser_pool().submit(os.getpid)
+
+
+async def ashutdown_cv_parser():
+    """Stop the parser processes, they would otherwise outlive the app waiting for work."""
+    if _cv_parser_pool is not None:
+        await asyncio.to_thread(_cv_parser_pool.shutdown, cancel_futures=True)
+
+
+async def aextract_pdf_text(path: str, max_pages: int = CV_MAX_PAGES) -> str:
+    """Extract the text of a PDF in a worker process, so parsing doesn't block the event loop."""
+    loop = asyncio.get_running_loop()
+    text, warnings = await loop.run_in_executor(get_cv_parser_pool(), pdf.extract_pdf_text, path, max_pages)
+    for warning in warnings:
+        logger.warning(warning)
+    return text
+
+
+def compact_profile(text: str, max_tokens: int = CV_PROFILE_MAX_TOKENS) -> str:
+    """Squeeze the whitespace, drop repeated lines (e.g. page headers and footers), and cap the tokens."""
+    lines = []
+    seen = set()
+    for line in _BLANK_LINES_PATTERN.sub("\n", text).splitlines():
+        line = _SPACES_PATTERN.sub(" ", line).strip()
+        if not line:
+            continue
+        # short lines like "Skills" or "2020 - 2022" legitimately repeat.
+        if len(line) > 30:
+            if line in seen:
+                continue
+            seen.add(line)
+        lines.append(line)
+    return TOKEN_COUNTER.truncate("\n".join(lines), max_tokens)
+
+
+async def save_upload(upload: UploadFile, path: str, max_bytes: int = CV_MAX_UPLOAD_BYTES) -> str:
+    """Stream the upload to `path` without holding it in memory, return the SHA-256 of its content."""
+    if upload.size is not None and upload.size > max_bytes:
+        raise CVTooLargeError(f"CV is larger than {max_bytes} bytes.")
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(path, "wb") as f:
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise CVTooLargeError(f"CV is larger than {max_bytes} bytes.")
+                digest.update(chunk)
+                await asyncio.to_thread(f.write, chunk)
+    except BaseException:
+        remove_upload(path)
+        raise
+    return digest.hexdigest()
+
+
+def remove_upload(path: str | None):
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Failed to remove CV file {path}: {e}")
+
+
+class CVCache:
+    """
+    Compact profiles of parsed CVs, keyed by the SHA-256 of the PDF and persisted as one JSON file per CV,
+    so re-uploads of the same resume (from any worker) skip parsing. The least recently used entries are
+    removed beyond `maxsize` files.
+    """
+
+    def __init__(self, path: str | Path | None = CV_CACHE_DIR, maxsize: int = CV_CACHE_SIZE):
+        self.path = Path(path) if path else None
+        self.maxsize = maxsize
+
+    def get(self, content_hash: str) -> str | None:
+        if self.path is None:
+            return None
+        file = self.path / f"{content_hash}.json"
+        try:
+            with open(file, encoding="utf-8") as f:
+                profile = json.load(f)["profile"]
+            os.utime(file)
+            return profile
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Failed to load cached CV {content_hash}: {e}")
+            return None
+
+    def set(self, content_hash: str, profile: str):
+        if self.path is None:
+            return
+        tmp_file = None
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+            # a unique temporary file, identical uploads can be cached at once by several requests or workers.
+            with tempfile.NamedTemporaryFile(
+                "w", encoding="utf-8", dir=self.path, prefix=f"{content_hash}.", suffix=".tmp", delete=False
+            ) as f:
+                tmp_file = f.name
+                json.dump({"version": 1, "profile": profile}, f)
+            os.replace(tmp_file, self.path / f"{content_hash}.json")
+            self._prune()
+        except OSError as e:
+            logger.warning(f"Failed to cache CV {content_hash}: {e}")
+            if tmp_file:
+                Path(tmp_file).unlink(missing_ok=True)
+
+    def _prune(self):
+        files = []
+        for file in self.path.glob("*.json"):
+            try:
+                files.append((file.stat().st_mtime, file))
+            except FileNotFoundError:
+                # pruned by another worker.
+                continue
+        if len(files) <= self.maxsize:
+            return
+        files.sort()
+        for _, file in files[: len(files) - self.maxsize]:
+            file.unlink(missing_ok=True)
+
+
+CV_CACHE = CVCache()
+
+
+async def ingest_cv(upload: UploadFile, session_id: str) -> CV:
+    """
+    Save the uploaded CV and build its compact profile, from the cache when the same PDF was seen before.
+    A CV that can't be parsed gets an empty profile.
+    """
+    path = os.path.join(CV_UPLOAD_DIR, f"{session_id}_{Path(upload.filename or 'cv.pdf').name}")
+    content_hash = await save_upload(upload, path)
+    profile = await asyncio.to_thread(CV_CACHE.get, content_hash)
+    if profile is not None:
+        logger.info(f"CV cache hit: {content_hash[:12]}")
+        return CV(path=path, content_hash=content_hash, profile=profile)
+
+    try:
+        text = await aextract_pdf_text(path)
+        profile = await asyncio.to_thread(compact_profile, text)
+    except Exception as e:
+        logger.error(f"Error parsing CV: {e}")
+        return CV(path=path, content_hash=content_hash, profile="")
+    # a failure to cache is logged, the profile is still used.
+    await asyncio.to_thread(CV_CACHE.set, content_hash, profile)
+    return CV(path=path, content_hash=content_hash, profile=profile)
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable
+
+import dotenv
+from fastapi import WebSocketDisconnect
+
+logger = logging.getLogger(__name__)
+
+dotenv.load_dotenv(override=False)
+
+WS_MAX_CONCURRENT_TASKS = int(os.getenv("WS_MAX_CONCURRENT_TASKS", 4))
+# requests waiting for a slot, more are dropped.
+WS_MAX_QUEUED_TASKS = int(os.getenv("WS_MAX_QUEUED_TASKS", 16))
+
+Handler = Callable[[], Awaitable[None]]
+# called with the description of a failed or dropped request and an error message.
+ErrorReporter = Callable[[dict, str], Awaitable[None]]
+
+
+class SessionDispatcher:
+    """
+    Run the websocket message handlers of a session in the background of the receive loop.
+
+    Interviewer turns run one at a time, in arrival order. Other requests (e.g. tutor help) run
+    concurrently with them and with each other, at most `max_concurrency` at once. Neither holds up the
+    receive loop, so pings are answered while handlers run: requests wait for a slot in the background,
+    and once `max_queued` of them are waiting, new ones are dropped. `aclose` cancels everything still in
+    flight. Handler errors are logged and don't stop the session. Failed and dropped requests are reported
+    to `on_error` with the `request` they were submitted with, so the client doesn't wait for them forever.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = WS_MAX_CONCURRENT_TASKS,
+        max_queued: int = WS_MAX_QUEUED_TASKS,
+        on_error: ErrorReporter | None = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queued = max_queued
+        self.on_error = on_error
+        self._turns: asyncio.Queue[tuple[Handler, dict]] = asyncio.Queue()
+        self._turn_worker: asyncio.Task | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    def submit_turn(self, handler: Handler, request: dict | None = None):
+        self._turns.put_nowait((handler, request or {}))
+        if self._turn_worker is None:
+            self._turn_worker = asyncio.create_task(self._run_turns())
+
+    def submit(self, handler: Handler, request: dict | None = None) -> bool:
+        """Run `handler` once a slot is free, return False if it was dropped since too many are waiting."""
+        request = request or {}
+        # the requests running or waiting for a slot.
+        if len(self._tasks) >= self.max_concurrency + self.max_queued:
+            logger.warning(f"Dropped a websocket request: {self.max_queued} request(s) already waiting.")
+            self._start(self._report(request, "Too many requests at once, please try again."))
+            return False
+        self._start(self._run(handler, request))
+        return True
+
+    async def aclose(self):
+        tasks = list(self._tasks)
+        if self._turn_worker is not None:
+            tasks.append(self._turn_worker)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._turn_worker = None
+
+    def _start(self, coro: Awaitable[None]):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_turns(self):
+        while True:
+            handler, request = await self._turns.get()
+            await self._call(handler, request)
+
+    async def _run(self, handler: Handler, request: dict):
+        async with self._slots:
+            await self._call(handler, request)
+
+    async def _call(self, handler: Handler, request: dict):
+        try:
+            await handler()
+        except WebSocketDisconnect:
+            logger.info("Client disconnected while handling a message.")
+        except Exception as e:
+            logger.exception(f"Failed to handle websocket message: {e}")
+            await self._report(request, f"Request failed: {e}")
+
+    async def _report(self, request: dict, message: str):
+        if self.on_error is None:
+            return
+        try:
+            await self.on_error(request, message)
+        except Exception as e:
+            # e.g. the websocket is closed already.
+            logger.info(f"Failed to report a websocket request error: {e}")
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+from functools import partial
+
+from langchain_core.messages import BaseMessage
+
+from ai_mock_interview.backends import SessionBackend
+from ai_mock_interview.reviewer import (
+    ChunkReview,
+    ReviewResult,
+    amerge_turn_reviews,
+    areview_turn,
+    question_answer_pairs,
+)
+from ai_mock_interview.scheduler import PRIORITY_SPECULATIVE, PRIORITY_TUTOR, UPSTREAM_SCHEDULER
+
+logger = logging.getLogger(__name__)
+
+
+class RollingEvaluator:
+    """
+    Review each answered question in the background while the interview goes on, in the lowest priority
+    class of the upstream scheduler.
+
+    The reviews are saved in the session backend, keyed by session and question number, so a
+    reconnect or a repeated diagnosis doesn't review the same answer twice. The diagnosis then only
+    merges the stored reviews.
+    """
+
+    def __init__(self, backend: SessionBackend):
+        self.backend = backend
+        # (session id, turn) -> review task running on this worker
+        self._tasks: dict[tuple[str, int], asyncio.Task] = {}
+
+    async def schedule(self, session_id: str, config: dict, histories: list[BaseMessage]):
+        """Start reviewing the answered questions that have no review yet."""
+        pairs = question_answer_pairs(histories)
+        if not pairs:
+            return
+        reviewed = await self.backend.load_turn_reviews(session_id)
+        for turn, pair in enumerate(pairs, start=1):
+            if turn not in reviewed:
+                self._start(session_id, config, turn, pair, PRIORITY_SPECULATIVE)
+
+    async def areview(self, session_id: str, config: dict, histories: list[BaseMessage]) -> ReviewResult | None:
+        """
+        Diagnosis the interview from the reviews of each answered question, reviewing the missing ones first.
+        A failed review is tried once more. Return None when no question has been answered, or when a question
+        still couldn't be reviewed, the whole transcript is then to be reviewed instead.
+        """
+        pairs = question_answer_pairs(histories)
+        if not pairs:
+            return None
+        reviewed = await self.backend.load_turn_reviews(session_id)
+        missing = [turn for turn in range(1, len(pairs) + 1) if turn not in reviewed]
+        if missing:
+            logger.info(f"Waiting for {len(missing)} of {len(pairs)} turn review(s) of session {session_id}")
+        for _ in range(2):
+            if not missing:
+                break
+            tasks = [self._start(session_id, config, turn, pairs[turn - 1], PRIORITY_TUTOR) for turn in missing]
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            missing = [turn for turn, result in zip(missing, results) if isinstance(result, BaseException)]
+        if missing:
+            logger.warning(f"Turn review(s) {missing} of session {session_id} failed, reviewing the whole interview")
+            return None
+        reviewed = await self.backend.load_turn_reviews(session_id)
+        turn_reviews = [ChunkReview.model_validate(reviewed[turn]) for turn in range(1, len(pairs) + 1)]
+        return await amerge_turn_reviews(
+            api_key=config["openai_api_key"],
+            turn_reviews=turn_reviews,
+            position=config["position"],
+            years_of_experience=config["years_of_experience"],
+            cv=config["cv_str"],
+        )
+
+    def cancel_all(self):
+        for task in self._tasks.values():
+            task.cancel()
+
+    def _start(self, session_id: str, config: dict, turn: int, pair: list[BaseMessage], priority: int) -> asyncio.Task:
+        key = (session_id, turn)
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.create_task(self._review(session_id, config, turn, pair, priority))
+            self._tasks[key] = task
+            task.add_done_callback(partial(self._forget, key))
+        else:
+            # already running, e.g. a speculative review the diagnosis now waits for.
+            UPSTREAM_SCHEDULER.raise_priority(task, priority)
+        return task
+
+    def _forget(self, key: tuple[str, int], task: asyncio.Task):
+        self._tasks.pop(key, None)
+        if not task.cancelled():
+            # already logged, retrieve it so that an unawaited failure isn't reported again.
+            task.exception()
+
+    async def _review(self, session_id: str, config: dict, turn: int, pair: list[BaseMessage], priority: int):
+        try:
+            review = await areview_turn(
+                api_key=config["openai_api_key"],
+                turn=turn,
+                question_answer=pair,
+                position=config["position"],
+                years_of_experience=config["years_of_experience"],
+                cv=config["cv_str"],
+                priority=priority,
+            )
+        except Exception as e:
+            logger.error(f"Turn review {turn} of session {session_id} failed: {e}")
+            raise
+        await self.backend.save_turn_review(session_id, turn, review.model_dump())
@@ -0,0 +1,93 @@
+import html
+import json
+import re
+from typing import AsyncIterator
+
+from langchain_core.messages import BaseMessage
+
+# format -> media type
+EXPORT_FORMATS = {
+    "txt": "text/plain; charset=utf-8",
+    "jsonl": "application/x-ndjson",
+    "md": "text/markdown; charset=utf-8",
+}
+# tutor help, by websocket message type
+TUTOR_OUTPUT_TITLES = {"grammar_check": "Grammar Check", "generate_ai_answer": "AI Answer"}
+ROLE_NAMES = {"ai": "Interviewer", "human": "Interviewee"}
+
+CORRECTION_PATTERN = re.compile(r'<span class="correct">(.*?)</span>', re.DOTALL)
+HTML_TAG_PATTERN = re.compile(r"<[^>]+>")
+# characters with a meaning anywhere in Markdown, and line starts making a heading, quote or list.
+MARKDOWN_SPECIAL_PATTERN = re.compile(r"([\\`*_\[\]<>|~&])")
+MARKDOWN_LINE_START_PATTERN = re.compile(r"^(\s*(?:\d+(?=[.)]))?)([#>+=.)-])", re.MULTILINE)
+
+
+async def aiter_transcript(
+    messages: AsyncIterator[BaseMessage],
+    format_: str = "txt",
+    tutor_outputs: dict[int, dict[str, str]] | None = None,
+    diagnosis: dict | None = None,
+) -> AsyncIterator[str]:
+    """
+    Render the interview in `format_` (see `EXPORT_FORMATS`), one message at a time.
+    The tutor help given for an answer follows it, the diagnosis comes last. The kick-off message
+    starting the interview isn't part of the transcript.
+    """
+    tutor_outputs = tutor_outputs or {}
+    if format_ == "md":
+        yield "# Interview Transcript\n\n"
+    position = 0
+    async for message in messages:
+        # the kick-off message comes first, then interviewer questions alternate with answers.
+        index = (position + 1) // 2 if message.type == "ai" else position // 2
+        position += 1
+        if position == 1 and message.type == "human":
+            continue
+        yield _render_message(format_, message, index)
+        if message.type == "human":
+            for kind, content in tutor_outputs.get(index, {}).items():
+                yield _render_tutor_output(format_, kind, content, index)
+    if diagnosis is not None:
+        yield _render_diagnosis(format_, diagnosis)
+
+
+def _render_message(format_: str, message: BaseMessage, index: int) -> str:
+    if format_ == "jsonl":
+        return _json_line({"type": "message", "role": message.type, "index": index, "content": message.text})
+    if format_ == "md":
+        role = ROLE_NAMES.get(message.type, message.type)
+        return f"**Q{index} - {role}:**\n\n{_escape_markdown(message.text)}\n\n"
+    return f"{message.type:<6}: {message.text}\n" + "-" * 20 + "\n\n"
+
+
+def _render_tutor_output(format_: str, kind: str, content: str, index: int) -> str:
+    title = TUTOR_OUTPUT_TITLES.get(kind, kind)
+    if format_ == "jsonl":
+        return _json_line({"type": kind, "index": index, "content": content})
+    if format_ == "md":
+        # the corrections are shown in bold, the text around them is escaped.
+        parts = [
+            _escape_markdown(html.unescape(HTML_TAG_PATTERN.sub("", part)))
+            for part in CORRECTION_PATTERN.split(content)
+        ]
+        text = "".join(f"**{part}**" if i % 2 else part for i, part in enumerate(parts))
+        return "".join(f"> {line}\n" for line in f"**{title}:** {text}".splitlines()) + "\n"
+    return f"{'tutor':<6}: [{title}] {HTML_TAG_PATTERN.sub('', content)}\n" + "-" * 20 + "\n\n"
+
+
+def _render_diagnosis(format_: str, diagnosis: dict) -> str:
+    if format_ == "jsonl":
+        return _json_line({"type": "diagnosis", **diagnosis})
+    fields = [(key.replace("_", " ").capitalize(), value) for key, value in diagnosis.items()]
+    if format_ == "md":
+        return "## Diagnosis\n\n" + "".join(f"**{name}:** {_escape_markdown(str(value))}\n\n" for name, value in fields)
+    return "Diagnosis\n" + "".join(f"{name}: {value}\n" for name, value in fields)
+
+
+def _escape_markdown(text: str) -> str:
+    """Escape `text` so that Markdown shows it as is, e.g. an answer starting with "#" isn't a heading."""
+    return MARKDOWN_LINE_START_PATTERN.sub(r"\1\\\2", MARKDOWN_SPECIAL_PATTERN.sub(r"\\\1", text))
+
+
+def _json_line(data: dict) -> str:
+    return json.dumps(data, ensure_ascii=False) + "\n"
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+from contextvars import ContextVar
+from typing import Callable
+
+from langchain.agents.middleware import AgentMiddleware
+from langchain_core.language_models import BaseChatModel
+from langchain_core.tracers.context import register_configure_hook
+from langgraph.config import get_config
+
+from ai_mock_interview.metrics import HEDGE_OUTCOMES
+from ai_mock_interview.scheduler import UPSTREAM_SCHEDULER, FirstTokenHandler, UpstreamScheduler
+
+logger = logging.getLogger(__name__)
+
+# added to the callbacks of the model calls made in the task it is set in.
+_first_token_handler: ContextVar[FirstTokenHandler | None] = ContextVar("first_token_handler", default=None)
+register_configure_hook(_first_token_handler, inheritable=True)
+
+
+class HedgingMiddleware(AgentMiddleware):
+    """
+    Hedge the model calls of the agent runs that ask for it (`"hedge": True` in the `configurable` of the run).
+
+    When the model hasn't streamed a first token after `deadline` seconds, the same request is sent again, to
+    the model returned by `fallback_model` for the `api_key` of the runtime context if given. The first
+    successful response wins and the other call is cancelled, or in streamed runs (`"streaming": True`), whose
+    tokens are sent on as they come, the first call to stream a token. No hedge is sent while upstream calls are waiting
+    for a slot, it would only add to the load. The models must stream (`streaming=True`) for their first token
+    to be seen. Outcomes are counted in `HEDGE_OUTCOMES`.
+    """
+
+    def __init__(
+        self,
+        deadline: float,
+        fallback_model: Callable[[str], BaseChatModel] | None = None,
+        scheduler: UpstreamScheduler = UPSTREAM_SCHEDULER,
+    ):
+        super().__init__()
+        self.deadline = deadline
+        self.fallback_model = fallback_model
+        self.scheduler = scheduler
+
+    def wrap_model_call(self, request, handler):
+        # blocking calls can't race each other, they are never hedged.
+        return handler(request)
+
+    async def awrap_model_call(self, request, handler):
+        configurable = get_config().get("configurable", {})
+        if not configurable.get("hedge"):
+            return await handler(request)
+
+        first_token = FirstTokenHandler()
+        primary = asyncio.create_task(_watch(handler(request), first_token))
+        first_token_wait = asyncio.create_task(first_token.event.wait())
+        hedge = None
+        races = {}
+        try:
+            done, _ = await asyncio.wait(
+                {primary, first_token_wait}, timeout=self.deadline, return_when=asyncio.FIRST_COMPLETED
+            )
+            if done:
+                HEDGE_OUTCOMES.inc(outcome="not_fired")
+                return await primary
+            if self.scheduler.queued:
+                logger.info(f"Skipped hedging: {self.scheduler.queued} upstream call(s) queued.")
+                HEDGE_OUTCOMES.inc(outcome="skipped")
+                return await primary
+
+            logger.info(f"No first token after {self.deadline:.2f} seconds, hedging the interviewer model call.")
+            hedge_request = request
+            if self.fallback_model is not None:
+                hedge_request = request.override(model=self.fallback_model(request.runtime.context.api_key))
+            hedge_first_token = FirstTokenHandler()
+            hedge = asyncio.create_task(_watch(handler(hedge_request), hedge_first_token))
+            if configurable.get("streaming"):
+                races = {
+                    asyncio.create_task(_first_token(primary, first_token)): ("primary", primary),
+                    asyncio.create_task(_first_token(hedge, hedge_first_token)): ("hedge", hedge),
+                }
+            else:
+                races = {primary: ("primary", primary), hedge: ("hedge", hedge)}
+            pending = set(races)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for race, (name, task) in races.items():
+                    if race in done and race.exception() is None:
+                        logger.info(f"Hedged interviewer model call won by the {name} request.")
+                        HEDGE_OUTCOMES.inc(outcome=name)
+                        (hedge if task is primary else primary).cancel()
+                        return await task
+            # both failed, report the error of the primary request.
+            return primary.result()
+        finally:
+            for task in (primary, first_token_wait, hedge, *races):
+                if task is not None:
+                    task.cancel()
+
+
+async def _first_token(call: asyncio.Task, first_token: FirstTokenHandler):
+    """Wait until `call` streamed its first token or returned, raise its error when it failed before."""
+    first_token_wait = asyncio.create_task(first_token.event.wait())
+    try:
+        await asyncio.wait({call, first_token_wait}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        first_token_wait.cancel()
+    if not first_token.event.is_set():
+        call.result()
+
+
+async def _watch(call, first_token: FirstTokenHandler):
+    # the task runs in its own copy of the context, so only the model calls of `call` report to `first_token`.
+    _first_token_handler.set(first_token)
+    return await call
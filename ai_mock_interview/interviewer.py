@@ -1,23 +1,35 @@
 import logging
 import os
 import time
-from typing import Any, Literal, Union
+from dataclasses import dataclass
+from typing import AsyncIterator, Literal
 
 import dotenv
 from langchain.agents import AgentState, create_agent
-from langchain.agents.middleware import before_model
-from langchain.messages import RemoveMessage
+from langchain.agents.middleware import AgentMiddleware, ModelRequest
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import SystemMessage
 from langchain_openai import ChatOpenAI
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.checkpoint.memory import InMemorySaver
-from langgraph.graph.message import REMOVE_ALL_MESSAGES
-from langgraph.runtime import Runtime
+from langgraph.graph.state import CompiledStateGraph
 from pydantic import BaseModel
 
+from ai_mock_interview.clients import get_chat_model
+from ai_mock_interview.context import RunningSummaryMiddleware
+from ai_mock_interview.hedging import HedgingMiddleware
+from ai_mock_interview.metrics import STAGE_SECONDS, observe
+from ai_mock_interview.scheduler import UpstreamSchedulerMiddleware
+
 logger = logging.getLogger(__name__)
 
 dotenv.load_dotenv(override=False)
 
 INTERVIEWER_MODEL_NAME = os.getenv("INTERVIEWER_MODEL_NAME")
+# `achat` sends a second request when the model has no first token after the deadline, to the fallback model if set.
+INTERVIEWER_HEDGE_ENABLED = os.getenv("INTERVIEWER_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+INTERVIEWER_HEDGE_DEADLINE_SECONDS = float(os.getenv("INTERVIEWER_HEDGE_DEADLINE_SECONDS", 2.0))
+INTERVIEWER_FALLBACK_MODEL_NAME = os.getenv("INTERVIEWER_FALLBACK_MODEL_NAME")
 
 BEHAVIORAL_INTERVIEW_INTERVIEWER_SYSTEM_PROMPT = """
 You are an interviewer responsible for conducting a behavioral interview with a candidate. Follow these rules:
@@ -59,15 +71,18 @@ USER_PROFILE_SYSTEM_PROMPT = """
 * Name: {name}
 * Position: {position}
 """
+
+USER_CV_SYSTEM_PROMPT = """* CV (compact):
+```
+{cv}
+```
+"""
 INTERVIEWER_PERSONALITY_SYSTEM_PROMPT_FACTORY = {
     "strict": "You are a strict interviewer who challenges the interviewee’s answers to probe their depth of understanding and frequently asks difficult, in-depth questions.",
     "friendly": "You are a friendly interviewer who is supportive and encouraging toward the interviewee.",
 }
 
 
-N_HUMAN_MESSAGES_TO_KEEP = 5
-
-
 class InterviewerResponse(BaseModel):
     index: int
     content: str
@@ -89,11 +104,42 @@ def interviewer_system_prompt_factory(
     interviewer_personality: str,
     additional_instruction: str | None = None,
 ) -> str:
+    return interviewer_instructions_prompt(interview_type, interviewer_personality) + interviewer_profile_prompt(
+        name, position, years_of_experience, cv, additional_instruction
+    )
+
+
+def interviewer_instructions_prompt(
+    interview_type: Literal["Behavioral", "Technical"], interviewer_personality: str
+) -> str:
+    """The start of the system prompt, shared by the sessions with the same interview type and personality."""
     if interviewer_personality not in INTERVIEWER_PERSONALITY_SYSTEM_PROMPT_FACTORY:
         raise ValueError(f"Invalid interviewer personality: {interviewer_personality}")
     interviewer_personality_prompt = INTERVIEWER_PERSONALITY_SYSTEM_PROMPT_FACTORY[interviewer_personality].strip()
+    if interview_type == "Technical":
+        return TECHNICAL_INTERVIEW_INTERVIEWER_SYSTEM_PROMPT.format(
+            interviewer_personality_prompt=interviewer_personality_prompt,
+        )
+    elif interview_type == "Behavioral":
+        return BEHAVIORAL_INTERVIEW_INTERVIEWER_SYSTEM_PROMPT.format(
+            interviewer_personality_prompt=interviewer_personality_prompt,
+        )
+    else:
+        raise ValueError(f"Invalid interview type: {interview_type}")
+
+
+def interviewer_profile_prompt(
+    name: str,
+    position: str,
+    years_of_experience: float,
+    cv: str,
+    additional_instruction: str | None = None,
+) -> str:
+    """The end of the system prompt, specific to the session: the additional instruction and the profile."""
     if additional_instruction:
-        additional_instruction_prompt = ADDITIONAL_INSTRUCTION_PROMPT.format(additional_instruction=additional_instruction)
+        additional_instruction_prompt = ADDITIONAL_INSTRUCTION_PROMPT.format(
+            additional_instruction=additional_instruction
+        )
     else:
         additional_instruction_prompt = ""
 
@@ -104,79 +150,122 @@ def interviewer_system_prompt_factory(
         cv=cv.strip(),
         # interviewer_personality_prompt=interviewer_personality_prompt,
     )
+    if cv and cv.strip():
+        # the CV is the token-capped compact profile, see `cv.compact_profile`.
+        user_profile += USER_CV_SYSTEM_PROMPT.format(cv=cv.strip())
+    return additional_instruction_prompt + user_profile
+
+
+@dataclass
+class InterviewerContext:
+    """Runtime context of the runs of a session on the shared interviewer agent."""
+
+    api_key: str
+    # appended to the system prompt of the agent, see `interviewer_profile_prompt`.
+    profile_prompt: str
 
-    if interview_type == "Technical":
-        return (
-            TECHNICAL_INTERVIEW_INTERVIEWER_SYSTEM_PROMPT.format(
-                interviewer_personality_prompt=interviewer_personality_prompt,
-            )
-            + additional_instruction_prompt
-            + user_profile
-        )
-    elif interview_type == "Behavioral":
-        return (
-            BEHAVIORAL_INTERVIEW_INTERVIEWER_SYSTEM_PROMPT.format(
-                interviewer_personality_prompt=interviewer_personality_prompt,
-            )
-            + additional_instruction_prompt
-            + user_profile
-        )
-    else:
-        raise ValueError(f"Invalid interview type: {interview_type}")
 
+def interviewer_model(api_key: str) -> BaseChatModel:
+    # the hedging middleware watches the streamed tokens for the first one.
+    streaming = {"streaming": True} if INTERVIEWER_HEDGE_ENABLED else {}
+    return get_chat_model(api_key, model=INTERVIEWER_MODEL_NAME, temperature=0.7, **streaming)
 
-@before_model
-def trim_human_messages(state: InterviewerAgentState, runtime: Runtime) -> dict[str, Any] | None:
-    """Keep only the last few messages to fit context window."""
-    messages = state["messages"]
 
-    if len(messages) < 2:
-        return None  # No changes needed
+def interviewer_fallback_model(api_key: str) -> BaseChatModel:
+    return get_chat_model(api_key, model=INTERVIEWER_FALLBACK_MODEL_NAME, temperature=0.7, streaming=True)
 
-    # ai_message_ids = [m.id for m in messages if m.type == 'ai']
-    human_message_ids = [m.id for m in messages if m.type == "human"]
-    if len(human_message_ids) <= N_HUMAN_MESSAGES_TO_KEEP:
-        return None
 
-    new_messages = [RemoveMessage(id=i) for i in human_message_ids[:-N_HUMAN_MESSAGES_TO_KEEP]]
-    return {"messages": new_messages}
+class InterviewerSessionMiddleware(AgentMiddleware):
+    """
+    Make the model calls of the shared interviewer agent for the session of the run, as told by its
+    `InterviewerContext`: with the model of its API key, and its profile appended to the system prompt.
+    """
+
+    def wrap_model_call(self, request, handler):
+        return handler(self._session_request(request))
+
+    async def awrap_model_call(self, request, handler):
+        return await handler(self._session_request(request))
+
+    @staticmethod
+    def _session_request(request: ModelRequest) -> ModelRequest:
+        context: InterviewerContext = request.runtime.context
+        return request.override(
+            model=interviewer_model(context.api_key),
+            system_message=SystemMessage(request.system_message.text + context.profile_prompt),
+        )
+
+
+# (interview type, personality, checkpointer) -> compiled interviewer agent
+INTERVIEWER_AGENTS: dict[tuple[str, str, BaseCheckpointSaver], CompiledStateGraph] = {}
+# used by the interviewers created without a checkpointer.
+DEFAULT_CHECKPOINTER = InMemorySaver()
+
+
+def get_interviewer_agent(
+    interview_type: str, interviewer_personality: str, checkpointer: BaseCheckpointSaver
+) -> CompiledStateGraph:
+    """
+    The compiled interviewer agent for the interview type and personality, shared by all the sessions using
+    `checkpointer`. Their runs are told apart by the `thread_id`, and pass an `InterviewerContext`.
+    """
+    key = (interview_type, interviewer_personality, checkpointer)
+    agent = INTERVIEWER_AGENTS.get(key)
+    if agent is not None:
+        return agent
+    middleware = [RunningSummaryMiddleware(), InterviewerSessionMiddleware(), UpstreamSchedulerMiddleware()]
+    if INTERVIEWER_HEDGE_ENABLED:
+        fallback_model = interviewer_fallback_model if INTERVIEWER_FALLBACK_MODEL_NAME else None
+        # outside of the scheduler middleware, so the hedge gets its own slot and retries.
+        middleware.insert(2, HedgingMiddleware(INTERVIEWER_HEDGE_DEADLINE_SECONDS, fallback_model))
+    agent = create_agent(
+        # never called, each call uses the model of the session, see `InterviewerSessionMiddleware`.
+        ChatOpenAI(api_key="unused"),
+        checkpointer=checkpointer,
+        state_schema=InterviewerAgentState,
+        context_schema=InterviewerContext,
+        middleware=middleware,
+        system_prompt=interviewer_instructions_prompt(interview_type, interviewer_personality),
+    )
+    INTERVIEWER_AGENTS[key] = agent
+    logger.info(f"Compiled the interviewer agent: {interview_type}, {interviewer_personality}.")
+    return agent
 
 
 class Interviewer:
-    def __init__(self, config: dict):
+    def __init__(self, config: dict, checkpointer: BaseCheckpointSaver | None = None):
         self.message_historys = []
-        self.memory = InMemorySaver()
+        self.memory = checkpointer or DEFAULT_CHECKPOINTER
         api_key = config.get("openai_api_key")
 
-        self.system_prompt = interviewer_system_prompt_factory(
-            interview_type=config["interview_type"],
+        profile_prompt = interviewer_profile_prompt(
             name=config["name"],
             position=config["position"],
             years_of_experience=config["years_of_experience"],
             cv=config["cv_str"],
-            interviewer_personality=config["interviewer_personality"],
             additional_instruction=config.get("additional_instruction"),
         )
-        model = ChatOpenAI(name=INTERVIEWER_MODEL_NAME, temperature=0.7, api_key=api_key)
-        self.agent = create_agent(
-            model,
-            checkpointer=self.memory,
-            state_schema=InterviewerAgentState,
-            middleware=[trim_human_messages],
-            system_prompt=self.system_prompt,
-        )
+        self.context = InterviewerContext(api_key=api_key, profile_prompt=profile_prompt)
+        self.agent = get_interviewer_agent(config["interview_type"], config["interviewer_personality"], self.memory)
         logger.info("Successfully generate interviewer agent.")
-        logger.info(f"System prompt:\n {self.system_prompt}")
+        # the system prompt holds the CV, keep it out of the INFO logs.
+        logger.debug(
+            "System prompt:\n "
+            + interviewer_instructions_prompt(config["interview_type"], config["interviewer_personality"])
+            + profile_prompt
+        )
 
     def chat(self, user_input: str, session_id: str) -> InterviewerResponse:
         logger.info("Calling Interviewer agent...")
         start_time = time.time()
-        response = self.agent.invoke(
-            {
-                "messages": [{"role": "user", "content": user_input}],
-            },
-            config={"configurable": {"thread_id": session_id}},
-        )
+        with observe("interviewer", INTERVIEWER_MODEL_NAME):
+            response = self.agent.invoke(
+                {
+                    "messages": [{"role": "user", "content": user_input}],
+                },
+                config={"configurable": {"thread_id": session_id}},
+                context=self.context,
+            )
         end_time = time.time()
         logger.info(f"Interviewer agent call took {end_time - start_time:.2f} seconds")
         current_index = len(self.message_historys) // 2 + 1
@@ -191,12 +280,14 @@ class Interviewer:
     async def achat(self, user_input: str, session_id: str) -> InterviewerResponse:
         logger.info("Calling Interviewer agent...")
         start_time = time.time()
-        response = await self.agent.ainvoke(
-            {
-                "messages": [{"role": "user", "content": user_input}],
-            },
-            config={"configurable": {"thread_id": session_id}},
-        )
+        with observe("interviewer", INTERVIEWER_MODEL_NAME):
+            response = await self.agent.ainvoke(
+                {
+                    "messages": [{"role": "user", "content": user_input}],
+                },
+                config={"configurable": {"thread_id": session_id, "hedge": INTERVIEWER_HEDGE_ENABLED}},
+                context=self.context,
+            )
         end_time = time.time()
         logger.info(f"Interviewer agent call took {end_time - start_time:.2f} seconds")
         current_index = len(self.message_historys) // 2 + 1
@@ -208,6 +299,49 @@ class Interviewer:
         text_content = response["messages"][-1].content
         return InterviewerResponse(index=current_index, content=text_content)
 
+    async def astream_chat(self, user_input: str, session_id: str) -> AsyncIterator[InterviewerResponse]:
+        """Stream the interviewer reply as text deltas, each wrapped in an `InterviewerResponse`."""
+        logger.info("Calling Interviewer agent (streaming)...")
+        start_time = time.time()
+        first_token_time = None
+        # the model calls are not retried once their tokens were sent, see `UpstreamSchedulerMiddleware`.
+        config = {"configurable": {"thread_id": session_id, "streaming": True, "hedge": INTERVIEWER_HEDGE_ENABLED}}
+        current_index = len(self.message_historys) // 2 + 1
+        message_id = None
+        with observe("interviewer", INTERVIEWER_MODEL_NAME):
+            async for chunk, metadata in self.agent.astream(
+                {
+                    "messages": [{"role": "user", "content": user_input}],
+                },
+                config=config,
+                context=self.context,
+                stream_mode="messages",
+            ):
+                if metadata.get("langgraph_node") != "model" or chunk.type not in ("ai", "AIMessageChunk"):
+                    continue
+                delta = chunk.text
+                if not delta:
+                    continue
+                if message_id is None:
+                    message_id = chunk.id
+                elif chunk.id != message_id:
+                    # from a hedged call losing to this one, cancelled right after it streamed its first token.
+                    continue
+                if first_token_time is None:
+                    first_token_time = time.time()
+                    logger.info(f"Interviewer agent first token took {first_token_time - start_time:.2f} seconds")
+                    STAGE_SECONDS.observe(
+                        first_token_time - start_time, stage="interviewer_first_token", model=INTERVIEWER_MODEL_NAME
+                    )
+                yield InterviewerResponse(index=current_index, content=delta)
+        end_time = time.time()
+        logger.info(f"Interviewer agent call took {end_time - start_time:.2f} seconds")
+        # update history
+        state = await self.agent.aget_state(config)
+        latest_conversation = state.values["messages"][-2:]
+        for message in latest_conversation:
+            self.message_historys.append(message)
+
     def save_history(self, session_id: str):
         with open(f"history_{session_id}.txt", "w") as f:
             for m in self.message_historys:
@@ -0,0 +1,157 @@
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# abbreviations expanded before lookup, so "Sr. ML Engineer" and "senior machine-learning engineer" match.
+JOB_TITLE_ABBREVIATIONS = {
+    "sr": "senior",
+    "snr": "senior",
+    "jr": "junior",
+    "ml": "machine learning",
+    "swe": "software engineer",
+    "sde": "software engineer",
+    "sre": "site reliability engineer",
+    "eng": "engineer",
+    "engr": "engineer",
+    "dev": "developer",
+    "mgr": "manager",
+    "pm": "product manager",
+    "cv": "computer vision",
+    "fullstack": "full stack",
+    "frontend": "front end",
+    "backend": "back end",
+}
+# words that don't change whether a title is a job title.
+JOB_TITLE_MODIFIERS = {
+    "senior",
+    "junior",
+    "lead",
+    "principal",
+    "staff",
+    "intern",
+    "associate",
+    "entry",
+    "level",
+    "mid",
+    "i",
+    "ii",
+    "iii",
+    "iv",
+}
+_TOKEN_PATTERN = re.compile(r"[a-z0-9+#]+")
+
+
+def normalize_job_title(job_title: str) -> str:
+    """Lowercase, drop punctuation and expand abbreviations, e.g. "Sr. ML-Eng" -> "senior machine learning engineer"."""
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(job_title.lower()):
+        tokens.extend(JOB_TITLE_ABBREVIATIONS.get(token, token).split())
+    return " ".join(tokens)
+
+
+def job_title_tokens(job_title: str) -> frozenset[str]:
+    """The set of meaningful tokens of a title, ignoring seniority modifiers, word order and plurals."""
+    tokens = normalize_job_title(job_title).split()
+    tokens = [_singularize(t) for t in tokens if t not in JOB_TITLE_MODIFIERS] or tokens
+    return frozenset(tokens)
+
+
+def _singularize(token: str) -> str:
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+class JobTitleCache:
+    """
+    A bounded LRU cache of job title validity, persisted to a local JSON file.
+
+    Titles are looked up by their token set (see `job_title_tokens`), so reordered or abbreviated
+    titles hit the same entry. Titles that are only similar are not matched: sharing most words with a
+    known title doesn't make one valid, e.g. "front end developer" and "front end developer banana". Seed
+    titles are never evicted. The file is re-read when another worker changed it.
+    """
+
+    def __init__(self, path: str | Path | None, maxsize: int = 10_000, seeds: dict[str, bool] | None = None):
+        self.path = Path(path) if path else None
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._seeds: dict[frozenset[str], bool] = {job_title_tokens(k): bool(v) for k, v in (seeds or {}).items()}
+        self._titles: OrderedDict[frozenset[str], bool] = OrderedDict()
+        self._mtime_ns: int | None = None
+        self.reload_if_changed()
+
+    def __len__(self) -> int:
+        return len(self._seeds) + len(self._titles)
+
+    def get(self, job_title: str) -> bool | None:
+        key = job_title_tokens(job_title)
+        if not key:
+            return None
+        with self._lock:
+            if key in self._seeds:
+                return self._seeds[key]
+            if key in self._titles:
+                self._titles.move_to_end(key)
+                return self._titles[key]
+            return None
+
+    def set(self, job_title: str, valid: bool):
+        key = job_title_tokens(job_title)
+        if not key or key in self._seeds:
+            return
+        with self._lock:
+            self._set(key, bool(valid))
+
+    def reload_if_changed(self):
+        """Merge entries written by other workers into the cache."""
+        if self.path is None:
+            return
+        try:
+            mtime_ns = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime_ns == self._mtime_ns:
+            return
+        titles = self._read()
+        with self._lock:
+            for title, valid in titles.items():
+                key = frozenset(title.split())
+                if key not in self._seeds and key not in self._titles:
+                    self._set(key, valid)
+            self._mtime_ns = mtime_ns
+
+    def save(self):
+        """Write the learned titles to disk, merged with what other workers have written."""
+        if self.path is None:
+            return
+        self.reload_if_changed()
+        with self._lock:
+            titles = {" ".join(sorted(key)): valid for key, valid in self._titles.items()}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "titles": titles}, f)
+        os.replace(tmp_path, self.path)
+        self._mtime_ns = self.path.stat().st_mtime_ns
+        logger.debug(f"Saved {len(titles)} job titles to {self.path}")
+
+    def _read(self) -> dict[str, bool]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return {str(k): bool(v) for k, v in json.load(f).get("titles", {}).items()}
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning(f"Failed to load job title cache from {self.path}: {e}")
+            return {}
+
+    def _set(self, key: frozenset[str], valid: bool):
+        self._titles[key] = valid
+        self._titles.move_to_end(key)
+        while len(self._titles) > self.maxsize:
+            self._titles.popitem(last=False)
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import uuid
+from typing import Awaitable, Callable
+
+from ai_mock_interview.backends import SessionBackend
+
+logger = logging.getLogger(__name__)
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_FINISHED_STATUSES = (JOB_DONE, JOB_FAILED)
+
+
+class BackgroundJobs:
+    """
+    Run per-session jobs (e.g. diagnosis) in the background of the current worker.
+
+    Job states are saved in the session backend, so any worker can report them. Submitting a job for a
+    session that already has one running on this worker returns the running job instead of starting another.
+    """
+
+    def __init__(self, backend: SessionBackend, name: str = "job"):
+        self.backend = backend
+        self.name = name
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._running_jobs: dict[str, str] = {}  # session id -> job id
+
+    async def submit(self, session_id: str, run: Callable[[], Awaitable[dict]]) -> dict:
+        job_id = self._running_jobs.get(session_id)
+        if job_id is not None:
+            return await self.get(job_id)
+
+        job = {
+            "job_id": str(uuid.uuid4()),
+            "session_id": session_id,
+            "status": JOB_PENDING,
+            "result": None,
+            "error": None,
+        }
+        self._running_jobs[session_id] = job["job_id"]
+        try:
+            await self.backend.save_job(job)
+        except BaseException:
+            del self._running_jobs[session_id]
+            raise
+        self._tasks[job["job_id"]] = asyncio.create_task(self._run(job, run))
+        logger.info(f"Submitted {self.name} {job['job_id']} for session {session_id}")
+        return job
+
+    async def get(self, job_id: str) -> dict | None:
+        return await self.backend.load_job(job_id)
+
+    async def latest(self, session_id: str, status: str = JOB_DONE) -> dict | None:
+        """The last job of a session in `status`, from any worker."""
+        jobs = [job for job in await self.backend.load_session_jobs(session_id) if job["status"] == status]
+        return jobs[-1] if jobs else None
+
+    async def wait(self, job_id: str) -> dict | None:
+        """Wait for a job running on this worker, and return its final state."""
+        task = self._tasks.get(job_id)
+        if task is not None:
+            await asyncio.wait([task])
+        return await self.get(job_id)
+
+    def cancel_all(self):
+        for task in self._tasks.values():
+            task.cancel()
+
+    async def _run(self, job: dict, run: Callable[[], Awaitable[dict]]):
+        try:
+            job["status"] = JOB_RUNNING
+            await self.backend.save_job(job)
+            job["result"] = await run()
+            job["status"] = JOB_DONE
+        except Exception as e:
+            logger.exception(f"{self.name} {job['job_id']} failed: {e}")
+            job["status"] = JOB_FAILED
+            job["error"] = str(e)
+        finally:
+            del self._running_jobs[job["session_id"]]
+            self._tasks.pop(job["job_id"], None)
+        await self.backend.save_job(job)
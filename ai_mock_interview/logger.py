@@ -1,55 +1,186 @@
+import json
 import logging
 import logging.config
+import os
+import queue
+import random
 import sys
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
 from pathlib import Path
 
+import dotenv
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+dotenv.load_dotenv(override=False)
 
-def get_logging_config():
-    log_dir = BASE_DIR / "logs"
-    log_dir.mkdir(exist_ok=True)
-    log_file = log_dir / "app.log"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_DIR = os.getenv("LOG_DIR", str(BASE_DIR / "logs"))
+# "text" or "json" (one JSON object per line)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))
+# rotate on time instead of size, e.g. "midnight" or "H", see `logging.handlers.TimedRotatingFileHandler`.
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "")
+# records waiting for the writer thread, more are dropped.
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10_000))
+LOG_MAX_MESSAGE_CHARS = int(os.getenv("LOG_MAX_MESSAGE_CHARS", 2000))
+# share of the INFO and DEBUG records of `LOG_SAMPLED_LOGGERS` that are kept.
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 1.0))
+LOG_SAMPLED_LOGGERS = os.getenv("LOG_SAMPLED_LOGGERS", "uvicorn.access")
+
+DEFAULT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class SampleFilter(logging.Filter):
+    """Keep a `rate` share of the records below WARNING from `loggers` (comma-separated names)."""
+
+    def __init__(self, rate: float = LOG_SAMPLE_RATE, loggers: str = LOG_SAMPLED_LOGGERS):
+        super().__init__()
+        self.rate = rate
+        self.loggers = tuple(name.strip() for name in loggers.split(",") if name.strip())
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate >= 1 or record.levelno >= logging.WARNING:
+            return True
+        if not any(record.name == name or record.name.startswith(f"{name}.") for name in self.loggers):
+            return True
+        return random.random() < self.rate
+
+
+class TruncateFilter(logging.Filter):
+    """Truncate messages longer than `max_chars`, tracebacks are kept whole."""
+
+    def __init__(self, max_chars: int = LOG_MAX_MESSAGE_CHARS):
+        super().__init__()
+        self.max_chars = max_chars
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        message = record.getMessage()
+        if len(message) > self.max_chars:
+            message = f"{message[: self.max_chars]}... [{len(message) - self.max_chars} chars truncated]"
+        record.msg, record.args = message, None
+        return True
 
+
+class _QueueListener(QueueListener):
+    def enqueue_sentinel(self):
+        # wait for room, the writer thread is still draining the queue.
+        self.queue.put(self._sentinel)
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """
+    Hand the records over to a writer thread, which sends them to the console and the rotating log file of
+    the process, so logging never blocks the event loop on I/O. When the queue is full, records are dropped and counted,
+    and a warning reports them once there is room again.
+    """
+
+    def __init__(self, queue_size: int = LOG_QUEUE_SIZE):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.dropped = 0
+        self.listener: QueueListener | None = _QueueListener(
+            self.queue, *create_target_handlers(), respect_handler_level=True
+        )
+        self.listener.start()
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            warning = logging.makeLogRecord(
+                {
+                    "name": __name__,
+                    "levelno": logging.WARNING,
+                    "levelname": "WARNING",
+                    "msg": f"Log queue is full, dropped {dropped} record(s).",
+                }
+            )
+            try:
+                self.queue.put_nowait(warning)
+            except queue.Full:
+                self.dropped += dropped
+
+    def close(self):
+        # also called by `logging.shutdown` at exit, and when the config is applied again.
+        if self.listener is not None:
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.close()
+            self.listener = None
+        super().close()
+
+
+def create_target_handlers() -> list[logging.Handler]:
+    log_dir = Path(LOG_DIR)
+    log_dir.mkdir(parents=True, exist_ok=True)
+    # one file per process: the workers of uvicorn rotating a shared file would lose and truncate records.
+    # opened on the first record, so the processes that don't log (e.g. the CV parsers) leave no file.
+    log_file = log_dir / f"app.{os.getpid()}.log"
+    if LOG_ROTATE_WHEN:
+        file_handler = TimedRotatingFileHandler(
+            log_file, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding="utf-8", delay=True
+        )
+    else:
+        file_handler = RotatingFileHandler(
+            log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8", delay=True
+        )
+    console_handler = logging.StreamHandler(sys.stdout)
+    formatter = JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(DEFAULT_FORMAT)
+    for handler in (console_handler, file_handler):
+        handler.setFormatter(formatter)
+    return [console_handler, file_handler]
+
+
+def get_logging_config():
     return {
         "version": 1,
         "disable_existing_loggers": False,
-        "formatters": {
-            "default": {
-                "format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-            },
+        "filters": {
+            "sample": {"()": SampleFilter},
+            "truncate": {"()": TruncateFilter},
         },
         "handlers": {
-            "console": {
-                "formatter": "default",
-                "class": "logging.StreamHandler",
-                "stream": "ext://sys.stdout",
-            },
-            "file": {
-                "formatter": "default",
-                "class": "logging.FileHandler",
-                "filename": str(log_file),
-                "encoding": "utf-8",
+            "queue": {
+                "()": BackgroundQueueHandler,
+                "filters": ["sample", "truncate"],
             },
         },
         "loggers": {
             "": {  # root logger
-                "handlers": ["console", "file"],
-                "level": "INFO",
+                "handlers": ["queue"],
+                "level": LOG_LEVEL,
             },
             "uvicorn": {
-                "handlers": ["console", "file"],
-                "level": "INFO",
+                "handlers": ["queue"],
+                "level": LOG_LEVEL,
                 "propagate": False,
             },
             "uvicorn.error": {
-                "handlers": ["console", "file"],
-                "level": "INFO",
+                "handlers": ["queue"],
+                "level": LOG_LEVEL,
                 "propagate": False,
             },
             "uvicorn.access": {
-                "handlers": ["console", "file"],
-                "level": "INFO",
+                "handlers": ["queue"],
+                "level": LOG_LEVEL,
                 "propagate": False,
             },
         },
@@ -1,14 +1,17 @@
+import asyncio
 import base64
+import hashlib
+import json
 import logging
 import os
 import tempfile
-import time
 import uuid
-from io import BytesIO
+import zipfile
+from contextlib import asynccontextmanager
+from functools import partial
 from pathlib import Path
 from typing import Optional
 
-import fitz
 import uvicorn
 from dotenv import load_dotenv
 from fastapi import (
@@ -16,32 +19,100 @@ from fastapi import (
     File,
     Form,
     HTTPException,
+    Query,
     UploadFile,
     WebSocket,
     WebSocketDisconnect,
 )
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from openai import AsyncOpenAI
-
-from ai_mock_interview.interviewer import Interviewer
+from openai import AsyncOpenAI, omit
+
+from ai_mock_interview.archive import AudioArchive
+from ai_mock_interview.clients import CLIENT_REGISTRY, get_async_client
+from ai_mock_interview.context import TOKEN_COUNTER
+from ai_mock_interview.cv import CV, CVTooLargeError, ashutdown_cv_parser, ingest_cv, remove_upload, start_cv_parser
+from ai_mock_interview.dispatcher import SessionDispatcher
+from ai_mock_interview.evaluation import RollingEvaluator
+from ai_mock_interview.export import EXPORT_FORMATS, aiter_transcript
+from ai_mock_interview.interviewer import Interviewer, InterviewerResponse
+from ai_mock_interview.jobs import JOB_FAILED, JOB_FINISHED_STATUSES, BackgroundJobs
 from ai_mock_interview.logger import configure_logging, get_logging_config
-from ai_mock_interview.reviewer import review
-from ai_mock_interview.tutor import Tutor
-from ai_mock_interview.utils import check_job_title_valid, check_openai_api_key
+from ai_mock_interview.metrics import (
+    ACTIVE_SESSIONS,
+    CONNECTED_SESSIONS,
+    MetricsMiddleware,
+    observe,
+    render_metrics,
+)
+from ai_mock_interview.protocol import audio_format, decode_binary_frame
+from ai_mock_interview.reviewer import areview
+from ai_mock_interview.scheduler import UPSTREAM_SCHEDULER
+from ai_mock_interview.sessions import SessionStore
+from ai_mock_interview.transcriber import StreamingTranscriber
+from ai_mock_interview.tts import (
+    DEFAULT_TTS_FORMAT,
+    REPLAY_FORMATS,
+    TTS_CACHE,
+    areplay_file,
+    astream_speech,
+    negotiate_tts_format,
+)
+from ai_mock_interview.tutor import SpeculativeTutor, Tutor
+from ai_mock_interview.utils import (
+    SentenceSplitter,
+    acheck_job_title_valid,
+    acheck_openai_api_key,
+)
 
 load_dotenv(override=False)
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-STT_FILENAME = "speech.webm"
+STT_FILENAME = "speech.{format}"
+STT_MODEL_NAME = "whisper-1"
+# config values left out of the logs
+SECRET_CONFIG_KEYS = ("openai_api_key", "cv_str")
+DIAGNOSIS_POLL_INTERVAL_SECONDS = float(os.getenv("DIAGNOSIS_POLL_INTERVAL_SECONDS", 1))
+# the audio zip is built in memory up to this size, then on disk.
+ZIP_SPOOL_MAX_BYTES = 1024 * 1024
 # client = OpenAI()
 
 SESSION_CONSTANTS = dict()
 
 configure_logging()
 logger = logging.getLogger(__name__)
-app = FastAPI()
+
+
+# 儲存 Session 設定 (In-memory storage)
+session_store = SessionStore()
+diagnosis_jobs = BackgroundJobs(session_store.backend, name="diagnosis")
+rolling_evaluator = RollingEvaluator(session_store.backend)
+audio_archive = AudioArchive()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await session_store.start()
+    await audio_archive.start()
+    # before the first interviewer turn needs it, without holding up the startup.
+    TOKEN_COUNTER.start_loading()
+    start_cv_parser()
+    session_sweeper = asyncio.create_task(session_store.run_sweeper())
+    archive_pruner = asyncio.create_task(audio_archive.run_pruner())
+    yield
+    session_sweeper.cancel()
+    archive_pruner.cancel()
+    diagnosis_jobs.cancel_all()
+    rolling_evaluator.cancel_all()
+    await audio_archive.close()
+    await session_store.close()
+    # close the shared OpenAI connection pools.
+    await CLIENT_REGISTRY.aclose()
+    await ashutdown_cv_parser()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # 設定 CORS，允許前端 (通常是 localhost) 存取
 app.add_middleware(
@@ -51,6 +122,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# counts open websockets and times every websocket send.
+app.add_middleware(MetricsMiddleware)
 
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -66,24 +139,112 @@ async def read_index():
     return FileResponse(FRONTEND_DIR / "index.html")
 
 
-# 儲存 Session 設定 (In-memory storage)
-sessions = {}
-interviewer_agents: dict[str, Interviewer] = {}
+@app.get("/sessions/stats")
+async def session_stats():
+    return {**session_store.stats(), "upstream": UPSTREAM_SCHEDULER.stats()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics of this worker."""
+    stats = session_store.stats()
+    ACTIVE_SESSIONS.set(stats["sessions"])
+    CONNECTED_SESSIONS.set(stats["connected_sessions"])
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/download_history/{session_id}")
-async def download_history(session_id: str):
-    if session_id not in interviewer_agents:
+async def download_history(
+    session_id: str,
+    format_: str = Query("txt", alias="format"),
+    include_tutor: bool = False,
+    include_diagnosis: bool = False,
+):
+    """
+    Stream the transcript as `txt`, `jsonl` or `md`, optionally with the tutor help given during the
+    interview and the last diagnosis. Messages are read and sent in batches, never all at once.
+    """
+    if await session_store.get_config(session_id) is None:
         return {"error": "Agent not found."}
+    if format_ not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format_}")
+
+    tutor_outputs = await session_store.backend.load_tutor_outputs(session_id) if include_tutor else None
+    diagnosis_job = await diagnosis_jobs.latest(session_id) if include_diagnosis else None
+    transcript = aiter_transcript(
+        session_store.iter_messages(session_id),
+        format_,
+        tutor_outputs=tutor_outputs,
+        diagnosis=diagnosis_job["result"] if diagnosis_job else None,
+    )
+    return StreamingResponse(
+        transcript,
+        media_type=EXPORT_FORMATS[format_],
+        headers={"Content-Disposition": f'attachment; filename="history_{session_id}.{format_}"'},
+    )
+
+
+@app.get("/audio/{session_id}/{index}")
+async def replay_audio(session_id: str, index: int):
+    """The audio of an interviewer message, from the TTS cache. Supports range requests."""
+    config = await session_store.get_config(session_id)
+    if config is None:
+        raise HTTPException(status_code=404, detail=f"Invalid session_id: {session_id}.")
+    audio = (await session_store.backend.load_reply_audio(session_id)).get(index)
+    if audio is None:
+        raise HTTPException(status_code=404, detail="Audio not found")
+    file = await areplay_file(get_async_client(config["openai_api_key"]), audio["sentences"], audio["format"])
+    if file is None:
+        raise HTTPException(status_code=404, detail="Audio not found")
+    media_type, extension = REPLAY_FORMATS[audio["format"]]
+    return FileResponse(
+        file, media_type=media_type, filename=f"interviewer_{index}.{extension}", content_disposition_type="inline"
+    )
 
-    interviewer = interviewer_agents[session_id]
 
-    with tempfile.NamedTemporaryFile(mode="wt", delete=False) as tmp:
-        for m in interviewer.message_historys:
-            tmp.writelines(f"{m.type:<6}: {m.content}\n" + "-" * 20 + "\n\n")
-        tmp.flush()
-        return FileResponse(tmp.name, filename=f"history_{session_id}.txt")
-    return {"error": "File not found"}
+@app.get("/download_audio/{session_id}")
+async def download_audio(session_id: str):
+    """The transcript and the audio of every interviewer message, as a zip. Supports range requests."""
+    config = await session_store.get_config(session_id)
+    if config is None:
+        raise HTTPException(status_code=404, detail=f"Invalid session_id: {session_id}.")
+    client = get_async_client(config["openai_api_key"])
+    transcript = [chunk async for chunk in aiter_transcript(session_store.iter_messages(session_id))]
+    files = {"transcript.txt": "".join(transcript).encode()}
+    for index, audio in sorted((await session_store.backend.load_reply_audio(session_id)).items()):
+        file = await areplay_file(client, audio["sentences"], audio["format"])
+        if file is not None:
+            files[f"interviewer_{index}.{REPLAY_FORMATS[audio['format']][1]}"] = file
+    archive = await asyncio.to_thread(build_zip, files)
+    if archive is None:
+        raise HTTPException(status_code=404, detail="Audio not found")
+    return FileResponse(archive, media_type="application/zip", filename=f"interview_{session_id}.zip")
+
+
+def build_zip(files: dict[str, bytes | Path]) -> Path | None:
+    """
+    Zip the files into the TTS cache, keyed by their names and content like the audio, so repeated exports
+    are reused without zipping again. The zip is spooled to disk, never held in memory as a whole.
+    """
+    digest = hashlib.sha256()
+    for name, content in files.items():
+        # the cached audio files are named after their content.
+        content_id = content.name.encode() if isinstance(content, Path) else hashlib.sha256(content).digest()
+        digest.update(name.encode() + b"\0" + content_id + b"\0")
+    key = digest.hexdigest()
+    file = TTS_CACHE.file(key, "zip")
+    if file is not None:
+        return file
+    with tempfile.SpooledTemporaryFile(ZIP_SPOOL_MAX_BYTES) as buffer:
+        with zipfile.ZipFile(buffer, "w") as archive:
+            for name, content in files.items():
+                # the audio is already compressed.
+                if isinstance(content, Path):
+                    archive.write(content, name, compress_type=zipfile.ZIP_STORED)
+                else:
+                    archive.writestr(name, content, compress_type=zipfile.ZIP_DEFLATED)
+        buffer.seek(0)
+        return TTS_CACHE.set(key, "zip", buffer)
 
 
 @app.post("/setup")
@@ -96,34 +257,43 @@ async def setup_interview(
     openai_api_key: Optional[str] = Form(OPENAI_API_KEY),
     cv: UploadFile = File(None),
     enable_voice: bool = Form(True),
+    enable_streaming: bool = Form(True),
+    enable_rolling_review: bool = Form(False),
+    enable_speculative_tutor: bool = Form(False),
+    # comma-separated TTS output formats the client can play, in order of preference.
+    audio_formats: Optional[str] = Form(None),
     additional_instruction: Optional[str] = Form(None),
     # enable_advice: bool = Form(True),
 ):
-    if not check_openai_api_key(openai_api_key):
-        raise HTTPException(status_code=400, detail="Invalid OpenAI API Key.")
-
-    if not check_job_title_valid(openai_api_key, position):
-        raise HTTPException(status_code=400, detail=f"Invalid job title: {position}")
-
     session_id = str(uuid.uuid4())
-
-    cv_filename = None
-    cv_str = ""
-    if cv:
-        cv_content = await cv.read()
-        try:
-            with fitz.open(stream=cv_content, filetype="pdf") as doc:
-                for page in doc:
-                    cv_str += page.get_text()
-        except Exception as e:
-            logger.error(f"Error parsing CV: {e}")
-
-        os.makedirs("uploads", exist_ok=True)
-        cv_filename = f"uploads/{session_id}_{cv.filename}"
-        with open(cv_filename, "wb") as f:
-            f.write(cv_content)
-
-    sessions[session_id] = {
+    # validations and CV ingestion are independent, run them concurrently.
+    with observe("setup_validation"):
+        is_api_key_valid, is_job_title_valid, cv_result = await asyncio.gather(
+            acheck_openai_api_key(openai_api_key),
+            acheck_job_title_valid(openai_api_key, position),
+            ingest_cv(cv, session_id) if cv else asyncio.sleep(0),
+            return_exceptions=True,
+        )
+    cv_filename = cv_result.path if isinstance(cv_result, CV) else None
+    try:
+        if is_api_key_valid is not True:
+            raise HTTPException(status_code=400, detail="Invalid OpenAI API Key.")
+
+        if isinstance(is_job_title_valid, BaseException):
+            raise is_job_title_valid
+        if not is_job_title_valid:
+            raise HTTPException(status_code=400, detail=f"Invalid job title: {position}")
+
+        if isinstance(cv_result, CVTooLargeError):
+            raise HTTPException(status_code=413, detail=str(cv_result))
+        if isinstance(cv_result, BaseException):
+            raise cv_result
+    except BaseException:
+        remove_upload(cv_filename)
+        raise
+    cv_str = cv_result.profile if cv_filename else ""
+
+    config = {
         "name": name,
         "position": position,
         "years_of_experience": years_of_experience,
@@ -132,42 +302,96 @@ async def setup_interview(
         "openai_api_key": openai_api_key,
         "cv_path": cv_filename,
         "cv_str": cv_str,
+        "cv_hash": cv_result.content_hash if cv_filename else None,
         "enable_voice": enable_voice,
+        "tts_format": negotiate_tts_format(audio_formats),
+        "enable_streaming": enable_streaming,
+        "enable_rolling_review": enable_rolling_review,
+        "enable_speculative_tutor": enable_speculative_tutor,
         "additional_instruction": additional_instruction,
         # "enable_advice": enable_advice,
     }
+    await session_store.add(session_id, config)
     logger.info(f"Session created: {session_id}")
-    logger.debug(f"config: {sessions[session_id]}")
+    # never log the API key, the CV is logged truncated.
+    logger.debug(f"config: { {key: value for key, value in config.items() if key not in SECRET_CONFIG_KEYS} }")
     logger.debug("-" * 20)
     logger.debug(f"cv_str: {cv_str[:100]}...")  # Log only first 100 chars
     # raise ValueError()
-    return {"session_id": session_id}
+    return {"session_id": session_id, "audio_format": config["tts_format"]}
 
 
 @app.post("/diagnosis")
 async def diagnosis(data: dict):
-    session_id = data.get("session_id")
-    logger.info(f"Diagnosis request for session_id: {session_id}")
-    assert session_id in sessions, f"Invalid session_id: {session_id}."
+    """Diagnose the interview and wait for the result, see `/diagnosis/jobs` to run it in the background."""
+    job = await submit_diagnosis(data.get("session_id"))
+    job = await diagnosis_jobs.wait(job["job_id"])
+    if job["status"] == JOB_FAILED:
+        raise HTTPException(status_code=500, detail=f"Diagnosis failed: {job['error']}")
+    return job["result"]
+
+
+@app.post("/diagnosis/jobs")
+async def create_diagnosis_job(data: dict):
+    job = await submit_diagnosis(data.get("session_id"))
+    return {"job_id": job["job_id"], "status": job["status"]}
+
+
+@app.get("/diagnosis/jobs/{job_id}")
+async def get_diagnosis_job(job_id: str):
+    job = await diagnosis_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/diagnosis/jobs/{job_id}/events")
+async def stream_diagnosis_job(job_id: str):
+    """Server-sent events of the job state, until it is done or failed."""
+    job = await diagnosis_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        current = job
+        last_status = None
+        while True:
+            if current["status"] != last_status:
+                last_status = current["status"]
+                yield f"data: {json.dumps(current)}\n\n"
+            if last_status in JOB_FINISHED_STATUSES:
+                return
+            await asyncio.sleep(DIAGNOSIS_POLL_INTERVAL_SECONDS)
+            current = await diagnosis_jobs.get(job_id) or current
 
-    interviewer = interviewer_agents[session_id]
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
-    review_result = review(
-        api_key=sessions[session_id]["openai_api_key"],
-        histories=interviewer.message_historys,
-        position=sessions[session_id]["position"],
-        years_of_experience=sessions[session_id]["years_of_experience"],
-        cv=sessions[session_id]["cv_str"],
-    )
-    logger.info(f"Successfully get the review result: {review_result.model_dump()}")
-    review_result_dict = review_result.model_dump()
-    # replace key:
-    # review_result_dict["the-chances-of-getting-this-job"] = review_result_dict.pop("the_chances_of_getting_this_job")
-    # review_result_dict["the-chances-of-getting-this-job"] = review_result_dict.pop("what_to_improve")
 
-    # In the future, you can use the session_id to retrieve the interview data
-    # and generate a real diagnosis.
-    return review_result_dict
+async def submit_diagnosis(session_id: str) -> dict:
+    logger.info(f"Diagnosis request for session_id: {session_id}")
+    config = await session_store.get_config(session_id)
+    if config is None:
+        raise HTTPException(status_code=404, detail=f"Invalid session_id: {session_id}.")
+
+    async def run() -> dict:
+        histories = await session_store.load_messages(session_id)
+        review_result = None
+        with observe("diagnosis"):
+            if config.get("enable_rolling_review"):
+                # most answers were already reviewed during the interview, only merge the reviews.
+                review_result = await rolling_evaluator.areview(session_id, config, histories)
+            if review_result is None:
+                review_result = await areview(
+                    api_key=config["openai_api_key"],
+                    histories=histories,
+                    position=config["position"],
+                    years_of_experience=config["years_of_experience"],
+                    cv=config["cv_str"],
+                )
+        logger.info(f"Successfully get the review result: {review_result.model_dump()}")
+        return review_result.model_dump()
+
+    return await diagnosis_jobs.submit(session_id, run)
 
 
 @app.websocket("/ws")
@@ -175,75 +399,144 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str = None):
     await websocket.accept()
     logger.info(f"Client connected: {session_id}")
 
-    config = sessions.get(session_id)
-    if not config:
+    session = await session_store.get(session_id)
+    if session is None:
         await websocket.send_text("Error: Invalid Session")
         await websocket.close()
         return
+    config = session.config
     logger.info(f"Loaded config for session: {session_id}")
 
     # initialize LLM clients
-    client = AsyncOpenAI(api_key=config["openai_api_key"])
+    client = get_async_client(config["openai_api_key"])
 
-    interviewer = Interviewer(config)
+    interviewer = Interviewer(config, checkpointer=session_store.checkpointer)
     tutor = Tutor(config["openai_api_key"])
-    interviewer_agents[session_id] = interviewer
-    # init the chatbot.
-    response = await interviewer.achat("### Start the Interview ###", session_id=session_id)
-    current_index = response.index
-    await websocket.send_json({"type": "interviewer", "content": response.content, "index": current_index})
-    if config.get("enable_voice"):
-        await sending_audio_messages(websocket, client, response.content)
-    n = 0
+    speculative_tutor = SpeculativeTutor(tutor) if config.get("enable_speculative_tutor") else None
+    # no await since the session was loaded, it can't have been evicted; once connected, it isn't.
+    session_store.connect(session_id)
+    current_index = 0
+    transcriber: StreamingTranscriber | None = None
+
+    async def send_error(request: dict, message: str):
+        # lets the client stop waiting for the request, e.g. clear its loading message.
+        await websocket.send_json({"type": "error", **request, "content": message})
+
+    # interviewer turns run in order, tutor requests concurrently, while this loop keeps receiving.
+    dispatcher = SessionDispatcher(on_error=send_error)
+
+    async def start_interview():
+        nonlocal current_index
+        response = await interviewer_reply(
+            websocket, client, interviewer, config, "### Start the Interview ###", session_id
+        )
+        current_index = response.index
+
+    async def answer_turn(message_type: str, data: bytes, format_: str, turn_transcriber: StreamingTranscriber | None):
+        nonlocal current_index
+        logger.info(f"Received audio data, size: {len(data)} bytes")
+        # logger.debug(type(data))
+        # 儲存音訊檔案 (in the background)
+        audio_archive.submit(session_id, data, format_)
+        if message_type == "audio":
+            input_text = await speech_to_text(client, data, format_)
+        else:
+            input_text = await turn_transcriber.finish()
+        await websocket.send_json({"type": "user", "content": input_text, "index": current_index})
+        logger.info(f"User said: {input_text}")
+        if speculative_tutor and interviewer.message_historys:
+            # precompute the tutor help while the interviewer replies.
+            question = interviewer.message_historys[-1].content
+            speculative_tutor.speculate(current_index, question=question, answer=input_text)
+
+        # COMMING QUESTIONS:
+        response = await interviewer_reply(websocket, client, interviewer, config, input_text, session_id)
+        current_index = response.index
+
+    async def grammar_check(data: dict):
+        assert "user" in data
+        user_message = data["user"]
+        index = data["index"]
+        # a speculative call for the same answer is found in the tutor cache.
+        response = await tutor.aimprove_grammar(answer=user_message)
+        await websocket.send_json({"type": "grammar_check", "content": response, "index": index})
+        await session_store.backend.save_tutor_output(session_id, index, "grammar_check", response)
+
+    async def generate_ai_answer(data: dict):
+        assert "user" in data
+        assert "interviewer" in data
+        user_message = data["user"]
+        interviewer_message = data["interviewer"]
+        index = data["index"]
+        response = await tutor.aimprove_answer(question=interviewer_message, answer=user_message)
+        await websocket.send_json({"type": "generate_ai_answer", "content": response, "index": index})
+        await session_store.backend.save_tutor_output(session_id, index, "generate_ai_answer", response)
+
     try:
+        interviewer.message_historys = await session_store.load_messages(session_id)
+        if not session_store.set_interviewer(session_id, interviewer):
+            # deleted in the meantime.
+            await websocket.send_text("Error: Invalid Session")
+            await websocket.close()
+            return
+        if interviewer.message_historys:
+            # resume the interview, e.g. after reconnecting, or when it was started on another worker.
+            current_index = len(interviewer.message_historys) // 2
+            last_message = interviewer.message_historys[-1]
+            await websocket.send_json({"type": "interviewer", "content": last_message.content, "index": current_index})
+        else:
+            # init the chatbot.
+            dispatcher.submit_turn(start_interview, {"request": "interviewer"})
         while True:
-            # 接收前端傳來的 JSON 資料
-            message = await websocket.receive_json()
+            # 接收前端傳來的 JSON 資料 or binary frame
+            try:
+                message, payload = await receive_message(websocket)
+            except ValueError as e:
+                logger.warning(f"Got invalid websocket message: {e}")
+                continue
 
             if message.get("type") == "ping":
                 logger.info("get ping")
                 await websocket.send_text("pong")
                 continue
 
-            if message.get("type") == "audio":
-                data = base64.b64decode(message.get("data"))
-                logger.info(f"Received audio data, size: {len(data)} bytes")
-                # logger.debug(type(data))
-                # 儲存音訊檔案
-                os.makedirs("inputs", exist_ok=True)
-                filename = f"inputs/{int(time.time())}-{n}.webm"
-                with open(filename, "wb") as f:
-                    f.write(data)
-                n += 1
-                input_text = await speech_to_text(client, data)
-                await websocket.send_json({"type": "user", "content": input_text, "index": current_index})
-                logger.info(f"User said: {input_text}")
-
-                # COMMING QUESTIONS:
-                response = await interviewer.achat(input_text, session_id=session_id)
-                current_index = response.index
-                await websocket.send_json({"type": "interviewer", "content": response.content, "index": current_index})
-
-                if config.get("enable_voice"):
-                    await sending_audio_messages(websocket, client, response.content)
-
-            elif message.get("type") == "grammar_check":
-                data = message.get("data")
-                assert "user" in data
-                user_message = data["user"]
-                index = data["index"]
-                response = await tutor.aimprove_grammar(answer=user_message)
-                await websocket.send_json({"type": "grammar_check", "content": response, "index": index})
-
-            elif message.get("type") == "generate_ai_answer":
-                data = message.get("data")
-                assert "user" in data
-                assert "interviewer" in data
-                user_message = data["user"]
-                interviewer_message = data["interviewer"]
-                index = data["index"]
-                response = await tutor.aimprove_answer(question=interviewer_message, answer=user_message)
-                await websocket.send_json({"type": "generate_ai_answer", "content": response, "index": index})
+            if message.get("type") == "audio_chunk":
+                # a new recording starts with chunk 0, drop whatever is left from an aborted one.
+                if transcriber is None or message.get("seq") == 0:
+                    if transcriber:
+                        transcriber.cancel()
+                    transcriber = StreamingTranscriber(partial(speech_to_text, client), audio_format(message))
+                chunk = payload if payload is not None else base64.b64decode(message.get("data"))
+                try:
+                    transcriber.add_chunk(chunk, message.get("seq"))
+                except ValueError as e:
+                    logger.warning(f"Dropped audio chunk: {e}")
+                continue
+
+            if message.get("type") in ("audio", "audio_end"):
+                if message.get("type") == "audio":
+                    # binary frames carry the raw audio, legacy JSON messages carry it in base64.
+                    data = payload if payload is not None else base64.b64decode(message.get("data"))
+                    format_ = audio_format(message)
+                elif transcriber is not None:
+                    data = transcriber.data
+                    format_ = transcriber.format
+                else:
+                    logger.warning("Got audio_end without any audio chunk.")
+                    continue
+                turn_transcriber = transcriber if message.get("type") == "audio_end" else None
+                if turn_transcriber:
+                    # the next recording gets its own transcriber, this one is finished by the turn.
+                    transcriber = None
+                dispatcher.submit_turn(
+                    partial(answer_turn, message.get("type"), data, format_, turn_transcriber),
+                    {"request": "interviewer"},
+                )
+
+            elif message.get("type") in ("grammar_check", "generate_ai_answer"):
+                handler = grammar_check if message.get("type") == "grammar_check" else generate_ai_answer
+                request = {"request": message.get("type"), "index": (message.get("data") or {}).get("index")}
+                dispatcher.submit(partial(handler, message.get("data")), request)
 
                 # print(type(data))
                 # print(type(data["user"]))
@@ -256,25 +549,193 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str = None):
 
     except WebSocketDisconnect:
         logger.info("Client disconnected")
-
-
-async def speech_to_text(client: AsyncOpenAI, input_bytes: bytes) -> str:
-    input_file = BytesIO(input_bytes)
-    input_file.name = STT_FILENAME
-    transcription = await client.audio.transcriptions.create(model="whisper-1", file=input_file)
+    finally:
+        await dispatcher.aclose()
+        if transcriber:
+            transcriber.cancel()
+        if speculative_tutor:
+            speculative_tutor.cancel()
+        session_store.disconnect(session_id)
+
+
+async def receive_message(websocket: WebSocket) -> tuple[dict, bytes | None]:
+    """
+    Receive a message from the client.
+    Text frames are JSON messages, binary frames are decoded by `protocol.decode_binary_frame`.
+    Return the message dict and the binary payload (None for JSON messages).
+    """
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    if message.get("bytes") is not None:
+        return decode_binary_frame(message["bytes"])
+    try:
+        return json.loads(message["text"]), None
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON message: {e}") from e
+
+
+async def speech_to_text(
+    client: AsyncOpenAI, input_bytes: bytes, format_: str = "webm", prompt: str | None = None
+) -> str:
+    # pass the buffer as-is, the filename extension tells whisper the container format.
+    input_file = (STT_FILENAME.format(format=format_), input_bytes)
+    with observe("stt", STT_MODEL_NAME):
+        transcription = await UPSTREAM_SCHEDULER.arun(
+            lambda: client.audio.transcriptions.create(model=STT_MODEL_NAME, file=input_file, prompt=prompt or omit),
+            client.api_key,
+        )
     return transcription.text
 
 
-async def sending_audio_messages(websocket: WebSocket, client: AsyncOpenAI, text: str):
+async def sending_audio_messages(
+    websocket: WebSocket, client: AsyncOpenAI, text: str, tts_format: str = DEFAULT_TTS_FORMAT
+):
     await websocket.send_text("START_AUDIO")
-    async with client.audio.speech.with_streaming_response.create(
-        model="tts-1", voice="alloy", input=text, response_format="mp3"
-    ) as response:
-        async for chunk in response.iter_bytes(chunk_size=4096):
-            await websocket.send_bytes(chunk)
+    async for chunk in astream_speech(client, text, tts_format):
+        await websocket.send_bytes(chunk)
     await websocket.send_text("END_AUDIO")
 
 
+async def interviewer_reply(
+    websocket: WebSocket,
+    client: AsyncOpenAI,
+    interviewer: Interviewer,
+    config: dict,
+    user_input: str,
+    session_id: str,
+) -> InterviewerResponse:
+    """
+    Get the interviewer reply and send it (and its audio, if enabled) to the client.
+    With rolling review, the answer is then reviewed in the background.
+    """
+    tts_format = config.get("tts_format", DEFAULT_TTS_FORMAT)
+    if config.get("enable_streaming"):
+        response = await sending_streamed_reply(
+            websocket,
+            client,
+            interviewer,
+            user_input,
+            session_id,
+            enable_voice=config.get("enable_voice"),
+            tts_format=tts_format,
+        )
+    else:
+        response = await interviewer.achat(user_input, session_id=session_id)
+        await session_store.append_messages(session_id, interviewer.message_historys[-2:])
+        await websocket.send_json({"type": "interviewer", "content": response.content, "index": response.index})
+        if config.get("enable_voice"):
+            await save_reply_audio(session_id, response.index, tts_format, [response.content])
+            await sending_audio_messages(websocket, client, response.content, tts_format)
+    if config.get("enable_rolling_review"):
+        await rolling_evaluator.schedule(session_id, config, interviewer.message_historys)
+    return response
+
+
+async def sending_streamed_reply(
+    websocket: WebSocket,
+    client: AsyncOpenAI,
+    interviewer: Interviewer,
+    user_input: str,
+    session_id: str,
+    enable_voice: bool = True,
+    tts_format: str = DEFAULT_TTS_FORMAT,
+) -> InterviewerResponse:
+    """
+    Stream the interviewer reply to the client.
+
+    Text deltas are sent as `interviewer_delta` messages as they arrive. When voice is enabled,
+    every completed sentence is sent to TTS right away, and the audio is sent back in sentence order,
+    so the audio of the first sentence plays while the LLM is still generating the rest.
+    """
+    splitter = SentenceSplitter()
+    synthesis_queue: asyncio.Queue = asyncio.Queue()
+    audio_sender = asyncio.create_task(_send_ordered_audio(websocket, synthesis_queue)) if enable_voice else None
+    contents = []
+    sentences = []
+    try:
+        async for delta in interviewer.astream_chat(user_input, session_id=session_id):
+            contents.append(delta.content)
+            await websocket.send_json({"type": "interviewer_delta", "content": delta.content, "index": delta.index})
+            if audio_sender:
+                for sentence in splitter.feed(delta.content):
+                    sentences.append(sentence)
+                    synthesis_queue.put_nowait(_start_sentence_synthesis(client, sentence, tts_format))
+
+        response = InterviewerResponse(index=len(interviewer.message_historys) // 2, content="".join(contents))
+        if audio_sender:
+            last_sentence = splitter.flush()
+            if last_sentence:
+                sentences.append(last_sentence)
+                synthesis_queue.put_nowait(_start_sentence_synthesis(client, last_sentence, tts_format))
+            # recorded before END_AUDIO is sent, the client may replay right after it.
+            await save_reply_audio(session_id, response.index, tts_format, sentences)
+            synthesis_queue.put_nowait(None)
+
+        await session_store.append_messages(session_id, interviewer.message_historys[-2:])
+        await websocket.send_json({"type": "interviewer", "content": response.content, "index": response.index})
+        if audio_sender:
+            await audio_sender
+    except BaseException:
+        if audio_sender:
+            audio_sender.cancel()
+        _cancel_pending_synthesis(synthesis_queue)
+        raise
+    return response
+
+
+async def save_reply_audio(session_id: str, index: int, tts_format: str, sentences: list[str]):
+    """Record what the audio of a reply is synthesized from, for `/audio/{session_id}/{index}`."""
+    await session_store.backend.save_reply_audio(session_id, index, {"format": tts_format, "sentences": sentences})
+
+
+def _start_sentence_synthesis(
+    client: AsyncOpenAI, sentence: str, tts_format: str = DEFAULT_TTS_FORMAT
+) -> tuple[asyncio.Queue, asyncio.Task]:
+    chunks: asyncio.Queue = asyncio.Queue()
+
+    async def synthesize():
+        try:
+            async for chunk in astream_speech(client, sentence, tts_format):
+                chunks.put_nowait(chunk)
+        finally:
+            chunks.put_nowait(None)
+
+    return chunks, asyncio.create_task(synthesize())
+
+
+async def _send_ordered_audio(websocket: WebSocket, synthesis_queue: asyncio.Queue):
+    started = False
+    task = None
+    try:
+        while (item := await synthesis_queue.get()) is not None:
+            chunks, task = item
+            while (chunk := await chunks.get()) is not None:
+                if not started:
+                    await websocket.send_text("START_AUDIO")
+                    started = True
+                await websocket.send_bytes(chunk)
+            try:
+                await task
+            except Exception as e:
+                # skip the failed sentence, keep the rest of the reply audible.
+                logger.error(f"TTS failed for sentence: {e}")
+    except BaseException:
+        if task:
+            task.cancel()
+        _cancel_pending_synthesis(synthesis_queue)
+        raise
+    if started:
+        await websocket.send_text("END_AUDIO")
+
+
+def _cancel_pending_synthesis(synthesis_queue: asyncio.Queue):
+    while not synthesis_queue.empty():
+        item = synthesis_queue.get_nowait()
+        if item is not None:
+            item[1].cancel()
+
+
 if __name__ == "__main__":
     PORT = int(os.getenv("PORT"))
     uvicorn.run(app, host="0.0.0.0", port=PORT, log_config=get_logging_config())
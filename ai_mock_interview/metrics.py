@@ -0,0 +1,189 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """A Prometheus histogram with labels, kept in the process memory."""
+
+    def __init__(
+        self, name: str, help_: str, labelnames: tuple[str, ...], buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.help = help_
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (bucket counts, sum, count)
+        self._series: dict[tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        for key, (counts, total, count) in sorted(series.items()):
+            labels = _render_labels(self.labelnames, key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_render_labels(self.labelnames, key, le=bound)} {cumulative}")
+            lines.append(f'{self.name}_bucket{_render_labels(self.labelnames, key, le="+Inf")} {count}')
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Counter:
+    """A Prometheus counter, with or without labels."""
+
+    def __init__(self, name: str, help_: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_
+        self.labelnames = labelnames
+        # label values -> count
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        if not self.labelnames:
+            return lines + [f"{self.name} {values.get((), 0.0)}"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_render_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge:
+    """A Prometheus gauge without labels."""
+
+    def __init__(self, name: str, help_: str):
+        self.name = name
+        self.help = help_
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.value}"]
+
+
+STAGE_SECONDS = Histogram(
+    "ai_mock_interview_stage_duration_seconds",
+    "Duration of each processing stage, by model for upstream calls.",
+    ("stage", "model"),
+)
+ACTIVE_SESSIONS = Gauge("ai_mock_interview_active_sessions", "Sessions held by this worker.")
+CONNECTED_SESSIONS = Gauge("ai_mock_interview_connected_sessions", "Sessions with an open websocket.")
+OPEN_WEBSOCKETS = Gauge("ai_mock_interview_open_websockets", "Open websocket connections.")
+UPSTREAM_IN_FLIGHT = Gauge("ai_mock_interview_upstream_in_flight", "OpenAI calls in flight.")
+UPSTREAM_QUEUED = Gauge("ai_mock_interview_upstream_queued", "OpenAI calls waiting for a free slot.")
+UPSTREAM_WAIT_SECONDS = Histogram(
+    "ai_mock_interview_upstream_wait_seconds",
+    "Time OpenAI calls waited for a free slot, by priority class.",
+    ("priority",),
+)
+UPSTREAM_RETRIES = Counter("ai_mock_interview_upstream_retries_total", "OpenAI calls retried after a failure.")
+HEDGE_OUTCOMES = Counter(
+    "ai_mock_interview_interviewer_hedges_total",
+    "Hedged interviewer model calls, by outcome: not_fired, skipped, primary or hedge (the path that won).",
+    ("outcome",),
+)
+
+METRICS = (
+    STAGE_SECONDS,
+    ACTIVE_SESSIONS,
+    CONNECTED_SESSIONS,
+    OPEN_WEBSOCKETS,
+    UPSTREAM_IN_FLIGHT,
+    UPSTREAM_QUEUED,
+    UPSTREAM_WAIT_SECONDS,
+    UPSTREAM_RETRIES,
+    HEDGE_OUTCOMES,
+)
+
+
+@contextmanager
+def observe(stage: str, model: str | None = None) -> Iterator[None]:
+    """Time the block as `stage`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage, model=model or "")
+
+
+def render_metrics() -> str:
+    """The metrics of this worker process, in the Prometheus text format."""
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting open websockets and timing websocket sends."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "websocket":
+            return await self.app(scope, receive, send)
+
+        accepted = False
+
+        async def timed_send(message):
+            nonlocal accepted
+            if message["type"] == "websocket.accept":
+                accepted = True
+                OPEN_WEBSOCKETS.inc()
+            if message["type"] != "websocket.send":
+                return await send(message)
+            with observe("ws_send"):
+                return await send(message)
+
+        try:
+            return await self.app(scope, receive, timed_send)
+        finally:
+            if accepted:
+                OPEN_WEBSOCKETS.dec()
+
+
+def _render_labels(labelnames: tuple[str, ...], values: tuple[str, ...], le: float | str | None = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
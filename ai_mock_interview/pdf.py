@@ -0,0 +1,15 @@
+import fitz
+
+
+def extract_pdf_text(path: str, max_pages: int) -> tuple[str, list[str]]:
+    """
+    The text of the first `max_pages` pages of a PDF, and the warnings about it.
+
+    Runs in the CV parser processes (see `cv.aextract_pdf_text`), so this module only imports what parsing
+    needs, and the warnings are logged by the caller: a spawned process has no logging configured.
+    """
+    warnings = []
+    with fitz.open(path, filetype="pdf") as doc:
+        if doc.page_count > max_pages:
+            warnings.append(f"CV has {doc.page_count} pages, only the first {max_pages} are parsed.")
+        return "".join(doc[i].get_text() for i in range(min(doc.page_count, max_pages))), warnings
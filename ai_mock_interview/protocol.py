@@ -0,0 +1,57 @@
+import json
+import struct
+from enum import IntEnum
+
+# Binary websocket frame layout:
+#   [version: uint8][frame type: uint8][metadata length: uint16][metadata: utf-8 JSON][payload]
+BINARY_FRAME_VERSION = 1
+BINARY_FRAME_HEADER = struct.Struct("!BBH")
+
+AUDIO_FORMATS = ("webm", "ogg", "mp4", "m4a", "wav", "mp3")
+DEFAULT_AUDIO_FORMAT = "webm"
+
+
+class FrameType(IntEnum):
+    AUDIO = 1  # a whole recording
+    AUDIO_CHUNK = 2  # a timesliced chunk of the ongoing recording
+    AUDIO_END = 3  # the ongoing recording has stopped
+
+
+FRAME_MESSAGE_TYPES = {
+    FrameType.AUDIO: "audio",
+    FrameType.AUDIO_CHUNK: "audio_chunk",
+    FrameType.AUDIO_END: "audio_end",
+}
+
+
+def encode_binary_frame(frame_type: FrameType, payload: bytes, metadata: dict | None = None) -> bytes:
+    metadata_bytes = json.dumps(metadata or {}).encode("utf-8")
+    header = BINARY_FRAME_HEADER.pack(BINARY_FRAME_VERSION, frame_type, len(metadata_bytes))
+    return header + metadata_bytes + payload
+
+
+def decode_binary_frame(data: bytes) -> tuple[dict, bytes]:
+    """
+    Decode a binary frame into a message dict (same shape as the JSON messages) and its payload.
+    Raise ValueError if the frame is malformed.
+    """
+    if len(data) < BINARY_FRAME_HEADER.size:
+        raise ValueError(f"Binary frame too short: {len(data)} bytes")
+    version, frame_type, metadata_length = BINARY_FRAME_HEADER.unpack_from(data)
+    if version != BINARY_FRAME_VERSION:
+        raise ValueError(f"Unsupported binary frame version: {version}")
+    if frame_type not in FRAME_MESSAGE_TYPES:
+        raise ValueError(f"Unknown binary frame type: {frame_type}")
+    payload_offset = BINARY_FRAME_HEADER.size + metadata_length
+    if len(data) < payload_offset:
+        raise ValueError("Binary frame metadata exceeds frame size")
+
+    metadata = json.loads(data[BINARY_FRAME_HEADER.size : payload_offset]) if metadata_length else {}
+    message = {**metadata, "type": FRAME_MESSAGE_TYPES[FrameType(frame_type)]}
+    return message, data[payload_offset:]
+
+
+def audio_format(message: dict) -> str:
+    """Get the audio container format of a message, falling back to the default one."""
+    format_ = str(message.get("format") or DEFAULT_AUDIO_FORMAT).lower()
+    return format_ if format_ in AUDIO_FORMATS else DEFAULT_AUDIO_FORMAT
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import logging
 import os
@@ -7,13 +8,18 @@ from typing import Union
 import dotenv
 from langchain_core.messages.ai import AIMessage
 from langchain_core.messages.human import HumanMessage
-from langchain_openai import ChatOpenAI
 from pydantic import BaseModel
 
+from ai_mock_interview.clients import get_chat_model
+from ai_mock_interview.metrics import observe
+from ai_mock_interview.scheduler import PRIORITY_TUTOR, UPSTREAM_SCHEDULER
+
 logger = logging.getLogger(__name__)
 
 dotenv.load_dotenv(override=False)
 MODEL_NAME = "gpt-5-nano-2025-08-07"
+# transcripts longer than this are reviewed in chunks concurrently, then merged.
+REVIEW_CHUNK_MAX_CHARS = int(os.getenv("REVIEW_CHUNK_MAX_CHARS", 12000))
 
 
 REVIEWER_SYSTEM_PROMPT = """
@@ -58,6 +64,76 @@ QUERY_PROMPT = """
 {interview_transcript}
 """
 
+CHUNK_REVIEWER_SYSTEM_PROMPT = """
+You are a hiring manager who has just finished interviewing a candidate.
+
+You will be given:
+- the applicant’s profile
+- one part of the interview transcript
+
+Your task is to evaluate the candidate's answers in this part of the interview only.
+
+Produce a JSON object with the following fields:
+
+1. "score"
+   A letter grade from A+ to F that reflects the performance in this part.
+
+2. "strengths"
+   What the candidate did well in this part (maximum 150 words).
+
+3. "weaknesses"
+   What the candidate did poorly or should improve in this part (maximum 150 words).
+
+Return ONLY valid JSON. Do not include any extra text.
+"""
+
+MERGE_REVIEWER_SYSTEM_PROMPT = """
+You are a hiring manager who has just finished interviewing a candidate.
+
+You will be given:
+- the applicant’s profile
+- your notes on each part of the interview, in order
+
+Your task is to evaluate the candidate and decide whether they should be hired based only on this information.
+
+Produce a JSON object with the following fields:
+
+1. "score"
+   A letter grade from A+ to F that reflects the overall interview performance.
+
+2. "the_chances_of_getting_this_job"
+   A number from 0 to 100 representing the estimated chance (in percent) that this candidate would get the job.
+
+3. "comments"
+   Feedback to the candidate about their performance in this interview (maximum 500 words).
+
+4. "what_to_improve"
+   Specific areas the candidate should improve, based on the notes (maximum 500 words).
+
+Return ONLY valid JSON. Do not include any extra text.
+"""
+
+CHUNK_QUERY_PROMPT = """
+# Applicant profile:
+{applicant_profile}
+# Interview transcript (part {part} of {n_parts}):
+{interview_transcript}
+"""
+
+TURN_QUERY_PROMPT = """
+# Applicant profile:
+{applicant_profile}
+# Interview transcript (question {turn}):
+{interview_transcript}
+"""
+
+MERGE_QUERY_PROMPT = """
+# Applicant profile:
+{applicant_profile}
+# Notes on each part of the interview:
+{chunk_reviews}
+"""
+
 APPLICANT_PROMPT = """
 # Applicant's Profile:
 * Position: {position}
@@ -76,6 +152,12 @@ class ReviewResult(BaseModel):
     what_to_improve: str
 
 
+class ChunkReview(BaseModel):
+    score: str
+    strengths: str
+    weaknesses: str
+
+
 def review(
     api_key: str,
     histories: list[Union[HumanMessage, AIMessage]],
@@ -88,10 +170,7 @@ def review(
     Diagnosis the interview result based on the history of the whole interview.
     """
     logger.info("Calling review function to get the review result...")
-    model = ChatOpenAI(
-        model=MODEL_NAME,
-        api_key=api_key,
-    )
+    model = get_chat_model(api_key, model=MODEL_NAME)
     interview_transcript = _render_histories(histories)
     applicant_profile = APPLICANT_PROMPT.format(
         position=position,
@@ -107,17 +186,198 @@ def review(
     messages = [("system", REVIEWER_SYSTEM_PROMPT), ("human", query_prompt)]
     start_time = time.time()
     logger.info("Calling Reviewer LLM...")
-    response = model.invoke(messages)
+    with observe("review", MODEL_NAME):
+        response = UPSTREAM_SCHEDULER.run(lambda: model.invoke(messages))
     end_time = time.time()
     logger.info(f"Reviewer LLM call took {end_time - start_time:.2f} seconds")
     # logger.info(f"Repsonse of reviewer: {response.content}")
+    return _parse_response(response.content, ReviewResult)
+
+
+async def areview(
+    api_key: str,
+    histories: list[Union[HumanMessage, AIMessage]],
+    position: str,
+    years_of_experience: float,
+    cv: str,
+    priority: int = PRIORITY_TUTOR,
+) -> ReviewResult:
+    """
+    Diagnosis the interview result based on the history of the whole interview.
+    Long transcripts are split into chunks reviewed concurrently, and the chunk reviews are merged.
+    """
+    logger.info("Calling review function to get the review result...")
+    model = get_chat_model(api_key, model=MODEL_NAME)
+    applicant_profile = APPLICANT_PROMPT.format(
+        position=position,
+        yoe=years_of_experience,
+        cv=cv.strip(),
+    )
+    chunks = _chunk_histories(histories, REVIEW_CHUNK_MAX_CHARS)
+    if len(chunks) <= 1:
+        query_prompt = QUERY_PROMPT.format(
+            applicant_profile=applicant_profile,
+            interview_transcript=_render_histories(histories),
+        )
+        return await _ainvoke(
+            model, REVIEWER_SYSTEM_PROMPT, query_prompt, ReviewResult, "Reviewer", "review", api_key, priority
+        )
+
+    logger.info(f"Reviewing the transcript in {len(chunks)} chunks...")
+    chunk_reviews = await asyncio.gather(
+        *(
+            _ainvoke(
+                model,
+                CHUNK_REVIEWER_SYSTEM_PROMPT,
+                CHUNK_QUERY_PROMPT.format(
+                    applicant_profile=applicant_profile,
+                    part=i + 1,
+                    n_parts=len(chunks),
+                    interview_transcript=_render_histories(chunk),
+                ),
+                ChunkReview,
+                f"Chunk Reviewer {i + 1}",
+                "review_chunk",
+                api_key,
+                priority,
+            )
+            for i, chunk in enumerate(chunks)
+        )
+    )
+    query_prompt = MERGE_QUERY_PROMPT.format(
+        applicant_profile=applicant_profile,
+        chunk_reviews=_render_chunk_reviews(chunk_reviews),
+    )
+    return await _ainvoke(
+        model,
+        MERGE_REVIEWER_SYSTEM_PROMPT,
+        query_prompt,
+        ReviewResult,
+        "Merge Reviewer",
+        "review_merge",
+        api_key,
+        priority,
+    )
+
+
+async def areview_turn(
+    api_key: str,
+    turn: int,
+    question_answer: list[Union[HumanMessage, AIMessage]],
+    position: str,
+    years_of_experience: float,
+    cv: str,
+    priority: int = PRIORITY_TUTOR,
+) -> ChunkReview:
+    """Review a single question/answer pair of the interview, see `question_answer_pairs`."""
+    model = get_chat_model(api_key, model=MODEL_NAME)
+    query_prompt = TURN_QUERY_PROMPT.format(
+        applicant_profile=APPLICANT_PROMPT.format(position=position, yoe=years_of_experience, cv=cv.strip()),
+        turn=turn,
+        interview_transcript=_render_histories(question_answer),
+    )
+    return await _ainvoke(
+        model,
+        CHUNK_REVIEWER_SYSTEM_PROMPT,
+        query_prompt,
+        ChunkReview,
+        f"Turn Reviewer {turn}",
+        "review_turn",
+        api_key,
+        priority,
+    )
+
+
+async def amerge_turn_reviews(
+    api_key: str,
+    turn_reviews: list[ChunkReview],
+    position: str,
+    years_of_experience: float,
+    cv: str,
+    priority: int = PRIORITY_TUTOR,
+) -> ReviewResult:
+    """Diagnosis the interview result based on the reviews of each question/answer pair."""
+    model = get_chat_model(api_key, model=MODEL_NAME)
+    query_prompt = MERGE_QUERY_PROMPT.format(
+        applicant_profile=APPLICANT_PROMPT.format(position=position, yoe=years_of_experience, cv=cv.strip()),
+        chunk_reviews=_render_chunk_reviews(turn_reviews, label="Question"),
+    )
+    return await _ainvoke(
+        model,
+        MERGE_REVIEWER_SYSTEM_PROMPT,
+        query_prompt,
+        ReviewResult,
+        "Merge Reviewer",
+        "review_merge",
+        api_key,
+        priority,
+    )
+
+
+def question_answer_pairs(
+    histories: list[Union[HumanMessage, AIMessage]],
+) -> list[list[Union[HumanMessage, AIMessage]]]:
+    """The answered questions of the interview, as [interviewer question, applicant answer] pairs."""
+    # histories start with the kick-off message, then alternate interviewer question / applicant answer.
+    return [histories[i : i + 2] for i in range(1, len(histories) - 1, 2)]
+
+
+async def _ainvoke(
+    model,
+    system_prompt: str,
+    query_prompt: str,
+    result_type: type[BaseModel],
+    name: str,
+    stage: str,
+    api_key: str,
+    priority: int,
+):
+    messages = [("system", system_prompt), ("human", query_prompt)]
+    start_time = time.time()
+    logger.info(f"Calling {name} LLM...")
+    with observe(stage, MODEL_NAME):
+        response = await UPSTREAM_SCHEDULER.arun(lambda: model.ainvoke(messages), api_key, priority)
+    end_time = time.time()
+    logger.info(f"{name} LLM call took {end_time - start_time:.2f} seconds")
+    return _parse_response(response.content, result_type)
+
+
+def _parse_response(content: str, result_type: type[BaseModel]):
     try:
-        response_in_dict = json.loads(response.content)
+        response_in_dict = json.loads(content)
     except json.decoder.JSONDecodeError:
-        logger.error(f"Failed to decode JSON response from LLM: {response.content}")
+        logger.error(f"Failed to decode JSON response from LLM: {content}")
         raise
-    review_result = ReviewResult.model_validate(response_in_dict)
-    return review_result
+    return result_type.model_validate(response_in_dict)
+
+
+def _chunk_histories(
+    histories: list[Union[HumanMessage, AIMessage]], max_chars: int
+) -> list[list[Union[HumanMessage, AIMessage]]]:
+    """Split the histories into chunks of at most `max_chars` rendered characters, keeping question/answer pairs."""
+    chunks = []
+    chunk = []
+    chunk_size = 0
+    # histories start with the kick-off message, then alternate interviewer question / applicant answer.
+    turns = [histories[:1]] + [histories[i : i + 2] for i in range(1, len(histories), 2)]
+    for turn in turns:
+        turn_size = len(_render_histories(turn))
+        if chunk and chunk_size + turn_size > max_chars:
+            chunks.append(chunk)
+            chunk = []
+            chunk_size = 0
+        chunk.extend(turn)
+        chunk_size += turn_size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def _render_chunk_reviews(chunk_reviews: list[ChunkReview], label: str = "Part") -> str:
+    return "\n".join(
+        f"## {label} {i + 1}\n* Score: {r.score}\n* Strengths: {r.strengths}\n* Weaknesses: {r.weaknesses}"
+        for i, r in enumerate(chunk_reviews)
+    )
 
 
 def _render_histories(histories: list[Union[HumanMessage, AIMessage]]) -> str:
@@ -0,0 +1,356 @@
+import asyncio
+import email.utils
+import logging
+import os
+import random
+import time
+import weakref
+from contextlib import AsyncExitStack, asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import AsyncContextManager, AsyncIterator, Awaitable, Callable, TypeVar
+
+import dotenv
+import openai
+from langchain.agents.middleware import AgentMiddleware
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+from langgraph.config import get_config
+
+from ai_mock_interview.clients import hash_api_key
+from ai_mock_interview.metrics import UPSTREAM_IN_FLIGHT, UPSTREAM_QUEUED, UPSTREAM_RETRIES, UPSTREAM_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+dotenv.load_dotenv(override=False)
+
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", 64))
+UPSTREAM_MAX_CONCURRENCY_PER_KEY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY_PER_KEY", 16))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", 4))
+UPSTREAM_BACKOFF_BASE_SECONDS = float(os.getenv("UPSTREAM_BACKOFF_BASE_SECONDS", 0.5))
+UPSTREAM_BACKOFF_MAX_SECONDS = float(os.getenv("UPSTREAM_BACKOFF_MAX_SECONDS", 20))
+# calls asked to come back later than this fail at once instead of holding up the session.
+UPSTREAM_RETRY_AFTER_MAX_SECONDS = float(os.getenv("UPSTREAM_RETRY_AFTER_MAX_SECONDS", 60))
+
+# priority classes, lower runs first.
+PRIORITY_INTERVIEWER = 0  # the interview turn: STT, interviewer reply, its audio, setup checks
+PRIORITY_TUTOR = 1  # on-demand requests: tutor help, diagnosis, replays
+PRIORITY_SPECULATIVE = 2  # work nobody waits for yet: speculative tutor calls, rolling reviews
+PRIORITY_NAMES = {PRIORITY_INTERVIEWER: "interviewer", PRIORITY_TUTOR: "tutor", PRIORITY_SPECULATIVE: "speculative"}
+
+# besides 5xx, the status codes worth retrying, as in the OpenAI SDK.
+RETRYABLE_STATUS_CODES = (408, 409, 429)
+
+T = TypeVar("T")
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    key: str = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    task: asyncio.Task | None = field(compare=False, default=None)
+
+
+class UpstreamScheduler:
+    """
+    Admission control and retries for the OpenAI calls of the process.
+
+    At most `max_concurrency` calls run at once, and at most `max_concurrency_per_key` per API key, so a
+    single key can't take all the slots. Waiting calls are admitted by priority class, then in arrival
+    order. Calls failing with an error that may go away (rate limit, timeout, server error) are retried
+    up to `max_retries` times after a jittered exponential backoff, or after the `Retry-After` delay asked
+    by the server when it is longer. The slot is given back while waiting to retry.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = UPSTREAM_MAX_CONCURRENCY,
+        max_concurrency_per_key: int = UPSTREAM_MAX_CONCURRENCY_PER_KEY,
+        max_retries: int = UPSTREAM_MAX_RETRIES,
+        backoff_base: float = UPSTREAM_BACKOFF_BASE_SECONDS,
+        backoff_max: float = UPSTREAM_BACKOFF_MAX_SECONDS,
+        retry_after_max: float = UPSTREAM_RETRY_AFTER_MAX_SECONDS,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_concurrency_per_key = max_concurrency_per_key
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+        self._running = 0
+        # api key hash -> running calls
+        self._running_per_key: dict[str, int] = {}
+        self._waiters: list[_Waiter] = []
+        self._seq = 0
+        # task -> priority its calls were raised to, see `raise_priority`
+        self._raised_priorities: weakref.WeakKeyDictionary[asyncio.Task, int] = weakref.WeakKeyDictionary()
+
+    @property
+    def queued(self) -> int:
+        """Calls waiting for a free slot."""
+        return len(self._waiters)
+
+    @asynccontextmanager
+    async def slot(self, api_key: str, priority: int = PRIORITY_INTERVIEWER) -> AsyncIterator[None]:
+        """Hold a slot for one upstream call, waiting for it if needed."""
+        key = hash_api_key(api_key)
+        await self._acquire(key, priority)
+        UPSTREAM_IN_FLIGHT.inc()
+        try:
+            yield
+        finally:
+            UPSTREAM_IN_FLIGHT.dec()
+            self._release(key)
+
+    async def arun(
+        self,
+        call: Callable[[], Awaitable[T]],
+        api_key: str,
+        priority: int = PRIORITY_INTERVIEWER,
+        streamed: Callable[[], bool] | None = None,
+    ) -> T:
+        """
+        Run `call` in a slot, retrying it when it fails with a retryable error. `streamed` tells whether the
+        failed call already streamed output to the client, it is then not retried, that output can't be
+        taken back.
+        """
+        attempt = 0
+        while True:
+            async with self.slot(api_key, priority):
+                try:
+                    return await call()
+                except Exception as e:
+                    error, delay = e, self.retry_delay(e, attempt)
+                    if delay is None or (streamed is not None and streamed()):
+                        raise
+            attempt += 1
+            self._log_retry(error, attempt, delay)
+            await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def aopen(
+        self, open_: Callable[[], AsyncContextManager[T]], api_key: str, priority: int = PRIORITY_INTERVIEWER
+    ) -> AsyncIterator[T]:
+        """
+        Like `arun`, for streamed responses: enter the context manager returned by `open_` in a slot, which is
+        held until it exits. Only opening the stream (up to the response headers) is retried: errors raised
+        while the body is read propagate, its first chunks may already have been sent on.
+        """
+        attempt = 0
+        while True:
+            async with AsyncExitStack() as stack:
+                await stack.enter_async_context(self.slot(api_key, priority))
+                try:
+                    response = await stack.enter_async_context(open_())
+                except Exception as e:
+                    error, delay = e, self.retry_delay(e, attempt)
+                    if delay is None:
+                        raise
+                else:
+                    # outside of the try, the errors of the body are never retried.
+                    yield response
+                    return
+            attempt += 1
+            self._log_retry(error, attempt, delay)
+            await asyncio.sleep(delay)
+
+    def run(self, call: Callable[[], T]) -> T:
+        """
+        Run a blocking `call`, retrying it like `arun`. Blocking calls don't take a slot, the slots belong to
+        the event loop; they are only used by the sync API, outside of the app.
+        """
+        attempt = 0
+        while True:
+            try:
+                return call()
+            except Exception as e:
+                delay = self.retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                self._log_retry(e, attempt, delay)
+            time.sleep(delay)
+
+    def retry_delay(self, error: Exception, attempt: int) -> float | None:
+        """Seconds to wait before retrying after the `attempt`-th retry failed with `error`, None to give up."""
+        if attempt >= self.max_retries or not is_retryable(error):
+            return None
+        # "full jitter", so the calls rate limited together don't come back together.
+        backoff = random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+        retry_after = retry_after_seconds(error)
+        if retry_after is None:
+            return backoff
+        if retry_after > self.retry_after_max:
+            return None
+        return max(retry_after, backoff)
+
+    def raise_priority(self, task: asyncio.Task, priority: int):
+        """
+        Run the calls of `task`, the waiting ones and the ones it makes next, at `priority` or higher, e.g. when
+        a client starts waiting for a speculative call.
+        """
+        if self._raised_priorities.get(task, priority + 1) <= priority:
+            return
+        self._raised_priorities[task] = priority
+        for waiter in self._waiters:
+            if waiter.task is task and waiter.priority > priority:
+                waiter.priority = priority
+
+    def stats(self) -> dict:
+        return {
+            "running": self._running,
+            "queued": len(self._waiters),
+            "keys": len(self._running_per_key),
+            "max_concurrency": self.max_concurrency,
+            "max_concurrency_per_key": self.max_concurrency_per_key,
+        }
+
+    async def _acquire(self, key: str, priority: int):
+        # every release admits the waiters it can, so the ones left wait for a slot this call can't take either.
+        if self._can_run(key):
+            self._start(key)
+            return
+        task = asyncio.current_task()
+        priority = min(priority, self._raised_priorities.get(task, priority))
+        waiter = _Waiter(priority, self._seq, key, asyncio.get_running_loop().create_future(), task)
+        self._seq += 1
+        self._waiters.append(waiter)
+        UPSTREAM_QUEUED.inc()
+        start_time = time.perf_counter()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            else:
+                # admitted while being cancelled, hand the slot over.
+                self._release(key)
+            raise
+        finally:
+            UPSTREAM_QUEUED.dec()
+            UPSTREAM_WAIT_SECONDS.observe(
+                time.perf_counter() - start_time, priority=PRIORITY_NAMES.get(waiter.priority, str(waiter.priority))
+            )
+
+    def _can_run(self, key: str) -> bool:
+        return self._running < self.max_concurrency and self._running_per_key.get(key, 0) < self.max_concurrency_per_key
+
+    def _start(self, key: str):
+        self._running += 1
+        self._running_per_key[key] = self._running_per_key.get(key, 0) + 1
+
+    def _release(self, key: str):
+        self._running -= 1
+        running = self._running_per_key[key] - 1
+        if running:
+            self._running_per_key[key] = running
+        else:
+            del self._running_per_key[key]
+        self._wake()
+
+    def _wake(self):
+        for waiter in sorted(self._waiters):
+            if self._running >= self.max_concurrency:
+                break
+            if waiter.future.done() or not self._can_run(waiter.key):
+                continue
+            self._waiters.remove(waiter)
+            self._start(waiter.key)
+            waiter.future.set_result(None)
+
+    @staticmethod
+    def _log_retry(error: Exception, attempt: int, delay: float):
+        UPSTREAM_RETRIES.inc()
+        logger.warning(f"OpenAI call failed ({type(error).__name__}: {error}), retry {attempt} in {delay:.2f} seconds")
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, openai.APIConnectionError):  # includes timeouts
+        return True
+    if not isinstance(error, openai.APIStatusError):
+        return False
+    should_retry = error.response.headers.get("x-should-retry")
+    if should_retry in ("true", "false"):
+        return should_retry == "true"
+    if error.code == "insufficient_quota":
+        # out of credits, waiting won't help.
+        return False
+    return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+
+
+def retry_after_seconds(error: Exception) -> float | None:
+    """The delay asked by the `Retry-After` (or `retry-after-ms`) header of the error response, if any."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" not in headers:
+            return None
+        value = headers["retry-after"]
+        try:
+            return float(value)
+        except ValueError:
+            # an HTTP date
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+UPSTREAM_SCHEDULER = UpstreamScheduler()
+
+
+class FirstTokenHandler(AsyncCallbackHandler):
+    """Set `event` once the model streams its first token."""
+
+    def __init__(self):
+        self.event = asyncio.Event()
+
+    async def on_llm_new_token(self, token: str, **kwargs):
+        if token:
+            self.event.set()
+
+
+# added to the callbacks of the model calls made in the context it is set in.
+_streamed_token_handler: ContextVar[FirstTokenHandler | None] = ContextVar("streamed_token_handler", default=None)
+register_configure_hook(_streamed_token_handler, inheritable=True)
+
+
+class UpstreamSchedulerMiddleware(AgentMiddleware):
+    """
+    Run the model calls of an agent through the upstream scheduler, under the `api_key` of the runtime context
+    of the run. Each model call is retried on its own, instead of the whole agent run, which has already saved
+    the user message. In the runs streaming the model tokens to the client (`"streaming": True` in the
+    `configurable` of the run, see `Interviewer.astream_chat`), a call failing after its first token is not
+    retried, the tokens would be sent twice.
+    """
+
+    def __init__(self, priority: int = PRIORITY_INTERVIEWER, scheduler: UpstreamScheduler = UPSTREAM_SCHEDULER):
+        super().__init__()
+        self.priority = priority
+        self.scheduler = scheduler
+
+    def wrap_model_call(self, request, handler):
+        return self.scheduler.run(lambda: handler(request))
+
+    async def awrap_model_call(self, request, handler):
+        if not get_config().get("configurable", {}).get("streaming"):
+            return await self.scheduler.arun(lambda: handler(request), request.runtime.context.api_key, self.priority)
+
+        first_token = FirstTokenHandler()
+
+        async def call():
+            # run in the context of the caller, don't leave the handler behind.
+            token = _streamed_token_handler.set(first_token)
+            try:
+                return await handler(request)
+            finally:
+                _streamed_token_handler.reset(token)
+
+        return await self.scheduler.arun(
+            call, request.runtime.context.api_key, self.priority, streamed=first_token.event.is_set
+        )
@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import AsyncIterator
+
+import dotenv
+from langchain_core.messages import BaseMessage
+from langgraph.checkpoint.base import BaseCheckpointSaver
+
+from ai_mock_interview.backends import SessionBackend, create_session_backend
+from ai_mock_interview.interviewer import Interviewer
+
+logger = logging.getLogger(__name__)
+
+dotenv.load_dotenv(override=False)
+
+SESSION_IDLE_TTL_SECONDS = float(os.getenv("SESSION_IDLE_TTL_SECONDS", 3600))
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", 1000))
+SESSION_MEMORY_BUDGET_BYTES = int(os.getenv("SESSION_MEMORY_BUDGET_BYTES", 512 * 1024 * 1024))
+SESSION_SWEEP_INTERVAL_SECONDS = float(os.getenv("SESSION_SWEEP_INTERVAL_SECONDS", 60))
+
+
+@dataclass
+class Session:
+    session_id: str
+    config: dict
+    interviewer: Interviewer | None = None
+    connections: int = 0
+    created_at: float = field(default_factory=time.monotonic)
+    last_active: float = field(default_factory=time.monotonic)
+
+    def estimate_bytes(self) -> int:
+        """
+        Rough estimate of the memory held by the session: the CV text, the end of the interviewer system prompt
+        with the profile (the rest is shared by the sessions), and the interviewer messages, counted twice
+        since the checkpointer keeps its own copy.
+        """
+        size = len(self.config.get("cv_str") or "")
+        if self.interviewer is not None:
+            size += len(self.interviewer.context.profile_prompt)
+            size += 2 * sum(len(str(m.content)) for m in self.interviewer.message_historys)
+        return size
+
+
+class SessionStore:
+    """
+    Store of interview sessions: a local cache of live sessions in front of a `SessionBackend`.
+
+    Sessions are evicted when idle for longer than `idle_ttl` seconds, and in LRU order when
+    there are more than `max_count` of them or they hold more than `memory_budget` bytes.
+    Sessions with an open websocket are never evicted. With a persistent backend, eviction only
+    drops the local copy (it is reloaded on demand), and sessions are deleted from the backend once
+    idle across all workers. Uploaded CV files are removed when a session is deleted.
+    """
+
+    def __init__(
+        self,
+        backend: SessionBackend | None = None,
+        idle_ttl: float = SESSION_IDLE_TTL_SECONDS,
+        max_count: int = SESSION_MAX_COUNT,
+        memory_budget: int = SESSION_MEMORY_BUDGET_BYTES,
+    ):
+        self.backend = backend or create_session_backend()
+        self.idle_ttl = idle_ttl
+        self.max_count = max_count
+        self.memory_budget = memory_budget
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+
+    @property
+    def checkpointer(self) -> BaseCheckpointSaver:
+        return self.backend.checkpointer
+
+    async def start(self):
+        await self.backend.start()
+
+    async def close(self):
+        await self.backend.close()
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    async def add(self, session_id: str, config: dict):
+        await self.backend.save_config(session_id, config)
+        self._sessions[session_id] = Session(session_id=session_id, config=config)
+        await self.evict()
+
+    async def get(self, session_id: str) -> Session | None:
+        session = self._sessions.get(session_id)
+        if session is None:
+            # the session may have been created by another worker, or dropped from the local cache.
+            config = await self.backend.load_config(session_id)
+            if config is None:
+                return None
+            session = self._sessions.setdefault(session_id, Session(session_id=session_id, config=config))
+        self._touch(session)
+        return session
+
+    async def get_config(self, session_id: str) -> dict | None:
+        session = await self.get(session_id)
+        return session.config if session else None
+
+    async def append_messages(self, session_id: str, messages: list[BaseMessage]):
+        await self.backend.append_messages(session_id, messages)
+
+    async def load_messages(self, session_id: str) -> list[BaseMessage]:
+        return await self.backend.load_messages(session_id)
+
+    def iter_messages(self, session_id: str) -> AsyncIterator[BaseMessage]:
+        return self.backend.iter_messages(session_id)
+
+    def set_interviewer(self, session_id: str, interviewer: Interviewer) -> bool:
+        """Keep the interviewer of a live session, return False if the session is gone."""
+        session = self._sessions.get(session_id)
+        if session is None:
+            return False
+        session.interviewer = interviewer
+        self._touch(session)
+        return True
+
+    def connect(self, session_id: str):
+        """Mark a websocket of the session as open, the session isn't evicted until it is closed."""
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.connections += 1
+
+    def disconnect(self, session_id: str):
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.connections = max(0, session.connections - 1)
+            self._touch(session)
+
+    async def remove(self, session_id: str):
+        """Delete the session everywhere."""
+        self._sessions.pop(session_id, None)
+        config = await self.backend.delete(session_id)
+        if config is not None:
+            self._cleanup(session_id, config)
+
+    async def evict(self) -> int:
+        """Evict idle sessions, then LRU sessions until the count and memory bounds hold."""
+        now = time.monotonic()
+        evicted = 0
+        for session in list(self._sessions.values()):
+            if session.connections == 0 and now - session.last_active > self.idle_ttl:
+                await self._evict(session.session_id)
+                evicted += 1
+
+        total_bytes = self.memory_bytes()
+        for session in list(self._sessions.values()):
+            if len(self._sessions) <= self.max_count and total_bytes <= self.memory_budget:
+                break
+            if session.connections > 0:
+                continue
+            total_bytes -= session.estimate_bytes()
+            await self._evict(session.session_id)
+            evicted += 1
+
+        if self.backend.persistent:
+            # keep sessions connected to this worker alive for the other workers.
+            for session in list(self._sessions.values()):
+                if session.connections > 0:
+                    await self.backend.touch(session.session_id)
+            for session_id in await self.backend.expired(self.idle_ttl):
+                if session_id not in self._sessions or self._sessions[session_id].connections == 0:
+                    await self.remove(session_id)
+                    evicted += 1
+
+        if evicted:
+            logger.info(f"Evicted {evicted} session(s), {len(self._sessions)} left.")
+        return evicted
+
+    def memory_bytes(self) -> int:
+        return sum(session.estimate_bytes() for session in self._sessions.values())
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "interviewers": sum(1 for s in self._sessions.values() if s.interviewer is not None),
+            "connected_sessions": sum(1 for s in self._sessions.values() if s.connections > 0),
+            "bytes": self.memory_bytes(),
+            "max_count": self.max_count,
+            "memory_budget": self.memory_budget,
+        }
+
+    async def run_sweeper(self, interval: float = SESSION_SWEEP_INTERVAL_SECONDS):
+        """Periodically evict sessions, until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.evict()
+            except Exception as e:
+                logger.error(f"Session sweep failed: {e}")
+
+    def _touch(self, session: Session):
+        session.last_active = time.monotonic()
+        self._sessions.move_to_end(session.session_id)
+
+    async def _evict(self, session_id: str):
+        if self.backend.persistent:
+            self._sessions.pop(session_id, None)
+        else:
+            await self.remove(session_id)
+
+    def _cleanup(self, session_id: str, config: dict):
+        cv_path = config.get("cv_path")
+        if cv_path:
+            try:
+                os.remove(cv_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Failed to remove CV file {cv_path}: {e}")
+        logger.info(f"Session removed: {session_id}")
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable
+
+import dotenv
+
+logger = logging.getLogger(__name__)
+
+dotenv.load_dotenv(override=False)
+
+# minimum size of a segment before it is sent to STT. ~10 seconds of opus audio from MediaRecorder.
+STT_SEGMENT_MIN_BYTES = int(os.getenv("STT_SEGMENT_MIN_BYTES", 160_000))
+# how much of the previous segment's transcript is passed to whisper as prompt, to keep the segments coherent.
+STT_PROMPT_MAX_CHARS = 500
+
+WEBM_CLUSTER_ID = b"\x1f\x43\xb6\x75"
+
+
+class StreamingTranscriber:
+    """
+    Transcribe a recording while it is still being uploaded.
+
+    The browser sends timesliced MediaRecorder chunks. For webm, the stream is cut at cluster
+    boundaries once enough audio is buffered, and each segment (prefixed by the webm header) is
+    transcribed in the background. When the recording ends only the tail is left to transcribe.
+    Other containers can't be cut safely, so they are transcribed as a whole at the end.
+    """
+
+    def __init__(
+        self,
+        transcribe: Callable[[bytes, str, str | None], Awaitable[str]],
+        format_: str = "webm",
+        min_segment_bytes: int = STT_SEGMENT_MIN_BYTES,
+    ):
+        self.transcribe = transcribe
+        self.format = format_
+        self.min_segment_bytes = min_segment_bytes
+        self.buffer = bytearray()
+        self.init_segment: bytes | None = None
+        self.segment_start = 0
+        self.next_seq = 0
+        self.tasks: list[asyncio.Task[str]] = []
+
+    @property
+    def data(self) -> bytes:
+        """The whole recording received so far."""
+        return bytes(self.buffer)
+
+    def add_chunk(self, chunk: bytes, seq: int | None = None):
+        if seq is not None and seq != self.next_seq:
+            raise ValueError(f"Got audio chunk {seq}, expected {self.next_seq}")
+        self.next_seq += 1
+        self.buffer += chunk
+        if self.format != "webm":
+            return
+
+        if self.init_segment is None:
+            first_cluster = self.buffer.find(WEBM_CLUSTER_ID)
+            if first_cluster < 0:
+                return
+            self.init_segment = bytes(self.buffer[:first_cluster])
+            self.segment_start = first_cluster
+
+        if len(self.buffer) - self.segment_start < self.min_segment_bytes:
+            return
+        # cut at the last cluster started, everything before it is complete.
+        boundary = self.buffer.rfind(WEBM_CLUSTER_ID, self.segment_start + 1)
+        if boundary < 0 or boundary - self.segment_start < self.min_segment_bytes:
+            return
+        self._start_segment(self.segment_start, boundary)
+        self.segment_start = boundary
+
+    async def finish(self) -> str:
+        """Transcribe the tail and return the whole transcript."""
+        if self.init_segment is None:
+            # not segmentable, transcribe the whole recording at once.
+            self.tasks.append(asyncio.create_task(self.transcribe(self.data, self.format, None)))
+        elif self.segment_start < len(self.buffer):
+            self._start_segment(self.segment_start, len(self.buffer))
+        self.segment_start = len(self.buffer)
+        logger.info(f"Waiting for {len(self.tasks)} transcription segment(s)...")
+        texts = await asyncio.gather(*self.tasks)
+        return " ".join(text.strip() for text in texts if text.strip())
+
+    def cancel(self):
+        for task in self.tasks:
+            task.cancel()
+
+    def _start_segment(self, start: int, end: int):
+        data = self.init_segment + bytes(self.buffer[start:end])
+        previous = self.tasks[-1] if self.tasks else None
+        logger.info(f"Transcribing segment {len(self.tasks)}, size: {len(data)} bytes")
+        self.tasks.append(asyncio.create_task(self._transcribe_segment(data, previous)))
+
+    async def _transcribe_segment(self, data: bytes, previous: asyncio.Task[str] | None) -> str:
+        prompt = None
+        if previous is not None:
+            try:
+                prompt = (await asyncio.shield(previous))[-STT_PROMPT_MAX_CHARS:] or None
+            except Exception:
+                # the previous segment will raise in `finish`, still transcribe this one.
+                prompt = None
+        return await self.transcribe(data, self.format, prompt)
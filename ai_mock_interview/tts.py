@@ -0,0 +1,484 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO
+
+import dotenv
+from openai import AsyncOpenAI
+
+from ai_mock_interview.metrics import STAGE_SECONDS, observe
+from ai_mock_interview.scheduler import PRIORITY_INTERVIEWER, PRIORITY_TUTOR, UPSTREAM_SCHEDULER
+
+logger = logging.getLogger(__name__)
+
+dotenv.load_dotenv(override=False)
+
+TTS_MODEL_NAME = "tts-1"
+TTS_VOICE = "alloy"
+# output formats a client can ask for, see `negotiate_tts_format`.
+TTS_FORMATS = ("opus", "pcm", "mp3")
+DEFAULT_TTS_FORMAT = os.getenv("DEFAULT_TTS_FORMAT", "mp3")
+# the pcm output of the speech API: 24 kHz, 16-bit signed little-endian, mono.
+PCM_SAMPLE_RATE = 24_000
+PCM_SAMPLE_WIDTH = 2
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", str(Path(__file__).resolve().parent.parent / "cache" / "tts"))
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+# size of the pieces cached audio is streamed in.
+TTS_CACHE_READ_SIZE = 16 * 1024
+# media type and file extension of the replay of each format, pcm is replayed as WAV.
+REPLAY_FORMATS = {"mp3": ("audio/mpeg", "mp3"), "opus": ("audio/ogg", "ogg"), "pcm": ("audio/wav", "wav")}
+
+# MPEG audio layer III, see http://www.mp3-tech.org/programmer/frame_header.html
+_MP3_BITRATES_KBPS = {
+    "mpeg1": (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    "mpeg2": (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+_ID3_HEADER_SIZE = 10
+_OGG_PAGE_HEADER_SIZE = 27
+_OGG_BOS, _OGG_EOS = 0x02, 0x04
+# frame duration in 48 kHz samples of each Opus configuration, see RFC 6716, section 3.1.
+_OPUS_FRAME_SAMPLES = (480, 960, 1920, 2880) * 3 + (480, 960) * 2 + (120, 240, 480, 960) * 4
+
+
+def negotiate_tts_format(accepted: str | None) -> str:
+    """Pick the first supported format of the client's comma-separated preference list, else the default."""
+    for format_ in (accepted or "").split(","):
+        format_ = format_.strip().lower()
+        if format_ in TTS_FORMATS:
+            return format_
+    return DEFAULT_TTS_FORMAT
+
+
+class FrameSplitter:
+    """
+    Re-chunk an audio byte stream on frame boundaries, so that every chunk sent to the client can be
+    decoded on its own. `feed` returns the complete frames received so far, `flush` what is left.
+    A stream that can't be parsed is passed through as is. Subclasses parse a format in `_frame_size`,
+    this class forwards every chunk as it arrives.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._passthrough = False
+
+    def feed(self, data: bytes) -> bytes:
+        self._buffer += data
+        if self._passthrough:
+            end = len(self._buffer)
+        else:
+            end = self._aligned_end()
+            if end is None:
+                logger.warning(f"Unexpected {type(self).__name__} audio frame, forwarding the stream unaligned.")
+                self._passthrough = True
+                end = len(self._buffer)
+        chunk = bytes(self._buffer[:end])
+        del self._buffer[:end]
+        return chunk
+
+    def flush(self) -> bytes:
+        chunk = bytes(self._buffer)
+        self._buffer.clear()
+        return chunk
+
+    def _aligned_end(self) -> int | None:
+        """Offset of the end of the last complete frame in the buffer, None if the stream is not parseable."""
+        end = 0
+        while end < len(self._buffer):
+            size = self._frame_size(end)
+            if size is None:
+                return None
+            if size == 0 or end + size > len(self._buffer):
+                break
+            end += size
+        return end
+
+    def _frame_size(self, offset: int) -> int | None:
+        """Size of the frame starting at `offset`, 0 if its header is incomplete, None if it is invalid."""
+        return len(self._buffer) - offset
+
+
+class MP3FrameSplitter(FrameSplitter):
+    def _frame_size(self, offset: int) -> int | None:
+        buffer = self._buffer
+        if len(buffer) - offset < 4:
+            return 0
+        if buffer[offset : offset + 3] == b"ID3":
+            # an ID3v2 tag, sent along with the first frame.
+            if len(buffer) - offset < _ID3_HEADER_SIZE:
+                return 0
+            size = 0
+            for byte in buffer[offset + 6 : offset + 10]:
+                size = (size << 7) | (byte & 0x7F)
+            footer = _ID3_HEADER_SIZE if buffer[offset + 5] & 0x10 else 0
+            return _ID3_HEADER_SIZE + size + footer
+        b1, b2 = buffer[offset + 1], buffer[offset + 2]
+        version, layer = (b1 >> 3) & 0b11, (b1 >> 1) & 0b11
+        bitrate_index, sample_rate_index, padding = b2 >> 4, (b2 >> 2) & 0b11, (b2 >> 1) & 1
+        if (
+            buffer[offset] != 0xFF
+            or b1 & 0xE0 != 0xE0
+            or version == 1
+            or layer != 1  # layer III
+            or bitrate_index in (0, 15)
+            or sample_rate_index == 3
+        ):
+            return None
+        bitrate = _MP3_BITRATES_KBPS["mpeg1" if version == 3 else "mpeg2"][bitrate_index] * 1000
+        sample_rate = _MP3_SAMPLE_RATES[version][sample_rate_index]
+        samples = 1152 if version == 3 else 576
+        return samples // 8 * bitrate // sample_rate + padding
+
+
+class OggFrameSplitter(FrameSplitter):
+    """Split an Ogg stream (the container of the opus output) on pages."""
+
+    def _frame_size(self, offset: int) -> int | None:
+        buffer = self._buffer
+        if len(buffer) - offset < _OGG_PAGE_HEADER_SIZE:
+            return 0
+        if buffer[offset : offset + 4] != b"OggS":
+            return None
+        n_segments = buffer[offset + 26]
+        header_size = _OGG_PAGE_HEADER_SIZE + n_segments
+        if len(buffer) - offset < header_size:
+            return 0
+        return header_size + sum(buffer[offset + _OGG_PAGE_HEADER_SIZE : offset + header_size])
+
+
+class PCMFrameSplitter(FrameSplitter):
+    """Split raw PCM on sample boundaries."""
+
+    def _aligned_end(self) -> int | None:
+        return len(self._buffer) - len(self._buffer) % PCM_SAMPLE_WIDTH
+
+
+FRAME_SPLITTERS = {"mp3": MP3FrameSplitter, "opus": OggFrameSplitter, "pcm": PCMFrameSplitter}
+
+
+class SpeechCache:
+    """
+    Synthesized audio on disk, one file per (model, voice, format, text) hash, so speaking the same text
+    again (replays, exports, repeated questions, from any worker) costs no TTS call. The least recently
+    used files are removed beyond `max_bytes`.
+    """
+
+    def __init__(self, path: str | Path | None = TTS_CACHE_DIR, max_bytes: int = TTS_CACHE_MAX_BYTES):
+        self.path = Path(path) if path else None
+        self.max_bytes = max_bytes
+        self._bytes: int | None = None  # size of the cache, as far as this process knows
+
+    @staticmethod
+    def key(text: str, format_: str, model: str = TTS_MODEL_NAME, voice: str = TTS_VOICE) -> str:
+        return hashlib.sha256("\0".join((model, voice, format_, text)).encode("utf-8")).hexdigest()
+
+    def file(self, key: str, extension: str) -> Path | None:
+        """The cached file, None if it is not cached. Marks it as recently used."""
+        if self.path is None:
+            return None
+        file = self.path / f"{key}.{extension}"
+        try:
+            os.utime(file)
+        except FileNotFoundError:
+            return None
+        return file
+
+    def get(self, key: str, extension: str) -> bytes | None:
+        file = self.file(key, extension)
+        if file is None:
+            return None
+        try:
+            return file.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key: str, extension: str, data: bytes | BinaryIO) -> Path | None:
+        """Cache `data`, bytes or a file read from its current position, return the cached file."""
+        if self.path is None:
+            return None
+        self.path.mkdir(parents=True, exist_ok=True)
+        file = self.path / f"{key}.{extension}"
+        # a unique temporary file, the same audio can be cached at once by several requests or workers.
+        with tempfile.NamedTemporaryFile(dir=self.path, prefix=f"{key}.", suffix=".tmp", delete=False) as f:
+            try:
+                if isinstance(data, bytes):
+                    f.write(data)
+                else:
+                    shutil.copyfileobj(data, f)
+                size = f.tell()
+            except BaseException:
+                f.close()
+                os.remove(f.name)
+                raise
+        os.replace(f.name, file)
+        if self._bytes is None:
+            self._bytes = self._size()
+        else:
+            self._bytes += size
+        if self._bytes > self.max_bytes:
+            self._prune()
+        return file
+
+    def _size(self) -> int:
+        return sum(file.stat().st_size for file in self.path.iterdir() if file.suffix != ".tmp")
+
+    def _prune(self):
+        files = []
+        for file in self.path.iterdir():
+            try:
+                stat = file.stat()
+            except FileNotFoundError:
+                continue
+            if file.suffix != ".tmp":
+                files.append((stat.st_mtime, stat.st_size, file))
+        files.sort()
+        self._bytes = sum(size for _, size, _ in files)
+        # prune down to 90% of the budget, so every write doesn't scan the directory again.
+        target = self.max_bytes * 0.9
+        for _, size, file in files:
+            if self._bytes <= target:
+                break
+            file.unlink(missing_ok=True)
+            self._bytes -= size
+
+
+TTS_CACHE = SpeechCache()
+
+
+async def astream_speech(
+    client: AsyncOpenAI,
+    text: str,
+    format_: str = DEFAULT_TTS_FORMAT,
+    cache: SpeechCache = TTS_CACHE,
+    priority: int = PRIORITY_INTERVIEWER,
+) -> AsyncIterator[bytes]:
+    """
+    Synthesize `text` and yield the audio in `format_` as soon as complete frames arrive.
+    Every chunk holds whole frames, so the client can start playback with the first one.
+    The audio is cached once complete, and streamed from the cache the next time.
+    """
+    splitter = FRAME_SPLITTERS[format_]()
+    key = cache.key(text, format_)
+    data = await asyncio.to_thread(cache.get, key, format_)
+    if data is not None:
+        logger.debug(f"TTS cache hit: {key[:12]}")
+        for start in range(0, len(data), TTS_CACHE_READ_SIZE):
+            chunk = splitter.feed(data[start : start + TTS_CACHE_READ_SIZE])
+            if chunk:
+                yield chunk
+        chunk = splitter.flush()
+        if chunk:
+            yield chunk
+        return
+
+    chunks = []
+    with observe("tts", TTS_MODEL_NAME):
+        start_time = time.perf_counter()
+        async with UPSTREAM_SCHEDULER.aopen(
+            lambda: client.audio.speech.with_streaming_response.create(
+                model=TTS_MODEL_NAME, voice=TTS_VOICE, input=text, response_format=format_
+            ),
+            client.api_key,
+            priority,
+        ) as response:
+            # read the bytes as they arrive, instead of waiting for fixed-size chunks.
+            async for data in response.iter_bytes():
+                if start_time is not None:
+                    STAGE_SECONDS.observe(
+                        time.perf_counter() - start_time, stage="tts_first_byte", model=TTS_MODEL_NAME
+                    )
+                    start_time = None
+                chunk = splitter.feed(data)
+                if chunk:
+                    chunks.append(chunk)
+                    yield chunk
+        chunk = splitter.flush()
+        if chunk:
+            chunks.append(chunk)
+            yield chunk
+    try:
+        await asyncio.to_thread(cache.set, key, format_, b"".join(chunks))
+    except OSError as e:
+        logger.warning(f"Failed to cache TTS audio {key[:12]}: {e}")
+
+
+async def areplay_file(
+    client: AsyncOpenAI, sentences: list[str], format_: str, cache: SpeechCache = TTS_CACHE
+) -> Path | None:
+    """
+    The audio of `sentences` as a single cached file, see `REPLAY_FORMATS` for its type. Sentences that
+    are no longer cached are synthesized again, those that fail are skipped. None if there is no audio,
+    or if the cache is disabled.
+    """
+    _, extension = REPLAY_FORMATS[format_]
+    sentence_keys = [cache.key(sentence, format_) for sentence in sentences]
+    if len(sentence_keys) == 1 and extension == format_:
+        key = sentence_keys[0]
+    else:
+        key = hashlib.sha256("".join([extension, *sentence_keys]).encode("utf-8")).hexdigest()
+    file = await asyncio.to_thread(cache.file, key, extension)
+    if file is not None:
+        return file
+
+    parts = []
+    for sentence in sentences:
+        try:
+            speech = astream_speech(client, sentence, format_, cache, PRIORITY_TUTOR)
+            parts.append(b"".join([chunk async for chunk in speech]))
+        except Exception as e:
+            logger.error(f"TTS failed for sentence: {e}")
+    parts = [part for part in parts if part]
+    if not parts:
+        return None
+    if format_ == "pcm":
+        data = b"".join(parts)
+        data = wav_header(len(data)) + data
+    elif format_ == "opus" and len(parts) > 1:
+        data = await asyncio.to_thread(join_ogg_opus, parts)
+    else:
+        data = b"".join(parts)
+    return await asyncio.to_thread(cache.set, key, extension, data)
+
+
+def wav_header(data_length: int) -> bytes:
+    """Header of a WAV file holding `data_length` bytes of the pcm output."""
+    byte_rate = PCM_SAMPLE_RATE * PCM_SAMPLE_WIDTH
+    return (
+        b"RIFF"
+        + struct.pack("<I", 36 + data_length)
+        + b"WAVEfmt "
+        + struct.pack("<IHHIIHH", 16, 1, 1, PCM_SAMPLE_RATE, byte_rate, PCM_SAMPLE_WIDTH, PCM_SAMPLE_WIDTH * 8)
+        + b"data"
+        + struct.pack("<I", data_length)
+    )
+
+
+def join_ogg_opus(parts: list[bytes]) -> bytes:
+    """
+    Join Ogg Opus files into a single logical stream: the headers of the first file, then the audio pages
+    of every file with continuous sequence numbers and granule positions. Concatenated files would form
+    a chained stream, that most players stop playing after the first file. Parts that are not Ogg Opus are
+    concatenated as they are.
+    """
+    parsed = [_ogg_opus_pages(part) for part in parts]
+    if any(pages is None for pages in parsed):
+        logger.warning("Unexpected Ogg Opus audio, concatenating the replay as is.")
+        return b"".join(parts)
+
+    headers = [page for page in parsed[0] if page.samples is None]
+    serial = headers[0].serial
+    output = [_ogg_page(page, page.flags & ~_OGG_EOS, page.granule, serial, i) for i, page in enumerate(headers)]
+    offset = 0
+    for part_index, pages in enumerate(parsed):
+        audio_pages = [page for page in pages if page.samples is not None]
+        samples = 0
+        for page_index, page in enumerate(audio_pages):
+            samples += page.samples
+            flags = page.flags & ~(_OGG_BOS | _OGG_EOS)
+            if page.granule < 0:
+                # no packet ends in the page.
+                granule = -1
+            elif part_index == len(parsed) - 1 and page_index == len(audio_pages) - 1:
+                # the granule position of the last page trims the padding at the end of the audio.
+                flags |= _OGG_EOS
+                granule = offset + page.granule
+            else:
+                granule = offset + samples
+            output.append(_ogg_page(page, flags, granule, serial, len(output)))
+        offset += samples
+    return b"".join(output)
+
+
+@dataclass
+class _OggPage:
+    flags: int
+    granule: int
+    serial: int
+    # the 48 kHz samples of the audio packets that end in the page, None for the header pages.
+    samples: int | None
+    segments: bytes
+    body: bytes
+
+
+def _ogg_opus_pages(data: bytes) -> list[_OggPage] | None:
+    """The pages of an Ogg Opus file, None if it is not Ogg Opus."""
+    pages = []
+    packets = 0  # packets that ended so far, the first is the OpusHead header and the second OpusTags
+    packet_head = b""  # first bytes of the current packet, its TOC
+    offset = 0
+    while offset < len(data):
+        if len(data) - offset < _OGG_PAGE_HEADER_SIZE or data[offset : offset + 4] != b"OggS":
+            return None
+        flags = data[offset + 5]
+        granule, serial = struct.unpack_from("<qI", data, offset + 6)
+        header_size = _OGG_PAGE_HEADER_SIZE + data[offset + 26]
+        segments = data[offset + _OGG_PAGE_HEADER_SIZE : offset + header_size]
+        body = data[offset + header_size : offset + header_size + sum(segments)]
+        if len(segments) != header_size - _OGG_PAGE_HEADER_SIZE or len(body) != sum(segments):
+            return None
+        offset += header_size + len(body)
+
+        # audio packets start on a new page after the headers.
+        samples = None if packets < 2 else 0
+        position = 0
+        for size in segments:
+            packet_head = (packet_head + body[position : position + size])[:2]
+            position += size
+            if size < 255:
+                if samples is not None and packet_head:
+                    samples += _opus_packet_samples(packet_head)
+                packets += 1
+                packet_head = b""
+        pages.append(_OggPage(flags, granule, serial, samples, segments, body))
+    if not pages or not pages[0].body.startswith(b"OpusHead"):
+        return None
+    return pages
+
+
+def _opus_packet_samples(packet: bytes) -> int:
+    """Number of 48 kHz samples in an Opus packet, from its TOC byte, see RFC 6716, section 3.1."""
+    toc = packet[0]
+    code = toc & 0b11
+    if code == 0:
+        frames = 1
+    elif code in (1, 2):
+        frames = 2
+    else:
+        frames = packet[1] & 0x3F if len(packet) > 1 else 0
+    return frames * _OPUS_FRAME_SAMPLES[toc >> 3]
+
+
+def _ogg_page(page: _OggPage, flags: int, granule: int, serial: int, sequence: int) -> bytes:
+    """Serialize `page` with new header fields."""
+    header = b"OggS" + struct.pack("<BBqIII", 0, flags, granule, serial, sequence, 0) + bytes([len(page.segments)])
+    data = bytearray(header + page.segments + page.body)
+    struct.pack_into("<I", data, 22, _ogg_crc(data))
+    return bytes(data)
+
+
+def _ogg_crc(data: bytes) -> int:
+    """The CRC-32 of an Ogg page (polynomial 0x04C11DB7, not reflected), computed with its CRC field zeroed."""
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ _OGG_CRC_TABLE[(crc >> 24) ^ byte]
+    return crc
+
+
+def _ogg_crc_table() -> list[int]:
+    table = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else crc << 1
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+_OGG_CRC_TABLE = _ogg_crc_table()
@@ -1,14 +1,28 @@
+import asyncio
+import hashlib
 import logging
 import os
 import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
 
 import dotenv
-from langchain_openai import ChatOpenAI
+
+from ai_mock_interview.clients import get_chat_model, hash_api_key
+from ai_mock_interview.metrics import observe
+from ai_mock_interview.scheduler import PRIORITY_SPECULATIVE, PRIORITY_TUTOR, UPSTREAM_SCHEDULER
+from ai_mock_interview.utils import TTLCache
 
 logger = logging.getLogger(__name__)
 
 dotenv.load_dotenv(override=False)
 TUTOR_MODEL_NAME = os.getenv("TUTOR_MODEL_NAME")
+TUTOR_CACHE_SIZE = int(os.getenv("TUTOR_CACHE_SIZE", 2048))
+TUTOR_CACHE_TTL_SECONDS = float(os.getenv("TUTOR_CACHE_TTL_SECONDS", 24 * 3600))
+# speculative tutor calls running at once in the process, more are skipped.
+TUTOR_SPECULATION_MAX_PENDING = int(os.getenv("TUTOR_SPECULATION_MAX_PENDING", 32))
+# turns whose speculative results are kept per session.
+TUTOR_SPECULATION_KEEP_TURNS = int(os.getenv("TUTOR_SPECULATION_KEEP_TURNS", 20))
 
 GRAMMAR_TUTOR_SYSTEM_PROMPT = """
 You are a tutor that helps users improve their answers during a mock interview.
@@ -58,49 +72,193 @@ Answer: ...
 """
 
 
+class TutorCache:
+    """
+    LRU cache of tutor outputs keyed by the prompt kind and a hash of the API key and the input, shared by the
+    sessions using the same key: a key doesn't pay for, or get the errors of, the calls made for another one.
+    Identical requests still in flight share one LLM call, which is cancelled when all of them are.
+    """
+
+    def __init__(self, maxsize: int = TUTOR_CACHE_SIZE, ttl: float = TUTOR_CACHE_TTL_SECONDS):
+        self._results = TTLCache(ttl=ttl, maxsize=maxsize)
+        self._in_flight: dict[str, asyncio.Task] = {}
+        self._waiters: dict[str, int] = {}
+
+    @staticmethod
+    def key(kind: str, api_key: str, *inputs: str) -> str:
+        parts = (TUTOR_MODEL_NAME or "", hash_api_key(api_key), *inputs)
+        digest = hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+        return f"{kind}:{digest}"
+
+    def get(self, key: str) -> str | None:
+        return self._results.get(key)
+
+    def set(self, key: str, value: str):
+        self._results.set(key, value)
+
+    async def aget_or_call(self, key: str, call: Callable[[], Awaitable[str]], priority: int = PRIORITY_TUTOR) -> str:
+        """Return the cached output, or the output of `call`, its upstream calls made at `priority` or higher."""
+        cached = self._results.get(key)
+        if cached is not None:
+            logger.info(f"Tutor cache hit: {key[:20]}")
+            return cached
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(call())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            logger.info(f"Tutor request coalesced: {key[:20]}")
+            # e.g. a click on a speculative call, which mustn't wait behind the other speculative calls.
+            UPSTREAM_SCHEDULER.raise_priority(task, priority)
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            # a waiter leaving (e.g. websocket closed) mustn't cancel the call for the others.
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[key] == 1:
+                task.cancel()
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+    def _done(self, key: str, task: asyncio.Task):
+        del self._in_flight[key]
+        if task.cancelled():
+            return
+        if task.exception() is None:
+            self._results.set(key, task.result())
+
+
+TUTOR_CACHE = TutorCache()
+
+
 class Tutor:
-    def __init__(self, api_key: str):
-        self.model = ChatOpenAI(
+    def __init__(self, api_key: str, cache: TutorCache = TUTOR_CACHE):
+        self.api_key = api_key
+        self.model = get_chat_model(
+            api_key,
             model=TUTOR_MODEL_NAME,
             # temperature=0.7,
-            api_key=api_key,
         )
+        self.cache = cache
         logger.debug("Tutor model initialized.")
 
     def improve_grammar(self, answer: str) -> str:
+        key = TutorCache.key("grammar", self.api_key, answer)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
         messages = [("system", GRAMMAR_TUTOR_SYSTEM_PROMPT), ("human", answer)]
         logger.info("Calling Grammar Tutor LLM...")
         start_time = time.time()
-        response = self.model.invoke(messages)
+        with observe("tutor_grammar", TUTOR_MODEL_NAME):
+            response = UPSTREAM_SCHEDULER.run(lambda: self.model.invoke(messages))
         end_time = time.time()
         logger.info(f"Grammar Tutor LLM call took {end_time - start_time:.2f} seconds")
+        self.cache.set(key, response.content)
         return response.content
 
-    async def aimprove_grammar(self, answer: str) -> str:
+    async def aimprove_grammar(self, answer: str, priority: int = PRIORITY_TUTOR) -> str:
         messages = [("system", GRAMMAR_TUTOR_SYSTEM_PROMPT), ("human", answer)]
-        logger.info("Calling Grammar Tutor LLM...")
-        start_time = time.time()
-        response = await self.model.ainvoke(messages)
-        end_time = time.time()
-        logger.info(f"Grammar Tutor LLM call took {end_time - start_time:.2f} seconds")
-        return response.content
+        return await self.cache.aget_or_call(
+            TutorCache.key("grammar", self.api_key, answer),
+            lambda: self._ainvoke(messages, "Grammar Tutor", "tutor_grammar", priority),
+            priority,
+        )
 
     def improve_answer(self, question: str, answer: str) -> str:
+        key = TutorCache.key("answer", self.api_key, question, answer)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
         input_ = f"Question: {question}\nAnswer: {answer}"
         messages = [("system", ANSWER_TUTOR_SYSTEM_PROMPT), ("human", input_)]
         logger.info("Calling Answer Tutor LLM...")
         start_time = time.time()
-        response = self.model.invoke(messages)
+        with observe("tutor_answer", TUTOR_MODEL_NAME):
+            response = UPSTREAM_SCHEDULER.run(lambda: self.model.invoke(messages))
         end_time = time.time()
         logger.info(f"Answer Tutor LLM call took {end_time - start_time:.2f} seconds")
+        self.cache.set(key, response.content)
         return response.content
 
-    async def aimprove_answer(self, question: str, answer: str) -> str:
+    async def aimprove_answer(self, question: str, answer: str, priority: int = PRIORITY_TUTOR) -> str:
         input_ = f"Question: {question}\nAnswer: {answer}"
         messages = [("system", ANSWER_TUTOR_SYSTEM_PROMPT), ("human", input_)]
-        logger.info("Calling Answer Tutor LLM...")
+        return await self.cache.aget_or_call(
+            TutorCache.key("answer", self.api_key, question, answer),
+            lambda: self._ainvoke(messages, "Answer Tutor", "tutor_answer", priority),
+            priority,
+        )
+
+    async def _ainvoke(self, messages: list, name: str, stage: str, priority: int) -> str:
+        logger.info(f"Calling {name} LLM...")
         start_time = time.time()
-        response = await self.model.ainvoke(messages)
+        with observe(stage, TUTOR_MODEL_NAME):
+            response = await UPSTREAM_SCHEDULER.arun(lambda: self.model.ainvoke(messages), self.api_key, priority)
         end_time = time.time()
-        logger.info(f"Answer Tutor LLM call took {end_time - start_time:.2f} seconds")
+        logger.info(f"{name} LLM call took {end_time - start_time:.2f} seconds")
         return response.content
+
+
+class SpeculativeTutor:
+    """
+    Start the tutor calls for an answer as soon as it is transcribed, so clicking "Grammar Check" or
+    "See AI Answer" returns at once. The calls run in the lowest priority class of the upstream scheduler and
+    their results land in the tutor cache: a click on the same text finds the result there, or joins the
+    call still running and raises it to the tutor priority, while a click on another text makes a new call. Speculation is skipped when `max_pending` speculative calls already
+    run in the process, or when upstream calls are waiting for a slot, and `cancel` stops the pending ones.
+    """
+
+    _pending = 0  # speculative calls running in the process
+
+    def __init__(
+        self,
+        tutor: Tutor,
+        max_pending: int = TUTOR_SPECULATION_MAX_PENDING,
+        keep_turns: int = TUTOR_SPECULATION_KEEP_TURNS,
+    ):
+        self.tutor = tutor
+        self.max_pending = max_pending
+        self.keep_turns = keep_turns
+        # (kind, index) -> task
+        self._tasks: OrderedDict[tuple[str, int], asyncio.Task] = OrderedDict()
+
+    def speculate(self, index: int, question: str, answer: str):
+        if SpeculativeTutor._pending + 2 > self.max_pending:
+            logger.info(f"Skipped tutor speculation for Q{index}: {SpeculativeTutor._pending} pending.")
+            return
+        if UPSTREAM_SCHEDULER.queued:
+            logger.info(f"Skipped tutor speculation for Q{index}: {UPSTREAM_SCHEDULER.queued} upstream call(s) queued.")
+            return
+        self._start(("grammar", index), self.tutor.aimprove_grammar(answer=answer, priority=PRIORITY_SPECULATIVE))
+        self._start(
+            ("answer", index),
+            self.tutor.aimprove_answer(question=question, answer=answer, priority=PRIORITY_SPECULATIVE),
+        )
+        while len(self._tasks) > 2 * self.keep_turns:
+            _, task = self._tasks.popitem(last=False)
+            task.cancel()
+
+    def cancel(self):
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+    def _start(self, key: tuple[str, int], coro: Awaitable[str]):
+        previous = self._tasks.pop(key, None)
+        if previous is not None:
+            previous.cancel()
+        SpeculativeTutor._pending += 1
+        task = asyncio.ensure_future(coro)
+        task.add_done_callback(self._done)
+        self._tasks[key] = task
+
+    @staticmethod
+    def _done(task: asyncio.Task):
+        SpeculativeTutor._pending -= 1
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Speculative tutor call failed: {task.exception()}")
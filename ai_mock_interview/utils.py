@@ -1,9 +1,35 @@
+import asyncio
 import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
 
-from openai import OpenAI
+import dotenv
+from openai import AuthenticationError
+
+from ai_mock_interview.clients import get_async_client, hash_api_key
+from ai_mock_interview.job_titles import JobTitleCache
+from ai_mock_interview.metrics import observe
+from ai_mock_interview.scheduler import UPSTREAM_SCHEDULER
 
 logger = logging.getLogger(__name__)
 
+dotenv.load_dotenv(override=False)
+
+API_KEY_CHECK_TTL_SECONDS = float(os.getenv("API_KEY_CHECK_TTL_SECONDS", 600))
+JOB_TITLE_CACHE_PATH = os.getenv(
+    "JOB_TITLE_CACHE_PATH", str(Path(__file__).resolve().parent.parent / "cache" / "job_titles.json")
+)
+JOB_TITLE_CACHE_SIZE = int(os.getenv("JOB_TITLE_CACHE_SIZE", 10_000))
+JOB_TITLE_CHECK_MODEL_NAME = "gpt-5-nano-2025-08-07"
+JOB_TITLE_CHECK_PROMPT = "Is '{job_title}' a job title? Return 1 if it is, 0 otherwise, don't return other things."
+
+# sentence terminators followed by whitespace (latin) or CJK full-width terminators.
+SENTENCE_BOUNDARY_PATTERN = re.compile(r"[.!?]+[\"'”’)\]]*\s+|[。！？]+")
+
 CHECKED_JOB_TITLES = {
     "software engineer": 1,
     "senior software engineer": 1,
@@ -55,32 +81,125 @@ CHECKED_JOB_TITLES = {
     "web engineer": 1,
     "api engineer": 1,
 }
+# seeded with the titles above, learned titles are bounded and persisted to disk.
+JOB_TITLE_CACHE = JobTitleCache(JOB_TITLE_CACHE_PATH, maxsize=JOB_TITLE_CACHE_SIZE, seeds=CHECKED_JOB_TITLES)
+
+
+class TTLCache:
+    """A small in-memory LRU cache whose entries expire `ttl` seconds after being set."""
 
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
 
-def check_openai_api_key(api_key: str) -> bool:
+    def get(self, key: str, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+# api key hash -> whether the key is valid.
+CHECKED_API_KEYS = TTLCache(ttl=API_KEY_CHECK_TTL_SECONDS)
+
+
+async def acheck_openai_api_key(api_key: str) -> bool:
+    if not api_key:
+        logger.error("OpenAI API key check failed: no API key.")
+        return False
+    key_hash = hash_api_key(api_key)
+    cached = CHECKED_API_KEYS.get(key_hash)
+    if cached is not None:
+        return cached
     try:
-        client = OpenAI(api_key=api_key)
-        client.models.list()  # cheap, fast auth check
+        client = get_async_client(api_key)
+        with observe("api_key_check"):
+            await UPSTREAM_SCHEDULER.arun(client.models.list, api_key)  # cheap, fast auth check
         logger.info("OpenAI API key check passed.")
+        CHECKED_API_KEYS.set(key_hash, True)
         return True
+    except AuthenticationError as e:
+        logger.error(f"OpenAI API key check failed: {e}")
+        CHECKED_API_KEYS.set(key_hash, False)
+        return False
     except Exception as e:
+        # transient errors are not cached.
         logger.error(f"OpenAI API key check failed: {e}")
         return False
 
 
-def check_job_title_valid(api_key: str, job_title: str) -> bool:
+async def acheck_job_title_valid(api_key: str, job_title: str) -> bool:
     job_title = job_title.strip().lower()
-    if job_title in CHECKED_JOB_TITLES:
-        v = CHECKED_JOB_TITLES[job_title]
+    v = JOB_TITLE_CACHE.get(job_title)
+    if v is None:
+        # another worker may have checked it already.
+        await asyncio.to_thread(JOB_TITLE_CACHE.reload_if_changed)
+        v = JOB_TITLE_CACHE.get(job_title)
+    if v is not None:
         return v
     logger.info(f"Unknown job title: {job_title}, check through OpenAI API...")
 
-    client = OpenAI(api_key=api_key)
-    prompt = "Is '{job_title}' a job title? Return 1 if it is, 0 otherwise, don't return other things."
-    response = client.responses.create(model="gpt-5-nano-2025-08-07", input=prompt.format(job_title=job_title))
-    assert response.output_text in ("0", "1"), f"Got invalid response from OpenAI: {response.output_text}"
-    result = bool(int(response.output_text))
+    client = get_async_client(api_key)
+    with observe("job_title_check", JOB_TITLE_CHECK_MODEL_NAME):
+        response = await UPSTREAM_SCHEDULER.arun(
+            lambda: client.responses.create(
+                model=JOB_TITLE_CHECK_MODEL_NAME, input=JOB_TITLE_CHECK_PROMPT.format(job_title=job_title)
+            ),
+            api_key,
+        )
+    result = _parse_job_title_check(job_title, response.output_text)
+    await asyncio.to_thread(JOB_TITLE_CACHE.save)
+    return result
+
+
+def _parse_job_title_check(job_title: str, output_text: str) -> bool:
+    assert output_text in ("0", "1"), f"Got invalid response from OpenAI: {output_text}"
+    result = bool(int(output_text))
 
     logger.info(f"Job title '{job_title}' validity check: {result}")
-    CHECKED_JOB_TITLES[job_title] = result
+    JOB_TITLE_CACHE.set(job_title, result)
     return result
+
+
+class SentenceSplitter:
+    """Incrementally split streamed text into sentences.
+
+    Sentences shorter than `min_length` are merged with the following one, so that
+    short fragments (e.g. "Great!") don't each cost a separate TTS request.
+    """
+
+    def __init__(self, min_length: int = 20):
+        self.min_length = min_length
+        self.buffer = ""
+
+    def feed(self, text: str) -> list[str]:
+        """Add a text delta, return the sentences completed by it."""
+        self.buffer += text
+        sentences = []
+        start = 0
+        for match in SENTENCE_BOUNDARY_PATTERN.finditer(self.buffer):
+            sentence = self.buffer[start : match.end()].strip()
+            if len(sentence) < self.min_length:
+                continue
+            sentences.append(sentence)
+            start = match.end()
+        self.buffer = self.buffer[start:]
+        return sentences
+
+    def flush(self) -> str | None:
+        """Return whatever is left in the buffer."""
+        sentence = self.buffer.strip()
+        self.buffer = ""
+        return sentence or None
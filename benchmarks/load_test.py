@@ -0,0 +1,193 @@
+"""
+Run simulated interviews against a running app, and report the throughput and latency of each stage.
+
+Each interview goes through `/setup`, answers `--turns` questions over `/ws` (one binary audio frame
+per answer), then asks for `/diagnosis`. A share of the interviews (`--new-job-titles`) applies for a job
+title the app has never seen, so `/setup` checks it through the Responses API instead of its cache; these
+titles end up in the job title cache of the app. Start the app against the OpenAI stub to measure the app
+itself rather than OpenAI:
+
+    python -m benchmarks.openai_stub --port 8001 &
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 python -m ai_mock_interview.main &
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --interviews 50 --concurrency 10
+
+Stages:
+    setup           POST /setup
+    first_question  websocket connected -> first interviewer message
+    transcription   answer sent -> transcribed answer received
+    first_reply     answer sent -> first interviewer text (a delta when streaming)
+    reply           answer sent -> complete interviewer message
+    reply_audio     answer sent -> end of the interviewer audio (with --voice)
+    diagnosis       POST /diagnosis
+    interview       the whole interview
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+import websockets
+
+from ai_mock_interview.protocol import FrameType, encode_binary_frame
+
+STAGES = ("setup", "first_question", "transcription", "first_reply", "reply", "reply_audio", "diagnosis", "interview")
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    def record(self, stage: str, seconds: float):
+        self.latencies[stage].append(seconds)
+
+    def report(self, elapsed: float) -> str:
+        lines = [
+            f"{'stage':<16}{'count':>8}{'per sec':>10}{'p50 (s)':>10}{'p95 (s)':>10}{'p99 (s)':>10}{'max (s)':>10}"
+        ]
+        for stage in STAGES:
+            values = sorted(self.latencies.get(stage, []))
+            if not values:
+                continue
+            lines.append(
+                f"{stage:<16}{len(values):>8}{len(values) / elapsed:>10.2f}"
+                f"{percentile(values, 50):>10.3f}{percentile(values, 95):>10.3f}"
+                f"{percentile(values, 99):>10.3f}{values[-1]:>10.3f}"
+            )
+        lines.append(f"elapsed: {elapsed:.1f} s")
+        if self.errors:
+            lines.append("errors: " + ", ".join(f"{error} x{count}" for error, count in self.errors.items()))
+        return "\n".join(lines)
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """Nearest-rank percentile."""
+    index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+async def run_interview(http: httpx.AsyncClient, args: argparse.Namespace, recorder: Recorder, i: int):
+    interview_start = time.perf_counter()
+    position = "Software Engineer"
+    if random.random() < args.new_job_titles:
+        position = f"Load Test Engineer {uuid.uuid4().hex[:8]}"
+    start = time.perf_counter()
+    response = await http.post(
+        "/setup",
+        data={
+            "name": f"Load Test {i}",
+            "position": position,
+            "years_of_experience": "3",
+            "interview_type": "Technical",
+            "interviewer_personality": "friendly",
+            "openai_api_key": args.api_key,
+            "enable_voice": str(args.voice).lower(),
+            "enable_streaming": str(args.streaming).lower(),
+            "audio_formats": args.audio_format,
+        },
+    )
+    response.raise_for_status()
+    recorder.record("setup", time.perf_counter() - start)
+    session_id = response.json()["session_id"]
+
+    ws_url = args.url.replace("http", "ws", 1) + f"/ws?session_id={session_id}"
+    async with websockets.connect(ws_url, max_size=None) as ws:
+        start = time.perf_counter()
+        await _receive_reply(ws, args.voice)
+        recorder.record("first_question", time.perf_counter() - start)
+
+        for _ in range(args.turns):
+            await ws.send(encode_binary_frame(FrameType.AUDIO, os.urandom(args.audio_bytes), {"format": "webm"}))
+            start = time.perf_counter()
+            timings = await _receive_reply(ws, args.voice, expect_user=True)
+            for stage, at in timings.items():
+                recorder.record(stage, at - start)
+
+    start = time.perf_counter()
+    response = await http.post("/diagnosis", json={"session_id": session_id}, timeout=args.timeout)
+    response.raise_for_status()
+    recorder.record("diagnosis", time.perf_counter() - start)
+    recorder.record("interview", time.perf_counter() - interview_start)
+
+
+async def _receive_reply(ws, voice: bool, expect_user: bool = False) -> dict[str, float]:
+    """Receive messages until the interviewer reply (and its audio) is complete, return when each stage ended."""
+    timings = {}
+    reply_done = audio_done = False
+    audio_started = False
+    while not (reply_done and (audio_done or not voice)):
+        message = await ws.recv()
+        now = time.perf_counter()
+        if isinstance(message, bytes):
+            continue
+        if message == "START_AUDIO":
+            audio_started = True
+            continue
+        if message == "END_AUDIO":
+            if audio_started:
+                timings["reply_audio"] = now
+                audio_done = True
+            continue
+        if message == "pong":
+            continue
+        data = json.loads(message)
+        if data.get("type") == "error":
+            raise RuntimeError(f"{data.get('request')} request failed: {data.get('content')}")
+        if data.get("type") == "user" and expect_user:
+            timings["transcription"] = now
+        elif data.get("type") in ("interviewer_delta", "interviewer"):
+            timings.setdefault("first_reply", now)
+            if data["type"] == "interviewer":
+                timings["reply"] = now
+                reply_done = True
+    return timings
+
+
+async def main(args: argparse.Namespace):
+    recorder = Recorder()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as http:
+
+        async def run(i: int):
+            async with semaphore:
+                try:
+                    await asyncio.wait_for(run_interview(http, args, recorder, i), args.timeout)
+                except Exception as e:
+                    recorder.errors[type(e).__name__] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(run(i) for i in range(args.interviews)))
+        elapsed = time.perf_counter() - start
+
+    print(recorder.report(elapsed))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="base URL of the app")
+    parser.add_argument("--interviews", type=int, default=20, help="number of interviews to run")
+    parser.add_argument("--concurrency", type=int, default=5, help="interviews running at once")
+    parser.add_argument("--turns", type=int, default=3, help="answers per interview")
+    parser.add_argument(
+        "--new-job-titles", type=float, default=0.1, help="share of interviews with a job title the app has to check"
+    )
+    parser.add_argument("--audio-bytes", type=int, default=64_000, help="size of each recorded answer")
+    parser.add_argument("--voice", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--streaming", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--audio-format", default="mp3", help="TTS output format to ask for: opus, pcm or mp3")
+    parser.add_argument("--api-key", default="sk-load-test", help="sent to /setup, the stub accepts any key")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds, per request and per interview")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,248 @@
+"""
+A local stand-in for the OpenAI API, for load tests that don't spend tokens.
+
+Serves the endpoints the app uses (models list, chat completions with and without streaming, responses,
+whisper transcription and TTS speech streaming) with configurable latency, token rate and audio size.
+A share of the requests can be rejected with 429 and a `Retry-After` header, to exercise the retries,
+and a share of the chat completions can be slowed down, to exercise the hedging of the interviewer calls.
+Point the app at it with `OPENAI_BASE_URL=http://127.0.0.1:8001/v1`.
+
+Usage:
+    python -m benchmarks.openai_stub --port 8001 --chat-latency 0.5 --tokens-per-second 50
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI()
+
+SETTINGS = argparse.Namespace(
+    chat_latency=0.5,
+    tokens_per_second=50.0,
+    completion_tokens=60,
+    stt_latency=0.5,
+    tts_latency=0.3,
+    audio_bytes=48_000,
+    audio_bytes_per_second=32_000,
+    rate_limit_rate=0.0,
+    retry_after=0.2,
+    chat_tail_rate=0.0,
+    chat_tail_latency=5.0,
+)
+
+REVIEW_RESULT = {
+    "score": "B+",
+    "the_chances_of_getting_this_job": 70,
+    "comments": "Stub comments.",
+    "what_to_improve": "Stub improvements.",
+}
+CHUNK_REVIEW = {"score": "B", "strengths": "Stub strengths.", "weaknesses": "Stub weaknesses."}
+SPEECH_MEDIA_TYPES = {"mp3": "audio/mpeg", "opus": "audio/ogg", "pcm": "audio/pcm"}
+
+
+@app.middleware("http")
+async def rate_limit(request: Request, call_next):
+    if random.random() < SETTINGS.rate_limit_rate:
+        return JSONResponse(
+            {"error": {"message": "Rate limit reached (stub).", "type": "requests", "code": "rate_limit_exceeded"}},
+            status_code=429,
+            headers={"retry-after": str(SETTINGS.retry_after)},
+        )
+    return await call_next(request)
+
+
+@app.get("/v1/models")
+async def list_models():
+    return {"object": "list", "data": [{"id": "stub-model", "object": "model", "created": 0, "owned_by": "stub"}]}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "stub-model")
+    tokens = _completion_tokens(body.get("messages", []))
+    latency = SETTINGS.chat_tail_latency if random.random() < SETTINGS.chat_tail_rate else SETTINGS.chat_latency
+    if not body.get("stream"):
+        await asyncio.sleep(latency + len(tokens) / SETTINGS.tokens_per_second)
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}
+            ],
+            "usage": _usage(tokens),
+        }
+
+    include_usage = (body.get("stream_options") or {}).get("include_usage")
+
+    async def stream():
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+        await asyncio.sleep(latency)
+        for i, token in enumerate(tokens):
+            delta = {"role": "assistant", "content": token} if i == 0 else {"content": token}
+            yield _sse(_chunk(chunk_id, model, [{"index": 0, "delta": delta, "finish_reason": None}]))
+            await asyncio.sleep(1 / SETTINGS.tokens_per_second)
+        yield _sse(_chunk(chunk_id, model, [{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if include_usage:
+            yield _sse(_chunk(chunk_id, model, [], usage=_usage(tokens)))
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@app.post("/v1/responses")
+async def responses(request: Request):
+    body = await request.json()
+    input_ = body.get("input", "")
+    messages = [{"role": "user", "content": input_}] if isinstance(input_, str) else list(input_)
+    if body.get("instructions"):
+        messages.insert(0, {"role": "system", "content": body["instructions"]})
+    tokens = _completion_tokens(messages)
+    await asyncio.sleep(SETTINGS.chat_latency + len(tokens) / SETTINGS.tokens_per_second)
+    return {
+        "id": f"resp_{uuid.uuid4().hex}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": body.get("model", "stub-model"),
+        "status": "completed",
+        "output": [
+            {
+                "id": f"msg_{uuid.uuid4().hex}",
+                "type": "message",
+                "role": "assistant",
+                "status": "completed",
+                "content": [{"type": "output_text", "text": "".join(tokens), "annotations": []}],
+            }
+        ],
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": [],
+        "usage": {
+            "input_tokens": 100,
+            "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens": len(tokens),
+            "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": 100 + len(tokens),
+        },
+    }
+
+
+@app.post("/v1/audio/transcriptions")
+async def transcriptions(request: Request):
+    form = await request.form()
+    file = form.get("file")
+    size = len(await file.read()) if file is not None else 0
+    await asyncio.sleep(SETTINGS.stt_latency)
+    return {"text": f"This is a transcribed stub answer of {size} bytes of audio."}
+
+
+@app.post("/v1/audio/speech")
+async def speech(request: Request):
+    body = await request.json()
+    format_ = body.get("response_format", "mp3")
+    frame = _audio_frame(format_)
+    audio = frame * (SETTINGS.audio_bytes // len(frame) + 1)
+
+    async def stream():
+        await asyncio.sleep(SETTINGS.tts_latency)
+        # fixed-size chunks that ignore the frame boundaries, like a real network stream.
+        chunk_size = 4096
+        sent = 0
+        while sent < SETTINGS.audio_bytes:
+            size = min(chunk_size, SETTINGS.audio_bytes - sent)
+            yield audio[sent : sent + size]
+            sent += size
+            await asyncio.sleep(size / SETTINGS.audio_bytes_per_second)
+
+    return StreamingResponse(stream(), media_type=SPEECH_MEDIA_TYPES.get(format_, "application/octet-stream"))
+
+
+def _completion_tokens(messages: list[dict]) -> list[str]:
+    system_prompt = " ".join(str(m.get("content")) for m in messages if m.get("role") in ("system", "developer"))
+    user_prompt = " ".join(str(m.get("content")) for m in messages if m.get("role") == "user")
+    if "a job title?" in user_prompt:
+        # the job title check of `/setup`, see `utils.acheck_job_title_valid`.
+        return ["1"]
+    if '"the_chances_of_getting_this_job"' in system_prompt:
+        return _split(json.dumps(REVIEW_RESULT))
+    if '"strengths"' in system_prompt:
+        return _split(json.dumps(CHUNK_REVIEW))
+    words = ["Thanks", " for", " sharing.", " Could", " you", " tell", " me", " more", " about", " that?"]
+    return [words[i % len(words)] for i in range(SETTINGS.completion_tokens)]
+
+
+def _audio_frame(format_: str) -> bytes:
+    """A silent-ish frame with a valid header: an MP3 frame (128 kbps, 44.1 kHz), an Ogg page, or PCM samples."""
+    if format_ == "mp3":
+        return b"\xff\xfb\x90\x64" + os.urandom(413)
+    if format_ == "opus":
+        body = os.urandom(200)
+        return b"OggS\x00\x00" + bytes(20) + bytes([1, len(body)]) + body
+    return os.urandom(960)
+
+
+def _split(text: str, size: int = 4) -> list[str]:
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+def _usage(tokens: list[str]) -> dict:
+    return {"prompt_tokens": 100, "completion_tokens": len(tokens), "total_tokens": 100 + len(tokens)}
+
+
+def _chunk(chunk_id: str, model: str, choices: list[dict], usage: dict | None = None) -> dict:
+    chunk = {
+        "id": chunk_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": choices,
+    }
+    if usage is not None:
+        chunk["usage"] = usage
+    return chunk
+
+
+def _sse(data: dict) -> str:
+    return f"data: {json.dumps(data)}\n\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--chat-latency", type=float, default=SETTINGS.chat_latency, help="seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=SETTINGS.tokens_per_second)
+    parser.add_argument("--completion-tokens", type=int, default=SETTINGS.completion_tokens)
+    parser.add_argument("--stt-latency", type=float, default=SETTINGS.stt_latency)
+    parser.add_argument("--tts-latency", type=float, default=SETTINGS.tts_latency)
+    parser.add_argument("--audio-bytes", type=int, default=SETTINGS.audio_bytes, help="TTS audio size per request")
+    parser.add_argument("--audio-bytes-per-second", type=int, default=SETTINGS.audio_bytes_per_second)
+    parser.add_argument(
+        "--rate-limit-rate", type=float, default=SETTINGS.rate_limit_rate, help="share of requests rejected with 429"
+    )
+    parser.add_argument("--retry-after", type=float, default=SETTINGS.retry_after, help="Retry-After of the 429s")
+    parser.add_argument(
+        "--chat-tail-rate", type=float, default=SETTINGS.chat_tail_rate, help="share of slow chat completions"
+    )
+    parser.add_argument(
+        "--chat-tail-latency", type=float, default=SETTINGS.chat_tail_latency, help="seconds to first token, when slow"
+    )
+    args = parser.parse_args()
+    for key, value in vars(args).items():
+        setattr(SETTINGS, key, value)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Check that several worker processes can share the SQLite session backend, as with `uvicorn --workers N`.
+
+Each worker process starts its own `SQLiteSessionBackend` on the same database and runs many sessions at
+once, each going through the writes of an interview: config, transcript, checkpoints, reply audio, tutor
+output, turn reviews, activity updates and, for some of them, deletion. The check fails when a write
+fails (e.g. "database is locked"), when a transcript lost or duplicated messages, or when the database
+files are readable by others.
+
+Usage:
+    python -m benchmarks.sqlite_workers --workers 3 --sessions 50 --turns 5
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import stat
+import sys
+import tempfile
+import time
+import uuid
+from operator import add
+from typing import Annotated, TypedDict
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.graph import StateGraph
+
+from ai_mock_interview.backends import SQLiteSessionBackend
+
+
+class _State(TypedDict):
+    turns: Annotated[list[str], add]
+
+
+async def run_worker(path: str, worker: int, args: argparse.Namespace) -> tuple[int, list[str]]:
+    """Run the sessions of a worker, return how many of them are kept and the errors."""
+    backend = SQLiteSessionBackend(path)
+    await backend.start()
+    builder = StateGraph(_State)
+    builder.add_node("turn", lambda state: {"turns": ["answered"]})
+    builder.set_entry_point("turn")
+    graph = builder.compile(checkpointer=backend.checkpointer)
+    errors = []
+
+    async def run_session(i: int) -> bool:
+        session_id = f"{worker}-{i}-{uuid.uuid4().hex[:8]}"
+        await backend.save_config(session_id, {"name": f"Worker {worker}", "openai_api_key": "sk-test"})
+        for turn in range(args.turns):
+            await backend.append_messages(session_id, [HumanMessage(f"answer {turn}"), AIMessage(f"question {turn}")])
+            await graph.ainvoke({"turns": [f"answer {turn}"]}, {"configurable": {"thread_id": session_id}})
+            await backend.save_reply_audio(session_id, 2 * turn + 1, {"format": "mp3", "sentences": ["Hi."]})
+            await backend.save_tutor_output(session_id, turn, "grammar_check", "Fine.")
+            await backend.save_turn_review(session_id, turn, {"score": "B"})
+            await backend.touch(session_id)
+            await backend.expired(3600)
+        if i % 5 == 0:
+            await backend.delete(session_id)
+            return False
+        messages = await backend.load_messages(session_id)
+        if [m.text for m in messages[::2]] != [f"answer {turn}" for turn in range(args.turns)]:
+            errors.append(f"{session_id}: {len(messages)} messages, expected {2 * args.turns}")
+        return True
+
+    results = await asyncio.gather(*(run_session(i) for i in range(args.sessions)), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            errors.append(f"{type(result).__name__}: {result}")
+    await backend.close()
+    return sum(1 for result in results if result is True), errors
+
+
+def worker_main(path: str, worker: int, args: argparse.Namespace, results):
+    results.put((worker, *asyncio.run(run_worker(path, worker, args))))
+
+
+def main(args: argparse.Namespace) -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sessions.sqlite3")
+        # the workers of uvicorn are separate processes, without anything inherited from the parent.
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        start = time.perf_counter()
+        processes = [
+            context.Process(target=worker_main, args=(path, worker, args, results)) for worker in range(args.workers)
+        ]
+        for process in processes:
+            process.start()
+        outcomes = [results.get(timeout=args.timeout) for _ in processes]
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        errors = [f"worker {worker}: {error}" for worker, _, worker_errors in outcomes for error in worker_errors]
+        errors += [f"worker process exited with {p.exitcode}" for p in processes if p.exitcode]
+        for file_path in (path, f"{path}-wal", f"{path}-shm"):
+            if os.path.exists(file_path) and os.stat(file_path).st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+                errors.append(f"{file_path} is accessible by others: {oct(os.stat(file_path).st_mode & 0o777)}")
+
+    kept = sum(count for _, count, _ in outcomes)
+    print(f"workers: {args.workers}, sessions: {args.workers * args.sessions} ({kept} kept), elapsed: {elapsed:.1f} s")
+    for error in errors[:20]:
+        print(error)
+    print(f"errors: {len(errors)}")
+    return 1 if errors else 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=3, help="worker processes sharing the database")
+    parser.add_argument("--sessions", type=int, default=50, help="sessions run at once by each worker")
+    parser.add_argument("--turns", type=int, default=5, help="turns per session")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds to wait for each worker")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))